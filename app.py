@@ -1,6 +1,9 @@
+import time
+RUN_START = time.perf_counter()
+
 import streamlit as st
-from utils.db_conn import SessionLocal
-from db.models import User
+from utils.auth import authenticate
+from utils.metrics import record, span
 
 st.set_page_config(page_title="Attendance System", layout="centered")
 
@@ -50,27 +53,33 @@ def login():
         submit_button = st.button("Log In", use_container_width=True, type="primary")
 
         if submit_button:
-            db = SessionLocal()
-            user = db.query(User).filter(User.username==username, User.password==password).first()
-            db.close()
+            with span("login"):
+                user = authenticate(username, password)
             if user:
-                st.session_state["user"] = {
-                    "id": user.id,
-                    "username": user.username,
-                    "role": user.role
-                }
+                st.session_state["user"] = user
                 st.rerun()
             else:
                 st.error("Invalid credentials. Please try again.")
 
+# Runs once per server process: the first script run pays for every import
+@st.cache_resource
+def record_cold_start():
+    cold_start_ms = (time.perf_counter() - RUN_START) * 1000
+    record("cold_start", cold_start_ms)
+    print(f"Cold start: {cold_start_ms:.0f} ms")
+    return cold_start_ms
+
+
 def main():
     add_custom_css()
     
-    if "user" not in st.session_state:
-        login()
-    else:
-        role = st.session_state["user"]["role"]
-        if role == "admin":
+    # Each dashboard is imported only for its role; the face pipeline
+    # imports its heavy dependencies on first use
+    role = st.session_state["user"]["role"] if "user" in st.session_state else "login"
+    with span("page_load", role=role):
+        if role == "login":
+            login()
+        elif role == "admin":
             import pages.admin_dashboard as admin_page
             admin_page.main()
         elif role == "faculty":
@@ -81,6 +90,7 @@ def main():
             student_page.main()
         else:
             st.error("Unknown role")
+    record_cold_start()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,15 @@
+# archive_csvs.py
+# One-time import of the per-session CSVs in attendance_csvs/ into the
+# columnar archive, then compaction to one file per day. Identical copies
+# ("... (1).csv") are imported once, sessions the app archived when it
+# recorded them are skipped, and re-running skips what is archived.
+from utils.db_conn import session_scope
+from utils.face_utils import CSV_DIR
+from utils.attendance_archive import import_csv_dir, compact_archive
+
+with session_scope() as db:
+    imported, duplicates, unreadable = import_csv_dir(CSV_DIR, db)
+for file_name, error in unreadable:
+    print(f"⚠️  Skipped {file_name}: {error}")
+removed = compact_archive()
+print(f"✅ Archived {imported} CSV files ({duplicates} duplicates skipped), compacted away {removed} files")
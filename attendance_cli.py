@@ -0,0 +1,136 @@
+# attendance_cli.py
+# Processes classroom photos without the Streamlit UI, e.g. a backlog of
+# sessions or a scheduled cron run. Records and CSVs are written exactly as
+# the faculty page writes them.
+#
+# Photos are grouped into sessions in one of three ways:
+#   python attendance_cli.py photos/                    # photos/<class>/<session>/*.jpg
+#   python attendance_cli.py photos/ --manifest runs.csv  # photo,session_name,class_name rows
+#   python attendance_cli.py photos/ --class CS101 --session "Lecture 1"
+#
+# Session folders may also hold short classroom videos (.mp4, .mov, ...), and
+# a single session can be taken live from a local camera:
+#   python attendance_cli.py --camera 0 --seconds 60 --class CS101 --session "Lecture 1"
+import os
+import csv
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from utils.db_conn import session_scope, create_tables
+from utils.face_utils import record_attendance, CSV_DIR, MATCH_MODES
+from utils.video_attendance import encode_session_media, list_session_media
+from utils.metrics import tagged, stage_summaries
+
+
+def sessions_from_tree(directory):
+    # {(session_name, class_name): [photo paths]}
+    sessions = {}
+    for class_name in sorted(os.listdir(directory)):
+        class_dir = os.path.join(directory, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for session_name in sorted(os.listdir(class_dir)):
+            photos = list_session_media(os.path.join(class_dir, session_name))
+            if photos:
+                sessions[(session_name, class_name)] = photos
+    return sessions
+
+
+def sessions_from_manifest(directory, manifest_path):
+    sessions = {}
+    with open(manifest_path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            key = (row["session_name"].strip(), row["class_name"].strip())
+            sessions.setdefault(key, []).append(os.path.join(directory, row["photo"].strip()))
+    return sessions
+
+
+def process_session(encoder, session_name, class_name, photos, mode, max_seconds=None):
+    # Runs in a session thread; the CPU-heavy encoding goes to the process pool
+    with tagged(session=session_name, class_name=class_name):
+        per_photo = encode_session_media(photos, pool=encoder, max_seconds=max_seconds)
+    with session_scope() as db:
+        csv_path, _, visitors = record_attendance(
+            db, session_name, class_name, photos, mode=mode, per_photo=per_photo
+        )
+    return csv_path, sum(len(faces) for faces in per_photo), visitors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mark attendance from classroom photos.")
+    parser.add_argument("directory", nargs="?", help="directory of group photos and videos")
+    parser.add_argument("--manifest", help="CSV with photo,session_name,class_name columns")
+    parser.add_argument("--class", dest="class_name", help="class of a single session (with --session)")
+    parser.add_argument("--session", dest="session_name", help="name of a single session (with --class)")
+    parser.add_argument("--mode", choices=MATCH_MODES, default="assignment",
+                        help="assignment credits each face to at most one student (default)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="photos encoded in parallel (default: CPU count)")
+    parser.add_argument("--camera", type=int, help="record a single session from this camera index")
+    parser.add_argument("--seconds", type=float,
+                        help="how long to watch the camera (default: 60), or how much of each video to use")
+    args = parser.parse_args()
+
+    if bool(args.class_name) != bool(args.session_name):
+        parser.error("--class and --session must be given together")
+    if (args.camera is None) == (args.directory is None):
+        parser.error("give either a directory or --camera")
+    if args.camera is not None:
+        if not args.class_name:
+            parser.error("--camera needs --class and --session")
+        sessions = {(args.session_name, args.class_name): [args.camera]}
+        args.seconds = args.seconds or 60.0
+    elif args.class_name:
+        sessions = {(args.session_name, args.class_name): list_session_media(args.directory)}
+    elif args.manifest:
+        sessions = sessions_from_manifest(args.directory, args.manifest)
+    else:
+        sessions = sessions_from_tree(args.directory)
+    sessions = {key: photos for key, photos in sessions.items() if photos}
+    if not sessions:
+        sys.exit("No photos or videos found.")
+
+    create_tables()
+    os.makedirs(CSV_DIR, exist_ok=True)
+    workers = max(1, args.workers)
+    photo_count = sum(len(photos) for photos in sessions.values())
+    print(f"Processing {photo_count} photo(s) in {len(sessions)} session(s) with {workers} worker(s)")
+
+    face_count = 0
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as encoder, \
+            ThreadPoolExecutor(max_workers=workers) as runner:
+        futures = {
+            runner.submit(process_session, encoder, session_name, class_name, photos, args.mode, args.seconds):
+                (session_name, class_name)
+            for (session_name, class_name), photos in sessions.items()
+        }
+        for future in as_completed(futures):
+            session_name, class_name = futures[future]
+            try:
+                csv_path, faces, visitors = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"❌ {class_name} / {session_name}: {e}")
+                continue
+            face_count += faces
+            print(f"✅ {class_name} / {session_name}: {faces} face(s) -> {csv_path}")
+            for v in visitors:
+                print(f"   ⚠️  {v['name']} ({v['roll_no']}) from {v['class_name']} was also recognised")
+
+    elapsed = time.perf_counter() - start
+    print(f"Done in {elapsed:.1f}s: {photo_count / elapsed:.2f} photos/s, {face_count / elapsed:.2f} faces/s"
+          + (f", {failed} session(s) failed" if failed else ""))
+    for stage, s in stage_summaries().items():
+        print(f"  {stage:<18} n={s['count']:<5} p50 {s['p50_ms']:8.1f} ms  p95 {s['p95_ms']:8.1f} ms  "
+              f"p99 {s['p99_ms']:8.1f} ms")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# bench_attendance_write.py
+# Compares the old per-object attendance write path with the bulk insert
+# used by mark_attendance. Run from the repository root:
+#   python -m benchmarks.bench_attendance_write [--url sqlite:///bench.db] [--sizes 50 500 5000]
+import os
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from db.models import Base, Student, AttendanceSession, AttendanceRecord, StudentAttendanceStat
+from utils.face_utils import save_attendance
+
+
+def seed_class(db, class_name, size):
+    db.execute(
+        insert(Student),
+        [
+            {"name": f"Student {i}", "roll_no": f"{class_name}-{i:05d}", "class_name": class_name}
+            for i in range(size)
+        ]
+    )
+    db.commit()
+    students = db.query(Student).filter(Student.class_name == class_name).all()
+    attendance = {s.id: "Present" if s.id % 3 else "Absent" for s in students}
+    confidence = {sid: 0.6 if status == "Present" else None for sid, status in attendance.items()}
+    return attendance, confidence
+
+
+# The write path mark_attendance used before the bulk insert
+def legacy_write(db, session_name, class_name, attendance, confidence):
+    session = AttendanceSession(session_name=session_name, class_name=class_name)
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+
+    for student_id, status in attendance.items():
+        db.add(AttendanceRecord(
+            session_id=session.id,
+            student_id=student_id,
+            status=status,
+            confidence=confidence[student_id]
+        ))
+    db.commit()
+
+    students = db.query(Student).filter(Student.id.in_(attendance.keys())).all()
+    session.csv_path = f"{session.timestamp.date()}_{session_name}_{class_name}.csv"
+    db.commit()
+    return len(students)
+
+
+def bulk_write(db, session_name, class_name, attendance, confidence):
+    save_attendance(db, session_name, class_name, attendance, confidence, datetime.utcnow(),
+                    f"{datetime.utcnow().date()}_{session_name}_{class_name}.csv")
+    db.commit()
+
+
+def time_it(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the attendance DB write path")
+    parser.add_argument("--url", help="Database URL (default: a temporary SQLite file)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    url = args.url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+    print(f"{'students':>10} {'legacy (ms)':>12} {'bulk (ms)':>10} {'speedup':>8}")
+
+    for size in args.sizes:
+        db = Session()
+        class_name = f"BENCH{size}"
+        attendance, confidence = seed_class(db, class_name, size)
+
+        legacy = time_it(lambda: legacy_write(db, "legacy", class_name, attendance, confidence), args.repeat)
+        bulk = time_it(lambda: bulk_write(db, "bulk", class_name, attendance, confidence), args.repeat)
+        db.close()
+
+        print(f"{size:>10} {legacy * 1000:>12.1f} {bulk * 1000:>10.1f} {legacy / bulk:>7.1f}x")
+        cleanup(Session, class_name)
+
+
+def cleanup(Session, class_name):
+    db = Session()
+    session_ids = db.query(AttendanceSession.id).filter(AttendanceSession.class_name == class_name)
+    db.query(AttendanceRecord).filter(AttendanceRecord.session_id.in_(session_ids)).delete(synchronize_session=False)
+    db.query(AttendanceSession).filter(AttendanceSession.class_name == class_name).delete(synchronize_session=False)
+    # save_attendance also keeps the per-student totals
+    student_ids = db.query(Student.id).filter(Student.class_name == class_name)
+    db.query(StudentAttendanceStat).filter(
+        StudentAttendanceStat.student_id.in_(student_ids)
+    ).delete(synchronize_session=False)
+    db.query(Student).filter(Student.class_name == class_name).delete(synchronize_session=False)
+    db.commit()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
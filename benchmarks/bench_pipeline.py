@@ -0,0 +1,363 @@
+# bench_pipeline.py
+# Times each stage of the attendance pipeline separately (detection,
+# encoding, encoding store read, matching, DB write, CSV export) on synthetic
+# classes and a temporary SQLite database, offline and on CPU only. Run from the
+# repository root:
+#   python -m benchmarks.bench_pipeline [--class-size 60] [--classes 20] [--json out.json]
+#   python -m benchmarks.bench_pipeline --json new.json --compare old.json
+#   python -m benchmarks.bench_pipeline --images student_images
+# --images times the real face pipeline end to end on the enrollment photos
+# in that folder (one sub-folder per student), tiled into a group photo.
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from db.models import Base, Student, FaceEncoding
+from utils.class_cache import ClassEmbeddings, class_cache
+from utils.face_utils import (
+    ENCODING_SIZE, CSV_DIR, detect_faces, face_crop, encode_group_image, encode_student_image,
+    encoding_to_bytes, encoding_from_bytes, load_encoding_rows, build_class_matrix, match_encodings,
+    save_attendance, attendance_rows, attendance_csv_bytes, record_attendance,
+    list_student_images, sync_student_encodings
+)
+
+# Synthetic embeddings: one random unit-norm identity per student, enrollment
+# and group-photo faces are that identity plus noise. With these scales
+# same-person distances land around 0.3 and strangers around 1.4, like
+# real 128-d face embeddings against the 0.5 tolerance.
+IMAGES_PER_STUDENT = 5
+ENROLL_NOISE = 0.02
+PHOTO_NOISE = 0.02
+PRESENT_RATE = 0.8
+STRANGERS_PER_PHOTO = 3
+PHOTO_SIZE = (4000, 3000)
+FACE_SIDE = 160
+
+# A stage regresses when it is slower than the baseline by more than this
+REGRESSION_THRESHOLD = 0.10
+
+
+def timed(fn, repeat):
+    # (best, median) wall time in milliseconds
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"best_ms": round(min(timings), 3), "median_ms": round(statistics.median(timings), 3)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------------------------
+# SYNTHETIC FIXTURES
+# ---------------------------
+def synthetic_identities(rng, n):
+    identities = rng.normal(size=(n, ENCODING_SIZE))
+    return identities / np.linalg.norm(identities, axis=1, keepdims=True)
+
+
+def synthetic_enrollment(rng, identities):
+    # {student index: [encodings]}
+    return {
+        i: list(identity + rng.normal(scale=ENROLL_NOISE, size=(IMAGES_PER_STUDENT, ENCODING_SIZE)))
+        for i, identity in enumerate(identities)
+    }
+
+
+def synthetic_photos(rng, identities, n_photos):
+    present = np.flatnonzero(rng.random(len(identities)) < PRESENT_RATE)
+    per_photo = []
+    for chunk in np.array_split(present, n_photos):
+        faces = identities[chunk] + rng.normal(scale=PHOTO_NOISE, size=(len(chunk), ENCODING_SIZE))
+        strangers = synthetic_identities(rng, STRANGERS_PER_PHOTO)
+        per_photo.append(np.vstack([faces, strangers]))
+    return per_photo
+
+
+def synthetic_photo_file(rng, folder):
+    # Noise rather than faces: detection still scans the whole photo, which
+    # is the cost that dominates a real group photo, but finds nothing in it
+    path = os.path.join(folder, "group.jpg")
+    pixels = rng.integers(0, 256, size=(PHOTO_SIZE[1], PHOTO_SIZE[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, quality=90)
+    return path
+
+
+def synthetic_face_boxes(n_faces):
+    # (top, right, bottom, left) of n_faces FACE_SIDE squares spread over the
+    # photo on a grid, standing in for what detection would have found
+    columns = int(np.ceil(np.sqrt(n_faces * PHOTO_SIZE[0] / PHOTO_SIZE[1])))
+    rows = int(np.ceil(n_faces / columns))
+    cell_w, cell_h = PHOTO_SIZE[0] // columns, PHOTO_SIZE[1] // rows
+    side = min(FACE_SIDE, cell_w // 2, cell_h // 2)
+    boxes = []
+    for i in range(n_faces):
+        left = (i % columns) * cell_w + (cell_w - side) // 2
+        top = (i // columns) * cell_h + (cell_h - side) // 2
+        boxes.append((top, left + side, top + side, left))
+    return boxes
+
+
+def seed_database(db, n_classes, class_size, encodings):
+    # Students of every class plus their stored encodings. Returns the
+    # student objects of the first class.
+    db.execute(insert(Student), [
+        {"name": f"Student {c}-{i}", "roll_no": f"C{c:03d}-{i:05d}", "class_name": f"C{c:03d}"}
+        for c in range(n_classes)
+        for i in range(class_size)
+    ])
+    students = db.query(Student).order_by(Student.id).all()
+    db.execute(insert(FaceEncoding), [
+        {
+            "student_id": s.id, "file_name": f"{k}.jpg", "image_hash": f"{s.id:032d}{k:032d}",
+            "file_size": 0, "file_mtime": 0, "encoding": encoding_to_bytes(e)
+        }
+        for n, s in enumerate(students)
+        for k, e in enumerate(encodings[n % class_size])
+    ])
+    db.commit()
+    return students[:class_size]
+
+
+# ---------------------------
+# SYNTHETIC RUN
+# ---------------------------
+def run_synthetic(args, workdir):
+    rng = np.random.default_rng(args.seed)
+    identities = synthetic_identities(rng, args.class_size)
+    enrollment = synthetic_enrollment(rng, identities)
+    per_photo = synthetic_photos(rng, identities, args.photos)
+
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    students = seed_database(db, args.classes, args.class_size, enrollment)
+    student_ids = [s.id for s in students]
+
+    photo_path = synthetic_photo_file(rng, workdir)
+    results = {}
+
+    # Detection finds no face in the noise, so the encoder is timed on its
+    # own at the face locations of the busiest synthetic photo; encoding cost
+    # does not depend on what the pixels show. Matching below then runs on
+    # the synthetic encodings of those faces.
+    # Imported here like in face_utils: dlib takes seconds to load.
+    import face_recognition
+
+    results["detect group photo"] = timed(lambda: detect_faces(photo_path), args.photo_repeat)
+
+    full = Image.open(photo_path).convert("RGB")
+    boxes = synthetic_face_boxes(max(len(faces) for faces in per_photo))
+
+    def encode_faces():
+        for box in boxes:
+            crop, location = face_crop(full, box)
+            face_recognition.face_encodings(crop, known_face_locations=[location])
+    results["encode group photo faces"] = timed(encode_faces, args.photo_repeat)
+    print(f"Encoding {len(boxes)} faces per group photo")
+
+    def read_store():
+        rows = load_encoding_rows(db, student_ids)
+        return {sid: [encoding_from_bytes(r.encoding) for r in rows[sid]] for sid in student_ids}
+    results["encoding store read"] = timed(read_store, args.repeat)
+
+    encodings_by_student = read_store()
+    results["class matrix build"] = timed(
+        lambda: build_class_matrix(students, encodings_by_student), args.repeat
+    )
+    matrix, owners = build_class_matrix(students, encodings_by_student)
+    class_embeddings = ClassEmbeddings(
+        student_ids=student_ids,
+        names=[s.name for s in students],
+        roll_nos=[s.roll_no for s in students],
+        matrix=matrix,
+        owners=owners
+    )
+
+    for mode in ("independent", "assignment"):
+        results[f"match ({mode})"] = timed(
+            lambda: match_encodings(per_photo, class_embeddings, mode=mode), args.repeat
+        )
+    attendance, confidence, _ = match_encodings(per_photo, class_embeddings, mode="assignment")
+
+    def write():
+        save_attendance(db, "bench", students[0].class_name, attendance, confidence, datetime.utcnow())
+        db.commit()
+    results["db write"] = timed(write, args.repeat)
+
+    results["csv export"] = timed(
+        lambda: attendance_csv_bytes(attendance_rows(class_embeddings, attendance, confidence)), args.repeat
+    )
+
+    db.close()
+    engine.dispose()
+    return results
+
+
+# ---------------------------
+# SAMPLE-IMAGE RUN
+# ---------------------------
+def tile_group_photo(img_paths, path, cell=400):
+    columns = int(np.ceil(np.sqrt(len(img_paths))))
+    rows = int(np.ceil(len(img_paths) / columns))
+    canvas = Image.new("RGB", (columns * cell, rows * cell), "white")
+    for i, img_path in enumerate(img_paths):
+        img = Image.open(img_path).convert("RGB")
+        img.thumbnail((cell, cell))
+        canvas.paste(img, ((i % columns) * cell, (i // columns) * cell))
+    canvas.save(path, quality=90)
+    return path
+
+
+def run_sample_images(args, workdir):
+    folders = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images)
+        if list_student_images(os.path.join(args.images, name))
+    )
+    if not folders:
+        sys.exit(f"No student image folders in {args.images}")
+
+    # Work on copies so the real fixtures and their encodings stay untouched
+    copies = []
+    for folder in folders:
+        copy = os.path.join(workdir, "students", os.path.basename(folder))
+        shutil.copytree(folder, copy)
+        copies.append(os.path.abspath(copy))
+    all_images = [p for folder in copies for p in list_student_images(folder)]
+
+    results = {}
+    results["encode one enrollment image"] = timed(lambda: encode_student_image(all_images[0]), args.photo_repeat)
+
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    db.execute(insert(Student), [
+        {"name": os.path.basename(f), "roll_no": os.path.basename(f), "class_name": "SAMPLE", "images_path": f}
+        for f in copies
+    ])
+    db.commit()
+    students = db.query(Student).all()
+
+    start = time.perf_counter()
+    for student in students:
+        sync_student_encodings(db, student)
+    elapsed = round((time.perf_counter() - start) * 1000, 3)
+    results["enroll every student"] = {"best_ms": elapsed, "median_ms": elapsed}
+
+    # First image of every student tiled into one classroom photo
+    group_path = tile_group_photo([list_student_images(f)[0] for f in copies],
+                                  os.path.join(workdir, "group.jpg"))
+    results["detect + encode group photo"] = timed(lambda: encode_group_image(group_path), args.photo_repeat)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs(CSV_DIR, exist_ok=True)
+    try:
+        def end_to_end():
+            class_cache.invalidate("SAMPLE")
+            record_attendance(db, "bench", "SAMPLE", [group_path], mode="assignment")
+        results["record attendance end to end"] = timed(end_to_end, args.photo_repeat)
+    finally:
+        os.chdir(cwd)
+
+    print(f"Sample images: {len(copies)} students, {len(all_images)} enrollment images")
+    db.close()
+    engine.dispose()
+    return results
+
+
+# ---------------------------
+# REPORT
+# ---------------------------
+def compare(results, baseline_path):
+    # Prints the change against a previous JSON run; returns the stages that
+    # regressed beyond REGRESSION_THRESHOLD
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit') or 'unknown'}):")
+    print(f"{'stage':<32} {'before (ms)':>12} {'after (ms)':>11} {'change':>8}")
+
+    regressions = []
+    for stage, timing in results.items():
+        before = baseline["results"].get(stage)
+        if before is None:
+            print(f"{stage:<32} {'-':>12} {timing['best_ms']:>11.2f} {'new':>8}")
+            continue
+        change = timing["best_ms"] / before["best_ms"] - 1 if before["best_ms"] else 0.0
+        flag = "  <-- slower" if change > REGRESSION_THRESHOLD else ""
+        print(f"{stage:<32} {before['best_ms']:>12.2f} {timing['best_ms']:>11.2f} {change:>+7.0%}{flag}")
+        if flag:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the face pipeline and DB write path")
+    parser.add_argument("--classes", type=int, default=20, help="classes seeded into the database")
+    parser.add_argument("--class-size", type=int, default=60, help="students per class")
+    parser.add_argument("--photos", type=int, default=3, help="group photos per session")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--photo-repeat", type=int, default=3, help="repeats of the slow image stages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--images", help="time the real pipeline on this folder of student images")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="previous --json output to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        if args.images:
+            config = {"mode": "images", "images": args.images}
+            results = run_sample_images(args, workdir)
+        else:
+            config = {"mode": "synthetic", "classes": args.classes, "class_size": args.class_size,
+                      "photos": args.photos, "seed": args.seed}
+            results = run_synthetic(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'stage':<32} {'best (ms)':>10} {'median (ms)':>12}")
+    for stage, timing in results.items():
+        print(f"{stage:<32} {timing['best_ms']:>10.2f} {timing['median_ms']:>12.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "config": config,
+                "results": results,
+            }, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+    if args.compare and compare(results, args.compare):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# bench_queries.py
+# Seeds a synthetic attendance database and times the dashboards' hot
+# queries without and with the schema's secondary indexes, with the
+# backend's EXPLAIN plan of each query in both states. Run from the
+# repository root:
+#   python -m benchmarks.bench_queries [--students 10000] [--records 1000000] [--url ...]
+# --url must point at a scratch database: every table of the schema is
+# dropped.
+import os
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, select, func, and_, text
+from sqlalchemy.orm import sessionmaker
+
+from db.models import Base, User, Student, AttendanceSession, AttendanceRecord
+
+CLASS_SIZE = 100
+CHUNK = 50000
+
+SECONDARY_INDEXES = (
+    "ix_students_class_name",
+    "ix_students_user_id",
+    "ix_attendance_sessions_class_timestamp",
+    "ux_attendance_records_session_student",
+    "ix_attendance_records_student_id",
+)
+
+
+def seed(engine, n_students, n_records):
+    n_classes = max(1, n_students // CLASS_SIZE)
+    sessions_per_class = max(1, n_records // n_students)
+    start = datetime(2025, 1, 1, 9, 0)
+
+    with engine.begin() as conn:
+        # students.user_id is a foreign key, so every student gets a user
+        conn.execute(insert(User), [
+            {"id": i + 1, "username": f"student{i:06d}", "password": "-", "role": "student"}
+            for i in range(n_students)
+        ])
+        conn.execute(insert(Student), [
+            {"name": f"Student {i}", "roll_no": f"R{i:06d}", "class_name": f"C{i % n_classes:04d}", "user_id": i + 1}
+            for i in range(n_students)
+        ])
+        conn.execute(insert(AttendanceSession), [
+            {
+                "session_name": f"Lecture {s}",
+                "class_name": f"C{c:04d}",
+                "timestamp": start + timedelta(days=s, minutes=c)
+            }
+            for c in range(n_classes)
+            for s in range(sessions_per_class)
+        ])
+
+    with engine.connect() as conn:
+        students_by_class = {}
+        for sid, class_name in conn.execute(select(Student.id, Student.class_name)):
+            students_by_class.setdefault(class_name, []).append(sid)
+        sessions = conn.execute(select(AttendanceSession.id, AttendanceSession.class_name)).all()
+
+    rows = []
+    total = 0
+    with engine.begin() as conn:
+        for session_id, class_name in sessions:
+            for student_id in students_by_class.get(class_name, []):
+                rows.append({
+                    "session_id": session_id,
+                    "student_id": student_id,
+                    "status": "Present" if random.random() < 0.8 else "Absent"
+                })
+                if len(rows) >= CHUNK:
+                    conn.execute(insert(AttendanceRecord), rows)
+                    total += len(rows)
+                    rows = []
+        if rows:
+            conn.execute(insert(AttendanceRecord), rows)
+            total += len(rows)
+
+    return n_classes, len(sessions), total
+
+
+# The queries the dashboards and the matcher run on every page load
+def dashboard_queries(db, class_name, student, session_id):
+    return {
+        "students of class (matcher)": db.query(Student).filter(Student.class_name == class_name),
+        "student by user (student page)": db.query(Student).filter(Student.user_id == student.user_id).limit(1),
+        "history page (student page)": (
+            db.query(AttendanceSession.id, AttendanceSession.timestamp, AttendanceRecord.status)
+            .outerjoin(AttendanceRecord, and_(
+                AttendanceRecord.session_id == AttendanceSession.id,
+                AttendanceRecord.student_id == student.id
+            ))
+            .filter(AttendanceSession.class_name == class_name)
+            .order_by(AttendanceSession.timestamp.desc())
+            .limit(20)
+        ),
+        "history count (student page)": (
+            db.query(func.count(AttendanceSession.id)).filter(AttendanceSession.class_name == class_name)
+        ),
+        "records of session": db.query(AttendanceRecord).filter(AttendanceRecord.session_id == session_id),
+        "records of student": (
+            db.query(func.count(AttendanceRecord.id)).filter(AttendanceRecord.student_id == student.id)
+        ),
+    }
+
+
+def run(db, queries, repeat):
+    timings = {}
+    for name, query in queries.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query.all()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    return timings
+
+
+def explain(engine, queries):
+    # {query name: plan lines} from the backend's own EXPLAIN
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    plans = {}
+    with engine.connect() as conn:
+        for name, query in queries.items():
+            sql = str(query.statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            rows = conn.execute(text(prefix + sql)).all()
+            if engine.dialect.name == "sqlite":
+                # (id, parent, notused, detail)
+                plans[name] = [row[-1] for row in rows]
+            else:
+                plans[name] = [" | ".join("" if v is None else str(v) for v in row) for row in rows]
+    return plans
+
+
+def print_plans(title, plans):
+    print(f"\n{title}")
+    for name, lines in plans.items():
+        print(f"  {name}")
+        for line in lines:
+            print(f"    {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard queries with and without indexes")
+    parser.add_argument("--url", help="Scratch database URL (default: a temporary SQLite file)")
+    parser.add_argument("--students", type=int, default=10000)
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    url = args.url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    engine = create_engine(url)
+    tables = [User.__table__, Student.__table__, AttendanceSession.__table__, AttendanceRecord.__table__]
+    # The whole schema, in dependency order: on MySQL the other tables'
+    # foreign keys to students would block dropping it alone
+    Base.metadata.drop_all(bind=engine)
+
+    # Start from the original schema: primary keys and unique columns only.
+    # The tables are created without the secondary indexes rather than
+    # dropping them afterwards, which InnoDB refuses for an index backing a
+    # foreign key; it adds its own index per foreign key instead, as it did
+    # for the original schema.
+    secondary = [
+        index for table in tables for index in table.indexes if index.name in SECONDARY_INDEXES
+    ]
+    for index in secondary:
+        index.table.indexes.discard(index)
+    try:
+        Base.metadata.create_all(bind=engine, tables=tables)
+    finally:
+        for index in secondary:
+            index.table.indexes.add(index)
+
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+    start = time.perf_counter()
+    n_classes, n_sessions, n_records = seed(engine, args.students, args.records)
+    print(f"Seeded {args.students} students, {n_classes} classes, {n_sessions} sessions, "
+          f"{n_records} records in {time.perf_counter() - start:.1f}s")
+
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    student = db.query(Student).order_by(Student.id.desc()).first()
+    session_id = db.query(func.max(AttendanceSession.id)).filter(
+        AttendanceSession.class_name == student.class_name
+    ).scalar()
+    queries = dashboard_queries(db, student.class_name, student, session_id)
+
+    before = run(db, queries, args.repeat)
+    before_plans = explain(engine, queries)
+
+    start = time.perf_counter()
+    for index in secondary:
+        index.create(bind=engine)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+    print(f"Created {len(secondary)} indexes in {time.perf_counter() - start:.1f}s")
+
+    after = run(db, queries, args.repeat)
+    after_plans = explain(engine, queries)
+    db.close()
+
+    print_plans("Query plans without the secondary indexes:", before_plans)
+    print_plans("Query plans with the secondary indexes:", after_plans)
+    print()
+
+    print(f"{'query':<34} {'before (ms)':>12} {'after (ms)':>11} {'speedup':>8}")
+    for name in queries:
+        print(f"{name:<34} {before[name] * 1000:>12.2f} {after[name] * 1000:>11.2f} "
+              f"{before[name] / after[name]:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
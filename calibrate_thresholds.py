@@ -0,0 +1,32 @@
+# calibrate_thresholds.py
+# Fits each class's match tolerance from the distances logged by past
+# sessions and stores it; the matcher picks it up within a few minutes.
+# Run it periodically (e.g. weekly from cron):
+#   python calibrate_thresholds.py             # fit and store
+#   python calibrate_thresholds.py --dry-run   # only report
+import argparse
+
+from utils.db_conn import session_scope, create_tables
+from utils.calibration import calibrate, CALIBRATION_DAYS
+
+parser = argparse.ArgumentParser(description="Calibrate per-class match tolerances.")
+parser.add_argument("--days", type=int, default=CALIBRATION_DAYS,
+                    help=f"history to fit on (default: {CALIBRATION_DAYS} days)")
+parser.add_argument("--dry-run", action="store_true", help="report without storing the tolerances")
+args = parser.parse_args()
+
+create_tables()
+with session_scope() as db:
+    report = calibrate(db, days=args.days, dry_run=args.dry_run)
+
+if not report:
+    print("No match distances logged yet.")
+for r in report:
+    if r["fitted"] is None:
+        print(f"⚠️  {r['class_name']}: kept {r['current']:.3f}, {r['reason']}")
+        continue
+    print(f"✅ {r['class_name']}: {r['current']:.3f} -> {r['fitted']:.3f} "
+          f"({r['samples']} decisions over {r['sessions']} sessions, {r['reason']}); "
+          f"would flip {r['to_present']} Absent -> Present, {r['to_absent']} Present -> Absent")
+if args.dry_run and report:
+    print("Dry run: nothing stored.")
@@ -1,10 +1,10 @@
 # create_admin.py
-from utils.db_conn import SessionLocal
+from utils.db_conn import session_scope
 from db.models import User
+from utils.auth import hash_password
 
-db = SessionLocal()
-admin = User(username="admin", password="admin123", role="admin")
-db.add(admin)
-db.commit()
-db.close()
+with session_scope() as db:
+    admin = User(username="admin", password=hash_password("admin123"), role="admin")
+    db.add(admin)
+    db.commit()
 print("✅ Admin user created")
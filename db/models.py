@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, BigInteger, Float, String, ForeignKey, DateTime, Text, LargeBinary, Index
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 
@@ -23,6 +23,10 @@ class User(Base):
 # -----------------------
 class Student(Base):
     __tablename__ = "students"
+    __table_args__ = (
+        Index("ix_students_class_name", "class_name"),
+        Index("ix_students_user_id", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
@@ -34,6 +38,34 @@ class Student(Base):
     user = relationship("User", back_populates="student")
 
     attendance_records = relationship("AttendanceRecord", back_populates="student")
+    face_encodings = relationship("FaceEncoding", back_populates="student", cascade="all, delete-orphan")
+    attendance_stats = relationship("StudentAttendanceStat", cascade="all, delete-orphan")
+
+
+# -----------------------
+# FACE ENCODINGS
+# -----------------------
+# One row per enrollment image. The encoding is keyed by the image content
+# hash so it is only recomputed when the file actually changes; the file
+# size/mtime pair is a cheap fingerprint checked before re-hashing.
+# encoding is NULL when no face was found in the image.
+# For students in the image store (images_path NULL) image_hash is the
+# store key, file_name the name it was uploaded under and file_mtime 0.
+class FaceEncoding(Base):
+    __tablename__ = "face_encodings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False, index=True)
+    file_name = Column(String(255), nullable=False)
+    image_hash = Column(String(64), nullable=False, index=True)
+    file_size = Column(BigInteger, nullable=False)
+    file_mtime = Column(BigInteger, nullable=False)
+    encoding = Column(LargeBinary, nullable=True)
+    # JSON quality score of the image (see utils/face_quality.py); NULL for
+    # rows encoded before images were scored
+    quality = Column(Text, nullable=True)
+
+    student = relationship("Student", back_populates="face_encodings")
 
 
 # -----------------------
@@ -41,6 +73,9 @@ class Student(Base):
 # -----------------------
 class AttendanceSession(Base):
     __tablename__ = "attendance_sessions"
+    __table_args__ = (
+        Index("ix_attendance_sessions_class_timestamp", "class_name", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     session_name = Column(String(100), nullable=False)
@@ -56,11 +91,161 @@ class AttendanceSession(Base):
 # -----------------------
 class AttendanceRecord(Base):
     __tablename__ = "attendance_records"
+    __table_args__ = (
+        # one record per student per session; also serves session lookups
+        Index("ux_attendance_records_session_student", "session_id", "student_id", unique=True),
+        Index("ix_attendance_records_student_id", "student_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("attendance_sessions.id"))
     student_id = Column(Integer, ForeignKey("students.id"))
     status = Column(String(20), default="Absent")
+    # 1 - face distance of the winning match; NULL when Absent
+    confidence = Column(Float, nullable=True)
 
     session = relationship("AttendanceSession", back_populates="records")
-    student = relationship("Student", back_populates="attendance_records")
\ No newline at end of file
+    student = relationship("Student", back_populates="attendance_records")
+
+
+# -----------------------
+# ATTENDANCE JOBS
+# -----------------------
+# Background attendance processing requests; status is one of
+# queued / running / done / failed.
+class AttendanceJob(Base):
+    __tablename__ = "attendance_jobs"
+    __table_args__ = (
+        Index("ix_attendance_jobs_submitted_created", "submitted_by", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_name = Column(String(100), nullable=False)
+    class_name = Column(String(50), nullable=False)
+    mode = Column(String(20), nullable=False, default="independent")
+    photo_count = Column(Integer, nullable=False, default=1)
+    upload_key = Column(String(64), nullable=True, index=True)
+    # NULL once the submitting faculty account is removed
+    submitted_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    status = Column(String(20), nullable=False, default="queued", index=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    csv_path = Column(Text, nullable=True)
+    # JSON list of students from other classes recognised in the photos
+    visitors = Column(Text, nullable=True)
+    # "<host>:<pid>" of the server process running the job, which refreshes
+    # heartbeat_at while the job is queued or running
+    worker = Column(String(100), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+
+# -----------------------
+# ATTENDANCE AGGREGATES
+# -----------------------
+# Running totals per student per class, updated by every new session so
+# percentage and defaulter reports never scan attendance_records.
+class StudentAttendanceStat(Base):
+    __tablename__ = "student_attendance_stats"
+    __table_args__ = (
+        Index("ix_student_attendance_stats_class", "class_name"),
+    )
+
+    student_id = Column(Integer, ForeignKey("students.id"), primary_key=True)
+    class_name = Column(String(50), primary_key=True)
+    sessions_held = Column(Integer, nullable=False, default=0)
+    sessions_present = Column(Integer, nullable=False, default=0)
+    last_seen = Column(DateTime, nullable=True)
+
+
+# -----------------------
+# BULK ENROLLMENT IMPORTS
+# -----------------------
+# One row per ZIP/CSV import, keyed by the content of both files so that
+# re-running an interrupted import resumes it. status is running / done /
+# failed; failures is a JSON list of per-student problems.
+class EnrollmentImport(Base):
+    __tablename__ = "enrollment_imports"
+
+    id = Column(Integer, primary_key=True, index=True)
+    import_key = Column(String(64), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default="running")
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    enrolled = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    failures = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+# -----------------------
+# PIPELINE SPANS
+# -----------------------
+# Timings of the attendance pipeline stages (see utils/metrics.py), only
+# written when ATTENDANCE_METRICS_PERSIST=1.
+class PipelineSpan(Base):
+    __tablename__ = "pipeline_spans"
+
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    stage = Column(String(50), nullable=False)
+    duration_ms = Column(Float, nullable=False)
+    session_name = Column(String(100), nullable=True)
+    class_name = Column(String(50), nullable=True)
+    faces = Column(Integer, nullable=True)
+
+
+# -----------------------
+# IMAGE STORE
+# -----------------------
+# One row per image in the content-addressed store (see utils/image_store.py),
+# keyed by the SHA-256 of the uploaded bytes. refcount is the number of
+# face_encodings rows pointing at it; the files go when it drops to zero.
+class StoredImage(Base):
+    __tablename__ = "stored_images"
+
+    image_hash = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# -----------------------
+# MATCH CALIBRATION
+# -----------------------
+# Per session and class student: the distances of the closest and second
+# closest face in the session's photos (NULL when there were not that many
+# faces), and the tolerance the decision was made with. The history
+# calibrate_thresholds.py fits the per-class tolerances from.
+class MatchDistance(Base):
+    __tablename__ = "match_distances"
+    __table_args__ = (
+        Index("ix_match_distances_class_created", "class_name", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("attendance_sessions.id"), index=True)
+    class_name = Column(String(50), nullable=False)
+    # no foreign key: the history outlives removed students
+    student_id = Column(Integer, nullable=False)
+    best_distance = Column(Float, nullable=True)
+    second_distance = Column(Float, nullable=True)
+    tolerance = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Calibrated match tolerance of a class; classes without a row use the
+# default MATCH_TOLERANCE.
+class MatchThreshold(Base):
+    __tablename__ = "match_thresholds"
+
+    class_name = Column(String(50), primary_key=True)
+    tolerance = Column(Float, nullable=False)
+    samples = Column(Integer, nullable=False)
+    sessions = Column(Integer, nullable=False)
+    fitted_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,24 @@
+# dedupe_attendance.py
+# One-time migration for databases created before attendance records were
+# unique per session and student: removes every record but the first of
+# each duplicated pair, then creates the unique index.
+#
+#   python dedupe_attendance.py [--dry-run]
+import argparse
+
+from utils.db_conn import create_tables, remove_duplicate_records
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove duplicate attendance records")
+    parser.add_argument("--dry-run", action="store_true", help="only list the records that would be removed")
+    args = parser.parse_args()
+
+    duplicates = remove_duplicate_records(dry_run=args.dry_run)
+    for record_id, session_id, student_id, status in duplicates:
+        print(f"{'Would remove' if args.dry_run else 'Removed'} record {record_id} "
+              f"(session {session_id}, student {student_id}, {status})")
+    if args.dry_run:
+        print(f"✅ {len(duplicates)} duplicate attendance records found")
+    else:
+        print(f"✅ Removed {len(duplicates)} duplicate attendance records")
+        create_tables()
@@ -0,0 +1,31 @@
+# enroll_students.py
+# Bulk-enrolls students from a ZIP of per-roll-number image folders and a CSV
+# manifest (roll_no, name, class_name, username, password). Re-run the same
+# command to resume an interrupted import. A running server picks the new
+# students up within a minute (see CLASS_CACHE_RECHECK in utils/face_utils.py).
+#
+#   python enroll_students.py students.zip manifest.csv
+import sys
+
+from utils.db_conn import create_tables
+from utils.bulk_enroll import bulk_enroll, import_key, import_failures
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python enroll_students.py <images.zip> <manifest.csv>")
+
+    zip_path, manifest_path = sys.argv[1:]
+    with open(zip_path, "rb") as f:
+        zip_bytes = f.read()
+    with open(manifest_path, "rb") as f:
+        manifest_bytes = f.read()
+
+    create_tables()
+    record = bulk_enroll(zip_path, manifest_bytes, key=import_key(zip_bytes, manifest_bytes))
+
+    for failure in import_failures(record):
+        print(f"⚠️  {failure['roll_no']}: {failure['reason']}")
+    if record.status != "done":
+        sys.exit(f"❌ Import stopped after {record.processed}/{record.total} students: {record.error}")
+    print(f"✅ Enrolled {record.enrolled} students ({record.skipped} already enrolled, "
+          f"{len(import_failures(record))} with problems)")
@@ -0,0 +1,15 @@
+# migrate_images.py
+# Moves students enrolled before the image store from student_images/<id>/
+# into it. Existing face encodings are kept; folders are removed once their
+# student is migrated. Safe to re-run.
+from utils.db_conn import session_scope, create_tables
+from db.models import Student
+from utils.image_store import migrate_student_images
+
+create_tables()
+with session_scope() as db:
+    students = db.query(Student).filter(Student.images_path.isnot(None)).all()
+    moved = 0
+    for student in students:
+        moved += migrate_student_images(db, student)
+print(f"✅ Moved {moved} images of {len(students)} students into the image store")
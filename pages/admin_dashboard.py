@@ -1,10 +1,26 @@
 import streamlit as st
 import os
+from datetime import datetime, timedelta
 
 from sqlalchemy.orm import joinedload
 
-from utils.db_conn import SessionLocal
+from utils.db_conn import session_scope, pool_metrics
+from utils.auth import hash_password, invalidate_logins
 from db.models import User, Student
+from utils.class_cache import class_cache
+from utils.face_index import remove_student_from_index
+from utils.face_utils import update_student_caches
+from utils.attendance_jobs import detach_user_jobs
+from utils.attendance_stats import attendance_report, report_classes, DEFAULTER_THRESHOLD
+from utils.face_quality import quality_summary
+from utils.dashboard_ui import show_image_report
+from utils.image_store import (
+    enroll_student, update_student_images, release_student_images, remove_image_files, student_images
+)
+from utils.bulk_enroll import bulk_enroll, import_key, import_failures, MANIFEST_COLUMNS
+from utils.metrics import (
+    stage_summaries, recent_spans, persisted_summaries, prometheus_text, PERSIST_SPANS
+)
 
 STUDENT_IMG_DIR = "student_images"
 os.makedirs(STUDENT_IMG_DIR, exist_ok=True)
@@ -23,21 +39,18 @@ def add_faculty():
             if not uname or not pwd:
                 st.error("Fill all fields")
                 return
-            db = SessionLocal()
-            if db.query(User).filter(User.username == uname).first():
-                st.error("Username already exists")
-                db.close()
-                return
-            faculty = User(username=uname, password=pwd, role="faculty")
-            db.add(faculty)
-            db.commit()
-            db.close()
+            with session_scope() as db:
+                if db.query(User).filter(User.username == uname).first():
+                    st.error("Username already exists")
+                    return
+                faculty = User(username=uname, password=hash_password(pwd), role="faculty")
+                db.add(faculty)
+                db.commit()
             st.success(f"Faculty {uname} added successfully!")
 
 def manage_faculty():
-    db = SessionLocal()
-    faculties = db.query(User).filter(User.role=="faculty").all()
-    db.close()
+    with session_scope() as db:
+        faculties = db.query(User).filter(User.role=="faculty").all()
     if faculties:
         st.markdown("### Select Faculty to Edit")
         choice = st.selectbox("Search Faculty by Username", [f.username for f in faculties])
@@ -49,26 +62,29 @@ def manage_faculty():
             with col1:
                 new_uname = st.text_input("Edit Username", value=faculty.username, key="edit_faculty_uname")
             with col2:
-                new_pwd = st.text_input("Edit Password", value=faculty.password, type="password", key="edit_faculty_pwd")
+                new_pwd = st.text_input("Edit Password", type="password", key="edit_faculty_pwd",
+                                        placeholder="Leave blank to keep the current password")
             
             st.write("")
             c1, c2 = st.columns(2)
             with c1:
                 if st.button("Update Faculty", use_container_width=True, type="primary"):
-                    db = SessionLocal()
-                    f_db = db.query(User).get(faculty.id)
-                    f_db.username = new_uname
-                    f_db.password = new_pwd
-                    db.commit()
-                    db.close()
+                    with session_scope() as db:
+                        f_db = db.query(User).get(faculty.id)
+                        f_db.username = new_uname
+                        if new_pwd:
+                            f_db.password = hash_password(new_pwd)
+                        db.commit()
+                    invalidate_logins(faculty.username, new_uname)
                     st.success(f"Faculty {new_uname} updated!")
             with c2:
                 if st.button("Remove Faculty", use_container_width=True):
-                    db = SessionLocal()
-                    f_db = db.query(User).get(faculty.id)
-                    db.delete(f_db)
-                    db.commit()
-                    db.close()
+                    with session_scope() as db:
+                        f_db = db.query(User).get(faculty.id)
+                        detach_user_jobs(db, f_db.id)
+                        db.delete(f_db)
+                        db.commit()
+                    invalidate_logins(faculty.username)
                     st.success(f"Faculty {choice} removed!")
 
 def add_student():
@@ -92,85 +108,264 @@ def add_student():
             if not all([name, roll_no, class_name, username, password, files]):
                 st.error("Fill all fields and upload images.")
                 return
-            db = SessionLocal()
-            # Check if username exists
-            if db.query(User).filter(User.username==username).first():
-                st.error("Username already exists.")
-                db.close()
-                return
-            # 1. Create User
-            user = User(username=username, password=password, role="student")
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-
-            # 2. Create Student
-            student = Student(name=name, roll_no=roll_no, class_name=class_name, user_id=user.id)
-            db.add(student)
-            db.commit()
-            db.refresh(student)
-
-            # Save images
-            folder = os.path.join(STUDENT_IMG_DIR, str(student.id))
-            os.makedirs(folder, exist_ok=True)
-            for f in files:
-                with open(os.path.join(folder, f.name), "wb") as out:
-                    out.write(f.getbuffer())
-            student.images_path = folder
-            db.commit()
-            db.close()
-            st.success(f"Student {name} added with {len(files)} images.")
-
+            with session_scope() as db:
+                # Check if username exists
+                if db.query(User).filter(User.username==username).first():
+                    st.error("Username already exists.")
+                    return
+                # Images are scored before anything is saved: the student is
+                # created only if at least one of them is usable
+                user = User(username=username, password=hash_password(password), role="student")
+                student = Student(name=name, roll_no=roll_no, class_name=class_name)
+                with st.spinner("Encoding face images..."):
+                    report, created = enroll_student(db, user, student, [(f.name, f.getvalue()) for f in files])
+            added = sum(outcome == "added" for _, outcome, _ in report)
+            show_image_report(report)
+            if created:
+                st.success(f"Student {name} added with {added} images.")
+            else:
+                st.error(f"Student {name} not added: none of the images can be used. Upload clearer photos.")
 
 def manage_students():
-    db = SessionLocal()
-    # eager load user to avoid DetachedInstanceError
-    students = db.query(Student).options(joinedload(Student.user)).all()
-    stu_names = {f"{s.name} ({s.roll_no})": s for s in students}
+    with session_scope() as db:
+        # eager load user to avoid DetachedInstanceError
+        students = db.query(Student).options(joinedload(Student.user)).all()
+        stu_names = {f"{s.name} ({s.roll_no})": s for s in students}
 
-    if stu_names:
-        st.markdown("### Select Student to Edit")
-        choice = st.selectbox("Search Student by Name or Roll No", list(stu_names.keys()), key="admin_select_student")
-        student = stu_names[choice]
+        if stu_names:
+            st.markdown("### Select Student to Edit")
+            choice = st.selectbox("Search Student by Name or Roll No", list(stu_names.keys()), key="admin_select_student")
+            student = stu_names[choice]
 
-        st.markdown("### Edit Details")
-        with st.container(border=True):
-            col1, col2 = st.columns(2)
-            with col1:
-                new_name = st.text_input("Edit Name", value=student.name, key="admin_edit_name")
-                new_class = st.text_input("Edit Class", value=student.class_name, key="admin_edit_class")
-                new_username = st.text_input("Edit Username", value=student.user.username if student.user else "",
-                                             key="admin_edit_username")
-            with col2:
-                new_roll = st.text_input("Edit Roll", value=student.roll_no, key="admin_edit_roll")
-                new_password = st.text_input("Edit Password", value=student.user.password if student.user else "",
-                                             type="password", key="admin_edit_pwd")
+            images = student_images(db, student)
+            shown = [(name, path, quality) for _, name, path, _, quality in images if os.path.exists(path)]
+            if shown:
+                st.image([path for _, path, _ in shown],
+                         caption=[f"{name} ({quality_summary(quality)})" if quality else name
+                                  for name, _, quality in shown],
+                         width=96)
 
-            st.write("")
-            c1, c2 = st.columns(2)
-            with c1:
-                if st.button("Update Student", use_container_width=True, type="primary", key="admin_update_student"):
-                    if student.user:
-                        student.user.username = new_username
-                        student.user.password = new_password
-                    student.name = new_name
-                    student.roll_no = new_roll
-                    student.class_name = new_class
-                    db.commit()
-                    st.success(f"Student {new_name} updated!")
+            st.markdown("### Edit Details")
+            with st.container(border=True):
+                col1, col2 = st.columns(2)
+                with col1:
+                    new_name = st.text_input("Edit Name", value=student.name, key="admin_edit_name")
+                    new_class = st.text_input("Edit Class", value=student.class_name, key="admin_edit_class")
+                    new_username = st.text_input("Edit Username", value=student.user.username if student.user else "",
+                                                 key="admin_edit_username")
+                with col2:
+                    new_roll = st.text_input("Edit Roll", value=student.roll_no, key="admin_edit_roll")
+                    new_password = st.text_input("Edit Password", type="password", key="admin_edit_pwd",
+                                                 placeholder="Leave blank to keep the current password")
+
+                st.write("")
+                c1, c2 = st.columns(2)
+                with c1:
+                    if st.button("Update Student", use_container_width=True, type="primary", key="admin_update_student"):
+                        if student.user:
+                            invalidate_logins(student.user.username, new_username)
+                            student.user.username = new_username
+                            if new_password:
+                                student.user.password = hash_password(new_password)
+                        old_class = student.class_name
+                        student.name = new_name
+                        student.roll_no = new_roll
+                        student.class_name = new_class
+                        db.commit()
+                        update_student_caches(db, student, old_class=old_class)
+                        st.success(f"Student {new_name} updated!")
                     
-            with c2:
-                if st.button("Remove Student", use_container_width=True, key="admin_remove_student"):
-                    if student.images_path and os.path.exists(student.images_path):
-                        import shutil
-                        shutil.rmtree(student.images_path)
-                    if student.user:
-                        db.delete(student.user)
-                    db.delete(student)
-                    db.commit()
-                    st.success(f"Student {choice} removed!")
+                with c2:
+                    if st.button("Remove Student", use_container_width=True, key="admin_remove_student"):
+                        removed_class = student.class_name
+                        removed_id = student.id
+                        if student.images_path and os.path.exists(student.images_path):
+                            import shutil
+                            shutil.rmtree(student.images_path)
+                        orphaned = release_student_images(db, student)
+                        if student.user:
+                            invalidate_logins(student.user.username)
+                            db.delete(student.user)
+                        db.delete(student)
+                        db.commit()
+                        remove_image_files(orphaned)
+                        class_cache.remove_student(removed_class, removed_id)
+                        remove_student_from_index(removed_id)
+                        st.success(f"Student {choice} removed!")
+
+            st.markdown("### Face Images")
+            with st.container(border=True):
+                # Only the added images are encoded; the rest of the class is untouched
+                labels = {
+                    f"{name} (#{image_id})" + ("" if encoded else " - no face found"): image_id
+                    for image_id, name, _, encoded, _ in images
+                }
+                to_remove = st.multiselect("Remove Images", list(labels), key=f"admin_remove_images_{student.id}")
+                new_files = st.file_uploader("Add Face Images", type=["jpg","jpeg","png"], accept_multiple_files=True,
+                                             key=f"admin_add_images_{student.id}")
+                if st.button("Update Images", use_container_width=True, key="admin_update_images"):
+                    if not to_remove and not new_files:
+                        st.error("Select images to remove or upload new ones.")
+                    elif len(to_remove) == len(images) and not new_files:
+                        st.error("A student needs at least one face image.")
+                    else:
+                        with st.spinner("Encoding face images..."):
+                            removed, report, refused = update_student_images(
+                                db, student, [(f.name, f.getvalue()) for f in new_files or []],
+                                [labels[label] for label in to_remove]
+                            )
+                        show_image_report(report)
+                        added = sum(outcome == "added" for _, outcome, _ in report)
+                        if refused:
+                            st.error("Nothing changed: a student needs at least one usable face image, "
+                                     "and none of the uploads can be used.")
+                        else:
+                            st.success(f"{student.name}: {added} image(s) added, {removed} removed.")
+
+
+def bulk_import_students():
+    st.markdown("### Bulk Enrollment")
+    st.caption("ZIP with one folder of face images per roll number, plus a CSV manifest with the columns "
+               + ", ".join(MANIFEST_COLUMNS) + ". Uploading the same files again resumes an interrupted import.")
+
+    with st.container(border=True):
+        zip_file = st.file_uploader("Student Images (ZIP)", type=["zip"], key="bulk_zip")
+        manifest = st.file_uploader("Manifest (CSV)", type=["csv"], key="bulk_manifest")
+
+        st.write("")
+        if st.button("Import Students", use_container_width=True, type="primary", key="bulk_import"):
+            if not zip_file or not manifest:
+                st.error("Upload both the ZIP and the manifest.")
+                return
+
+            manifest_bytes = manifest.getvalue()
+            key = import_key(zip_file.getvalue(), manifest_bytes)
+            bar = st.progress(0.0, text="Encoding face images...")
+
+            def progress(done, total):
+                bar.progress(done / total if total else 1.0, text=f"Processed {done} of {total} students")
+
+            try:
+                record = bulk_enroll(zip_file, manifest_bytes, key=key, progress=progress)
+            except ValueError as e:
+                st.error(str(e))
+                return
 
-    db.close()
+            failures = import_failures(record)
+            if record.status == "done":
+                st.success(f"Enrolled {record.enrolled} students "
+                           f"({record.skipped} already enrolled, {len(failures)} with problems).")
+            else:
+                st.error(f"Import stopped after {record.processed} of {record.total} students: {record.error}. "
+                         "Upload the same files again to resume.")
+            if failures:
+                st.dataframe(
+                    [{"Roll No": f["roll_no"], "Problem": f["reason"]} for f in failures],
+                    use_container_width=True, hide_index=True
+                )
+
+
+# ----------------- Reports -----------------
+def attendance_reports():
+    with session_scope() as db:
+        classes = report_classes(db)
+
+    if not classes:
+        st.info("No attendance recorded yet. Run rebuild_stats.py to backfill existing history.")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        class_name = st.selectbox("Class", ["All classes"] + classes, key="report_class")
+    with col2:
+        threshold = st.slider("Defaulter threshold (%)", 0, 100, int(DEFAULTER_THRESHOLD), key="report_threshold")
+    class_name = None if class_name == "All classes" else class_name
+
+    with session_scope() as db:
+        report = attendance_report(db, class_name)
+        defaulters = attendance_report(db, class_name, below=threshold)
+
+    def as_rows(rows):
+        return [
+            {
+                "Roll No": r.roll_no,
+                "Name": r.name,
+                "Class": r.class_name,
+                "Held": r.sessions_held,
+                "Present": r.sessions_present,
+                "Attendance %": round(r.percentage, 1),
+                "Last Seen": r.last_seen.date() if r.last_seen else None,
+            }
+            for r in rows
+        ]
+
+    tab1, tab2 = st.tabs(["Attendance Percentages", f"Defaulters ({len(defaulters)})"])
+    with tab1:
+        st.dataframe(as_rows(report), use_container_width=True, hide_index=True)
+    with tab2:
+        if defaulters:
+            st.dataframe(as_rows(defaulters), use_container_width=True, hide_index=True)
+        else:
+            st.success(f"No student is below {threshold}% attendance.")
+
+
+# ----------------- Metrics -----------------
+def pipeline_metrics():
+    st.caption("Time spent in each stage of attendance processing by this server "
+               "(percentiles over the most recent runs).")
+
+    source = "This server process"
+    if PERSIST_SPANS:
+        source = st.radio("Source", ["This server process", "Last 24 hours", "Last 7 days"],
+                          horizontal=True, key="metrics_source")
+
+    if source == "This server process":
+        summaries = stage_summaries()
+    else:
+        days = 1 if source == "Last 24 hours" else 7
+        with session_scope() as db:
+            summaries = persisted_summaries(db, datetime.utcnow() - timedelta(days=days))
+
+    if not summaries:
+        st.info("No attendance has been processed yet.")
+        return
+
+    st.dataframe(
+        [
+            {
+                "Stage": stage,
+                "Count": s["count"],
+                "Mean (ms)": round(s["mean_ms"], 1),
+                "p50 (ms)": round(s["p50_ms"], 1),
+                "p95 (ms)": round(s["p95_ms"], 1),
+                "p99 (ms)": round(s["p99_ms"], 1),
+                "Max (ms)": round(s["max_ms"], 1),
+            }
+            for stage, s in summaries.items()
+        ],
+        use_container_width=True, hide_index=True
+    )
+
+    spans = recent_spans(limit=50)
+    if spans:
+        st.markdown("**Recent spans**")
+        st.dataframe(
+            [
+                {
+                    "Time": created_at.strftime("%H:%M:%S"),
+                    "Stage": name,
+                    "Duration (ms)": round(duration_ms, 1),
+                    "Session": tags.get("session", ""),
+                    "Class": tags.get("class_name", ""),
+                    "Faces": tags.get("faces"),
+                }
+                for created_at, name, duration_ms, tags in spans
+            ],
+            use_container_width=True, hide_index=True
+        )
+
+    st.download_button("Download Prometheus metrics", prometheus_text(),
+                       file_name="attendance_metrics.prom", mime="text/plain")
 
 
 # ----------------- Main -----------------
@@ -184,7 +379,7 @@ def main():
     st.markdown("<style> [data-testid='stSidebar'] { display: none; } </style>", unsafe_allow_html=True)
 
     # Top Navbar logic
-    col1, col2, col3, col4, col5 = st.columns([1,1.5,1.5,1.5,1])
+    col1, col2, col3, col4, col5, col6 = st.columns([0.5,1.2,1.2,1.2,1.2,1])
     with col2:
         if st.button("Home", use_container_width=True):
             st.session_state['admin_nav'] = 'home'
@@ -198,6 +393,10 @@ def main():
             st.session_state['admin_nav'] = 'student'
             st.rerun()
     with col5:
+        if st.button("Reports", use_container_width=True):
+            st.session_state['admin_nav'] = 'reports'
+            st.rerun()
+    with col6:
         if st.button("Logout", type="primary", use_container_width=True):
             st.session_state.pop("user")
             st.rerun()
@@ -216,21 +415,25 @@ def main():
             manage_faculty()
             
     elif st.session_state['admin_nav'] == 'student':
-        tab1, tab2 = st.tabs(["Add New Student", "Manage Existing Students"])
+        tab1, tab2, tab3 = st.tabs(["Add New Student", "Manage Existing Students", "Bulk Import"])
         with tab1:
             add_student()
         with tab2:
             manage_students()
+        with tab3:
+            bulk_import_students()
             
+    elif st.session_state['admin_nav'] == 'reports':
+        attendance_reports()
+
     else:
         st.header("Welcome to Admin Portal")
         st.write("Overview of the attendance system.")
         
         # Query database for counts
-        db = SessionLocal()
-        student_count = db.query(Student).count()
-        faculty_count = db.query(User).filter(User.role == "faculty").count()
-        db.close()
+        with session_scope() as db:
+            student_count = db.query(Student).count()
+            faculty_count = db.query(User).filter(User.role == "faculty").count()
         
         # Display nicely styled metrics
         col1, col2, col3 = st.columns(3)
@@ -238,3 +441,25 @@ def main():
             st.metric(label="Total Registered Students", value=student_count)
         with col2:
             st.metric(label="Total Faculty Members", value=faculty_count)
+
+        with st.expander("Database connection pool"):
+            pool = pool_metrics()
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Backend", pool["backend"])
+            c2.metric("Connections opened", pool["connections_opened"])
+            c3.metric("Checked out now", pool.get("checked_out", "-"))
+            c4.metric("Avg checkout wait", f"{pool['checkout_wait_avg'] * 1000:.2f} ms")
+            st.caption(f"{pool['checkouts']} checkouts, max wait {pool['checkout_wait_max'] * 1000:.1f} ms")
+
+        with st.expander("Class embedding cache"):
+            cache = class_cache.stats()
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Hit rate", f"{cache['hit_rate'] * 100:.1f}%")
+            c2.metric("Hits", cache["hits"])
+            c3.metric("Misses", cache["misses"])
+            c4.metric("Evictions", cache["evictions"])
+            st.caption(f"{cache['classes']} classes cached ({cache['bytes'] / 2**20:.1f} MiB), "
+                       f"{cache['stale']} reloaded after the class changed in the database")
+
+        with st.expander("Attendance pipeline timings"):
+            pipeline_metrics()
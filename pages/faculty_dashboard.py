@@ -1,11 +1,23 @@
 import streamlit as st
 import os
+import tempfile
 
 from sqlalchemy.orm import joinedload
 
-from utils.db_conn import SessionLocal
+from utils.db_conn import session_scope
+from utils.auth import hash_password, invalidate_logins
 from db.models import User, Student
-from utils.face_utils import mark_attendance, STUDENT_IMG_DIR, CSV_DIR
+from utils.class_cache import class_cache
+from utils.face_index import remove_student_from_index
+from utils.face_utils import STUDENT_IMG_DIR, CSV_DIR, update_student_caches
+from utils.face_quality import quality_summary
+from utils.dashboard_ui import show_image_report
+from utils.image_store import (
+    enroll_student, update_student_images, release_student_images, remove_image_files, student_images
+)
+from utils.attendance_jobs import (
+    submit_attendance_job, recent_jobs, queue_position, job_timings, job_csv_bytes, job_visitors, upload_key
+)
 
 os.makedirs(STUDENT_IMG_DIR, exist_ok=True)
 os.makedirs(CSV_DIR, exist_ok=True)
@@ -31,81 +43,117 @@ def add_student():
             if not all([name, roll_no, class_name, username, password, files]):
                 st.error("Fill all fields and upload images before saving.")
                 return
-            db = SessionLocal()
-            if db.query(User).filter(User.username==username).first():
-                st.error("Username already exists. Choose a different one.")
-                db.close()
-                return
-            # Create User
-            user = User(username=username, password=password, role="student")
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-            # Create Student
-            student = Student(name=name, roll_no=roll_no, class_name=class_name, user_id=user.id)
-            db.add(student)
-            db.commit()
-            db.refresh(student)
-            # Save Images
-            folder = os.path.join(STUDENT_IMG_DIR, str(student.id))
-            os.makedirs(folder, exist_ok=True)
-            for f in files:
-                with open(os.path.join(folder, f.name), "wb") as out:
-                    out.write(f.getbuffer())
-            student.images_path = folder
-            db.commit()
-            db.close()
-            st.success(f"Student {name} added successfully! Uploaded {len(files)} face image(s).")
-
+            with session_scope() as db:
+                if db.query(User).filter(User.username==username).first():
+                    st.error("Username already exists. Choose a different one.")
+                    return
+                # Images are scored before anything is saved: the student is
+                # created only if at least one of them is usable
+                user = User(username=username, password=hash_password(password), role="student")
+                student = Student(name=name, roll_no=roll_no, class_name=class_name)
+                with st.spinner("Encoding face images..."):
+                    report, created = enroll_student(db, user, student, [(f.name, f.getvalue()) for f in files])
+            added = sum(outcome == "added" for _, outcome, _ in report)
+            show_image_report(report)
+            if created:
+                st.success(f"Student {name} added successfully! Uploaded {added} face image(s).")
+            else:
+                st.error(f"Student {name} not added: none of the images can be used. Upload clearer photos.")
 
 def manage_students():
-    db = SessionLocal()
-    # eager load user to avoid DetachedInstanceError
-    students = db.query(Student).options(joinedload(Student.user)).all()
-    stu_names = {f"{s.name} ({s.roll_no})": s for s in students}
+    with session_scope() as db:
+        # eager load user to avoid DetachedInstanceError
+        students = db.query(Student).options(joinedload(Student.user)).all()
+        stu_names = {f"{s.name} ({s.roll_no})": s for s in students}
 
-    if stu_names:
-        st.markdown("### Select Student to Edit")
-        choice = st.selectbox("Search Student by Name or Roll No", list(stu_names.keys()), key="faculty_select_student")
-        student = stu_names[choice]
+        if stu_names:
+            st.markdown("### Select Student to Edit")
+            choice = st.selectbox("Search Student by Name or Roll No", list(stu_names.keys()), key="faculty_select_student")
+            student = stu_names[choice]
 
-        st.markdown("### Edit Details")
-        with st.container(border=True):
-            col1, col2 = st.columns(2)
-            with col1:
-                new_name = st.text_input("Edit Name", value=student.name, key="faculty_edit_name")
-                new_class = st.text_input("Edit Class", value=student.class_name, key="faculty_edit_class")
-                new_username = st.text_input("Edit Username", value=student.user.username if student.user else "",
-                                             key="faculty_edit_username")
-            with col2:
-                new_roll = st.text_input("Edit Roll", value=student.roll_no, key="faculty_edit_roll")
-                new_password = st.text_input("Edit Password", value=student.user.password if student.user else "",
-                                             type="password", key="faculty_edit_pwd")
+            images = student_images(db, student)
+            shown = [(name, path, quality) for _, name, path, _, quality in images if os.path.exists(path)]
+            if shown:
+                st.image([path for _, path, _ in shown],
+                         caption=[f"{name} ({quality_summary(quality)})" if quality else name
+                                  for name, _, quality in shown],
+                         width=96)
+
+            st.markdown("### Edit Details")
+            with st.container(border=True):
+                col1, col2 = st.columns(2)
+                with col1:
+                    new_name = st.text_input("Edit Name", value=student.name, key="faculty_edit_name")
+                    new_class = st.text_input("Edit Class", value=student.class_name, key="faculty_edit_class")
+                    new_username = st.text_input("Edit Username", value=student.user.username if student.user else "",
+                                                 key="faculty_edit_username")
+                with col2:
+                    new_roll = st.text_input("Edit Roll", value=student.roll_no, key="faculty_edit_roll")
+                    new_password = st.text_input("Edit Password", type="password", key="faculty_edit_pwd",
+                                                 placeholder="Leave blank to keep the current password")
             
-            st.write("")
-            c1, c2 = st.columns(2)
-            with c1:
-                if st.button("Update Student", use_container_width=True, type="primary", key="faculty_update_student"):
-                    if student.user:
-                        student.user.username = new_username
-                        student.user.password = new_password
-                    student.name = new_name
-                    student.roll_no = new_roll
-                    student.class_name = new_class
-                    db.commit()
-                    st.success(f"Student {new_name}'s details successfully updated!")
-            with c2:
-                if st.button("Remove Student", use_container_width=True, key="faculty_remove_student"):
-                    if student.images_path and os.path.exists(student.images_path):
-                        import shutil
-                        shutil.rmtree(student.images_path)
-                    if student.user:
-                        db.delete(student.user)
-                    db.delete(student)
-                    db.commit()
-                    st.success(f"Student {choice} totally removed from system!")
-
-    db.close()
+                st.write("")
+                c1, c2 = st.columns(2)
+                with c1:
+                    if st.button("Update Student", use_container_width=True, type="primary", key="faculty_update_student"):
+                        if student.user:
+                            invalidate_logins(student.user.username, new_username)
+                            student.user.username = new_username
+                            if new_password:
+                                student.user.password = hash_password(new_password)
+                        old_class = student.class_name
+                        student.name = new_name
+                        student.roll_no = new_roll
+                        student.class_name = new_class
+                        db.commit()
+                        update_student_caches(db, student, old_class=old_class)
+                        st.success(f"Student {new_name}'s details successfully updated!")
+                with c2:
+                    if st.button("Remove Student", use_container_width=True, key="faculty_remove_student"):
+                        removed_class = student.class_name
+                        removed_id = student.id
+                        if student.images_path and os.path.exists(student.images_path):
+                            import shutil
+                            shutil.rmtree(student.images_path)
+                        orphaned = release_student_images(db, student)
+                        if student.user:
+                            invalidate_logins(student.user.username)
+                            db.delete(student.user)
+                        db.delete(student)
+                        db.commit()
+                        remove_image_files(orphaned)
+                        class_cache.remove_student(removed_class, removed_id)
+                        remove_student_from_index(removed_id)
+                        st.success(f"Student {choice} totally removed from system!")
+
+            st.markdown("### Face Images")
+            with st.container(border=True):
+                # Only the added images are encoded; the rest of the class is untouched
+                labels = {
+                    f"{name} (#{image_id})" + ("" if encoded else " - no face found"): image_id
+                    for image_id, name, _, encoded, _ in images
+                }
+                to_remove = st.multiselect("Remove Images", list(labels), key=f"faculty_remove_images_{student.id}")
+                new_files = st.file_uploader("Add Face Images", type=["jpg","jpeg","png"], accept_multiple_files=True,
+                                             key=f"faculty_add_images_{student.id}")
+                if st.button("Update Images", use_container_width=True, key="faculty_update_images"):
+                    if not to_remove and not new_files:
+                        st.error("Select images to remove or upload new ones.")
+                    elif len(to_remove) == len(images) and not new_files:
+                        st.error("A student needs at least one face image.")
+                    else:
+                        with st.spinner("Encoding face images..."):
+                            removed, report, refused = update_student_images(
+                                db, student, [(f.name, f.getvalue()) for f in new_files or []],
+                                [labels[label] for label in to_remove]
+                            )
+                        show_image_report(report)
+                        added = sum(outcome == "added" for _, outcome, _ in report)
+                        if refused:
+                            st.error("Nothing changed: a student needs at least one usable face image, "
+                                     "and none of the uploads can be used.")
+                        else:
+                            st.success(f"{student.name}: {added} image(s) added, {removed} removed.")
 
 
 # ----------------- Attendance -----------------
@@ -119,34 +167,79 @@ def post_attendance():
         with col2:
             class_name = st.text_input("Class Name", placeholder="e.g. CS101")
             
-        group_img = st.file_uploader("Upload Group Photo / Classroom View", type=["jpg","jpeg","png"])
+        group_imgs = st.file_uploader("Upload Group Photos / Classroom Views (several angles for large rooms)",
+                                      type=["jpg","jpeg","png","mp4","mov","avi","mkv","webm"],
+                                      accept_multiple_files=True,
+                                      help="A short video panning the room works too: everyone seen in the clip is matched once.")
+        one_to_one = st.checkbox("Credit each detected face to at most one student", value=True,
+                                 help="Prevents one face from marking several look-alike students Present.")
 
         st.write("")
         if st.button("Process & Submit Attendance", use_container_width=True, type="primary"):
-            if not session_name or not class_name or not group_img:
-                st.error("Please provide Session Name, Class Name, and a valid Group Photo.")
+            if not session_name or not class_name or not group_imgs:
+                st.error("Please provide Session Name, Class Name, and at least one valid Group Photo or video.")
                 return
             
-            # Save group image temporarily
-            group_path = "temp_group.jpg"
-            with open(group_path, "wb") as f:
-                f.write(group_img.getbuffer())
-            
-            try:
-                with st.spinner('Scanning faces and matching with database...'):
-                    db = SessionLocal()
-                    csv_path = mark_attendance(db, session_name, class_name, group_path)
-                    db.close()
-                
-                st.success(f"Attendance recorded successfully for {class_name} during {session_name}!")
-                with open(csv_path, "rb") as f:
-                    st.download_button("Download CSV Report", f, file_name=os.path.basename(csv_path))
-            except Exception as e:
-                st.error(f"Error processing images: {str(e)}")
-            finally:
-                # Clean up temp file
-                if os.path.exists(group_path):
-                    os.remove(group_path)
+            photos = [group_img.getvalue() for group_img in group_imgs]
+            key = upload_key(session_name, class_name, photos)
+
+            # Save group images temporarily (per request, so concurrent sessions don't collide);
+            # the job removes them once processed
+            temp_dir = tempfile.mkdtemp(prefix="attendance_")
+            group_paths = []
+            for i, (group_img, photo) in enumerate(zip(group_imgs, photos)):
+                group_path = os.path.join(temp_dir, f"group_{i}{os.path.splitext(group_img.name)[1]}")
+                with open(group_path, "wb") as f:
+                    f.write(photo)
+                group_paths.append(group_path)
+
+            mode = "assignment" if one_to_one else "independent"
+            job_id, created = submit_attendance_job(
+                session_name, class_name, group_paths, mode=mode,
+                submitted_by=st.session_state["user"]["id"], key=key
+            )
+            if created:
+                st.success(f"Attendance for {class_name} during {session_name} queued (job #{job_id}).")
+            else:
+                st.info(f"These photos were already submitted as job #{job_id}.")
+
+    attendance_jobs()
+
+
+def attendance_jobs():
+    jobs = recent_jobs(submitted_by=st.session_state["user"]["id"])
+    if not jobs:
+        return
+
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        st.markdown("### Recent Attendance Jobs")
+    with col2:
+        if st.button("Refresh Status", use_container_width=True):
+            st.rerun()
+
+    for job in jobs:
+        waited, ran = job_timings(job)
+        with st.container(border=True):
+            st.write(f"**#{job.id} {job.session_name}** | **Class:** {job.class_name} | "
+                     f"**Photos:** {job.photo_count} | **Status:** {job.status}")
+            if job.status == "queued":
+                st.caption(f"Waiting for a worker ({queue_position(job)} job(s) ahead, {waited:.0f}s so far)")
+            elif job.status == "running":
+                st.caption(f"Scanning faces and matching with database... ({ran:.0f}s)")
+            elif job.status == "failed":
+                st.error(f"Error processing images: {job.error}")
+            elif job.status == "done":
+                st.caption(f"Queued {waited:.1f}s, processed in {ran:.1f}s")
+                visitors = job_visitors(job)
+                if visitors:
+                    st.warning("Recognised students from other classes: " + ", ".join(
+                        f"{v['name']} ({v['roll_no']}, {v['class_name']})" for v in visitors
+                    ))
+                csv_bytes = job_csv_bytes(job)
+                if csv_bytes is not None:
+                    st.download_button("Download CSV Report", csv_bytes, file_name=os.path.basename(job.csv_path),
+                                       mime="text/csv", key=f"job_csv_{job.id}")
 
 # ----------------- Main -----------------
 def main():
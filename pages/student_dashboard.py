@@ -1,43 +1,117 @@
 import streamlit as st
 import os
-from utils.db_conn import SessionLocal
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import and_
+
+from utils.db_conn import session_scope
 from db.models import Student, AttendanceSession, AttendanceRecord
 
 CSV_DIR = "attendance_csvs"
 os.makedirs(CSV_DIR, exist_ok=True)
 
-def view_attendance():
-    db = SessionLocal()
-    student_id = st.session_state["user"]["id"]
-    student = db.query(Student).filter(Student.user_id == student_id).first()
-    if not student:
-        st.error("Student not found")
-        db.close()
+PAGE_SIZE = 20
+
+
+def attendance_history(db, student, start_date=None, end_date=None, page=0, page_size=PAGE_SIZE):
+    # One outer-joined query: every session of the student's class with the
+    # student's status (NULL when no record exists), newest first.
+    query = (
+        db.query(
+            AttendanceSession.id,
+            AttendanceSession.session_name,
+            AttendanceSession.timestamp,
+            AttendanceSession.csv_path,
+            AttendanceRecord.status
+        )
+        .outerjoin(
+            AttendanceRecord,
+            and_(
+                AttendanceRecord.session_id == AttendanceSession.id,
+                AttendanceRecord.student_id == student.id
+            )
+        )
+        .filter(AttendanceSession.class_name == student.class_name)
+    )
+    if start_date:
+        query = query.filter(AttendanceSession.timestamp >= datetime.combine(start_date, time.min))
+    if end_date:
+        query = query.filter(AttendanceSession.timestamp < datetime.combine(end_date + timedelta(days=1), time.min))
+
+    total = query.count()
+    rows = (
+        query.order_by(AttendanceSession.timestamp.desc(), AttendanceSession.id.desc())
+        .offset(page * page_size)
+        .limit(page_size)
+        .all()
+    )
+    return rows, total
+
+
+def csv_download(session_id, session_name, csv_path):
+    # CSV bytes are only read for the session the student asked for
+    if st.session_state.get("student_csv_session") != session_id:
+        if st.button(f"Get CSV ({session_name})", key=f"prepare_{session_id}"):
+            st.session_state["student_csv_session"] = session_id
+            st.rerun()
         return
-    st.subheader(f"Attendance for {student.name} ({student.roll_no}) - Class {student.class_name}")
 
-    sessions = db.query(AttendanceSession).filter(AttendanceSession.class_name == student.class_name).order_by(AttendanceSession.timestamp.desc()).all()
-    if not sessions:
+    if csv_path and os.path.exists(csv_path):
+        with open(csv_path, "rb") as f:
+            st.download_button(
+                label=f"Download CSV ({session_name})",
+                data=f.read(),
+                file_name=os.path.basename(csv_path),
+                mime="text/csv",
+                key=f"download_{session_id}"
+            )
+    else:
+        st.caption("CSV report not available")
+
+
+def view_attendance():
+    with session_scope() as db:
+        student_id = st.session_state["user"]["id"]
+        student = db.query(Student).filter(Student.user_id == student_id).first()
+        if not student:
+            st.error("Student not found")
+            return
+        st.subheader(f"Attendance for {student.name} ({student.roll_no}) - Class {student.class_name}")
+
+        dates = st.date_input("Filter by date range", value=(), key="student_date_range",
+                              on_change=lambda: st.session_state.update(student_page=0))
+        start_date = dates[0] if len(dates) > 0 else None
+        end_date = dates[1] if len(dates) > 1 else start_date
+
+        page = st.session_state.get("student_page", 0)
+        rows, total = attendance_history(db, student, start_date, end_date, page)
+
+    if not total:
         st.info("No attendance records yet")
-        db.close()
         return
 
-    for sess in sessions:
-        record = db.query(AttendanceRecord).filter(
-            AttendanceRecord.session_id == sess.id,
-            AttendanceRecord.student_id == student.id
-        ).first()
-        status = record.status if record else "Absent"
-        st.write(f"**Session:** {sess.session_name} | **Date:** {sess.timestamp.date()} | **Status:** {status}")
-        if sess.csv_path and os.path.exists(sess.csv_path):
-            with open(sess.csv_path, "rb") as f:
-                st.download_button(
-                    label=f"Download CSV ({sess.session_name})",
-                    data=f,
-                    file_name=os.path.basename(sess.csv_path),
-                    key=f"download_{sess.id}"
-                )
-    db.close()
+    pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+    if page >= pages:
+        st.session_state["student_page"] = pages - 1
+        st.rerun()
+
+    for session_id, session_name, timestamp, csv_path, status in rows:
+        status = status or "Absent"
+        st.write(f"**Session:** {session_name} | **Date:** {timestamp.date()} | **Status:** {status}")
+        if csv_path:
+            csv_download(session_id, session_name, csv_path)
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("Previous", disabled=page == 0, use_container_width=True):
+            st.session_state["student_page"] = page - 1
+            st.rerun()
+    with col2:
+        st.caption(f"Page {page + 1} of {pages} ({total} sessions)")
+    with col3:
+        if st.button("Next", disabled=page >= pages - 1, use_container_width=True):
+            st.session_state["student_page"] = page + 1
+            st.rerun()
 
 def main():
     if "user" not in st.session_state or st.session_state["user"]["role"] != "student":
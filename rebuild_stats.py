@@ -0,0 +1,9 @@
+# rebuild_stats.py
+# Backfills student_attendance_stats from the full attendance history.
+from utils.db_conn import session_scope, create_tables
+from utils.attendance_stats import rebuild_attendance_stats
+
+create_tables()
+with session_scope() as db:
+    count = rebuild_attendance_stats(db)
+print(f"✅ Rebuilt attendance totals for {count} student/class pairs")
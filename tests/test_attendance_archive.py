@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pyarrow", exc_type=ImportError)
+
+from sqlalchemy.orm import sessionmaker
+
+from db.models import Base, Student, FaceEncoding
+from utils.db_conn import build_engine
+from utils import face_utils
+from utils.attendance_archive import ARCHIVE_DIR, import_csv_dir, read_attendance
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # record_attendance writes attendance_csvs/ and the archive relative to
+    # the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(face_utils.CSV_DIR)
+    engine = build_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def test_recorded_session_is_not_imported_again(db):
+    rng = np.random.default_rng(0)
+    encodings = rng.normal(size=(2, 128)) * 0.05
+    for i, encoding in enumerate(encodings):
+        student = Student(name=f"S{i}", roll_no=f"ARCHIVE{i}", class_name="ARCHIVE_TEST")
+        db.add(student)
+        db.flush()
+        db.add(FaceEncoding(student_id=student.id, file_name="a.jpg", image_hash=f"h{i}", file_size=1,
+                            file_mtime=0, encoding=face_utils.encoding_to_bytes(encoding)))
+    db.commit()
+
+    face_utils.record_attendance(db, "Lecture 1", "ARCHIVE_TEST", [], per_photo=[encodings[:1]])
+    assert read_attendance(archive_dir=ARCHIVE_DIR).num_rows == 2
+
+    imported, duplicates, unreadable = import_csv_dir(face_utils.CSV_DIR, db)
+
+    assert (imported, duplicates, unreadable) == (0, 1, [])
+    archived = read_attendance(archive_dir=ARCHIVE_DIR)
+    assert archived.num_rows == 2
+    assert set(archived.column("source").to_pylist()) == {"app"}
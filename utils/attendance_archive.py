@@ -0,0 +1,263 @@
+import os
+import re
+import csv
+import uuid
+import hashlib
+from datetime import datetime, date, time
+
+# Append-only columnar copy of every attendance record, for reports that
+# span many sessions. One Parquet file per session, partitioned by day:
+#   attendance_archive/date=2026-02-13/part-<session>-<uuid>.parquet
+# compact_archive() merges each day into a single file. Readers filter on
+# the date partition and on column statistics, so a class/term report reads
+# only the files and row groups it needs.
+ARCHIVE_DIR = "attendance_archive"
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("session_id", pa.int64()),
+        ("session_name", pa.string()),
+        ("class_name", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+        ("student_id", pa.int64()),
+        ("student_name", pa.string()),
+        ("roll_no", pa.string()),
+        ("status", pa.string()),
+        ("confidence", pa.float64()),
+        # "app" for sessions recorded by the app, "csv:<sha256>" for imports
+        ("source", pa.string()),
+    ])
+
+
+def _partition_dir(archive_dir, day):
+    return os.path.join(archive_dir, f"date={day.isoformat()}")
+
+
+def _write_table(table, folder, name):
+    import pyarrow.parquet as pq
+
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    # dot-prefixed so dataset discovery never picks up a half-written file
+    tmp_path = os.path.join(folder, "." + name + ".tmp")
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+    return path
+
+
+# ---------------------------
+# WRITE
+# ---------------------------
+def append_session(session_id, session_name, class_name, timestamp, rows, source="app",
+                   archive_dir=ARCHIVE_DIR):
+    # rows are (student_id, student_name, roll_no, status, confidence), as
+    # produced by face_utils.attendance_rows. Returns the file written, or
+    # None when there are no rows.
+    import pyarrow as pa
+
+    rows = list(rows)
+    if not rows:
+        return None
+    student_ids, names, roll_nos, statuses, confidences = zip(*rows)
+    table = pa.table({
+        "session_id": [session_id] * len(rows),
+        "session_name": [session_name] * len(rows),
+        "class_name": [class_name] * len(rows),
+        "timestamp": [timestamp] * len(rows),
+        "student_id": list(student_ids),
+        "student_name": list(names),
+        "roll_no": list(roll_nos),
+        "status": list(statuses),
+        "confidence": list(confidences),
+        "source": [source] * len(rows),
+    }, schema=_schema())
+
+    name = f"part-{session_id if session_id is not None else 'import'}-{uuid.uuid4().hex[:8]}.parquet"
+    return _write_table(table, _partition_dir(archive_dir, timestamp.date()), name)
+
+
+def compact_archive(archive_dir=ARCHIVE_DIR):
+    # Rewrites every day with several files as one file, sorted by class and
+    # time so row-group statistics prune well. Returns the number of files
+    # removed. Run it when nothing else writes to the archive.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    removed = 0
+    if not os.path.isdir(archive_dir):
+        return removed
+    for partition in sorted(os.listdir(archive_dir)):
+        folder = os.path.join(archive_dir, partition)
+        parts = sorted(f for f in os.listdir(folder) if f.endswith(".parquet"))
+        if len(parts) < 2:
+            continue
+        table = pa.concat_tables(
+            [pq.read_table(os.path.join(folder, p), schema=_schema()) for p in parts]
+        ).sort_by([("class_name", "ascending"), ("timestamp", "ascending")])
+        _write_table(table, folder, f"part-compacted-{uuid.uuid4().hex[:8]}.parquet")
+        for part in parts:
+            os.remove(os.path.join(folder, part))
+        removed += len(parts) - 1
+    return removed
+
+
+# ---------------------------
+# READ
+# ---------------------------
+def _dataset(archive_dir):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([("date", pa.date32())]), flavor="hive")
+    return ds.dataset(archive_dir, format="parquet", partitioning=partitioning,
+                      schema=_schema().append(pa.field("date", pa.date32())))
+
+
+def read_attendance(class_names=None, start=None, end=None, student_ids=None, columns=None,
+                    archive_dir=ARCHIVE_DIR):
+    # pyarrow Table of the archived records matching every given filter.
+    # start/end are inclusive dates. The date filter skips whole partitions
+    # without opening them; the others are pushed down to the Parquet row
+    # groups.
+    import pyarrow.dataset as ds
+
+    columns = columns or _schema().names
+    if not os.path.isdir(archive_dir):
+        return _schema().empty_table().select(columns)
+
+    condition = ds.scalar(True)
+    if start is not None:
+        condition &= ds.field("date") >= start
+    if end is not None:
+        condition &= ds.field("date") <= end
+    if class_names is not None:
+        condition &= ds.field("class_name").isin(list(class_names))
+    if student_ids is not None:
+        condition &= ds.field("student_id").isin(list(student_ids))
+
+    return _dataset(archive_dir).to_table(columns=columns, filter=condition)
+
+
+def term_report(class_name, start=None, end=None, archive_dir=ARCHIVE_DIR):
+    # Per-student totals of one class over a date range from the archive:
+    # [{student_id, roll_no, student_name, held, present, percentage}]
+    import pyarrow.compute as pc
+
+    table = read_attendance(
+        class_names=[class_name], start=start, end=end,
+        columns=["student_id", "student_name", "roll_no", "status"], archive_dir=archive_dir
+    )
+    if not table.num_rows:
+        return []
+
+    table = table.append_column("present", pc.cast(pc.equal(table["status"], "Present"), "int64"))
+    totals = table.group_by(["student_id"]).aggregate([
+        ("status", "count"), ("present", "sum"), ("roll_no", "max"), ("student_name", "max")
+    ]).to_pylist()
+
+    return sorted(
+        (
+            {
+                "student_id": t["student_id"],
+                "roll_no": t["roll_no_max"],
+                "student_name": t["student_name_max"],
+                "held": t["status_count"],
+                "present": t["present_sum"],
+                "percentage": 100.0 * t["present_sum"] / t["status_count"],
+            }
+            for t in totals
+        ),
+        key=lambda r: (r["roll_no"] or "", r["student_id"])
+    )
+
+
+# ---------------------------
+# CSV IMPORT
+# ---------------------------
+# attendance_csvs/ holds "<date>_<session>_<class>.csv" files, some of them
+# browser re-downloads named "... (1).csv". Every distinct file content is
+# imported once; identical copies, and the CSVs of sessions the app already
+# archived when recording them, are skipped.
+CSV_NAME = re.compile(r"^(\d{4}-\d{2}-\d{2})_(.+)_([^_]+?)(?: \(\d+\))?\.csv$")
+
+
+def _archived(archive_dir):
+    # (sources, session ids) already in the archive
+    table = read_attendance(columns=["source", "session_id"], archive_dir=archive_dir)
+    if not table.num_rows:
+        return set(), set()
+    return (
+        set(table.column("source").unique().to_pylist()),
+        set(table.column("session_id").drop_null().unique().to_pylist()),
+    )
+
+
+def import_csv_dir(csv_dir, db=None, archive_dir=ARCHIVE_DIR):
+    # Returns (files imported, duplicate files skipped, unreadable files).
+    # With a db session, student names/roll numbers missing from old CSVs and
+    # the session ids and timestamps are looked up by csv_path.
+    from db.models import Student, AttendanceSession
+
+    done, archived_sessions = _archived(archive_dir)
+    imported = duplicates = 0
+    unreadable = []
+
+    sessions = {}
+    students = {}
+    if db is not None:
+        for session in db.query(AttendanceSession).filter(AttendanceSession.csv_path.isnot(None)):
+            sessions[os.path.basename(session.csv_path)] = session
+        students = {s.id: s for s in db.query(Student)}
+
+    for file_name in sorted(os.listdir(csv_dir)):
+        match = CSV_NAME.match(file_name)
+        if not match:
+            continue
+        path = os.path.join(csv_dir, file_name)
+        with open(path, "rb") as f:
+            content = f.read()
+        source = "csv:" + hashlib.sha256(content).hexdigest()
+        if source in done:
+            duplicates += 1
+            continue
+
+        day, session_name, class_name = match.groups()
+        canonical = f"{day}_{session_name}_{class_name}.csv"
+        session = sessions.get(canonical)
+        # sessions recorded by the app are archived as they are recorded, so
+        # their CSV (or a re-download of it) is a copy of what is there
+        if session is not None and session.id in archived_sessions:
+            duplicates += 1
+            continue
+        timestamp = session.timestamp if session else datetime.combine(date.fromisoformat(day), time.min)
+
+        try:
+            rows = []
+            for record in csv.DictReader(content.decode("utf-8-sig").splitlines()):
+                student_id = int(record["student_id"])
+                student = students.get(student_id)
+                confidence = record.get("confidence")
+                rows.append((
+                    student_id,
+                    record.get("student_name") or (student.name if student else None),
+                    record.get("roll_no") or (student.roll_no if student else None),
+                    record["status"],
+                    float(confidence) if confidence else None,
+                ))
+        except (KeyError, ValueError, UnicodeDecodeError) as e:
+            unreadable.append((file_name, str(e)))
+            continue
+        if not rows:
+            continue
+
+        append_session(session.id if session else None, session_name, class_name, timestamp, rows,
+                       source=source, archive_dir=archive_dir)
+        done.add(source)
+        if session is not None:
+            archived_sessions.add(session.id)
+        imported += 1
+
+    return imported, duplicates, unreadable
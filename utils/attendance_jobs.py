@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import socket
+import shutil
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import or_
+
+from utils.db_conn import session_scope
+from utils.metrics import tagged
+from db.models import AttendanceJob
+
+# Jobs share this many workers across every faculty session of the server;
+# the rest wait in the queue instead of each spiking the CPU.
+JOB_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# CSV reports of the most recent jobs, served to the download button from
+# memory instead of being read back from attendance_csvs/
+CSV_RESULTS_KEPT = 32
+_csv_results = OrderedDict()
+_csv_results_lock = threading.Lock()
+
+# Every server process refreshes the heartbeat of the jobs it owns; an
+# active job whose heartbeat is older than JOB_STALE_AFTER belongs to a
+# process that is gone, so other servers on the same database leave each
+# other's jobs alone
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+HEARTBEAT_INTERVAL = 30
+JOB_STALE_AFTER = 120
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _fail_orphaned_jobs()
+            threading.Thread(target=_heartbeat_loop, name="attendance-job-heartbeat", daemon=True).start()
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="attendance-job")
+        return _executor
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        try:
+            with session_scope() as db:
+                db.query(AttendanceJob).filter(
+                    AttendanceJob.worker == WORKER_ID, AttendanceJob.status.in_(ACTIVE_STATUSES)
+                ).update({"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+            _fail_orphaned_jobs()
+        except Exception as e:
+            print(f"❌ Attendance job heartbeat failed: {e}")
+
+
+def _fail_orphaned_jobs():
+    # Jobs left queued/running by a server process that stopped will never
+    # finish; jobs without a heartbeat predate heartbeats
+    stale = datetime.utcnow() - timedelta(seconds=JOB_STALE_AFTER)
+    with session_scope() as db:
+        orphaned = db.query(AttendanceJob).filter(
+            AttendanceJob.status.in_(ACTIVE_STATUSES),
+            or_(AttendanceJob.heartbeat_at.is_(None), AttendanceJob.heartbeat_at < stale)
+        ).update(
+            {"status": "failed", "error": "Interrupted: the server processing it stopped",
+             "finished_at": datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.commit()
+    if orphaned:
+        print(f"⚠️  Marked {orphaned} orphaned attendance job(s) as failed")
+
+
+def upload_key(session_name, class_name, photos):
+    # Identifies one submission, so a Streamlit rerun can't queue it twice
+    digest = hashlib.sha256(f"{session_name}\0{class_name}".encode())
+    for photo in photos:
+        digest.update(hashlib.sha256(photo).digest())
+    return digest.hexdigest()
+
+
+# ---------------------------
+# SUBMIT
+# ---------------------------
+def submit_attendance_job(session_name, class_name, group_img_paths, mode="independent",
+                          submitted_by=None, key=None):
+    # The job takes ownership of group_img_paths and deletes their directory
+    # when it finishes. Returns (job_id, created).
+    executor = _get_executor()
+
+    with session_scope() as db:
+        if key:
+            existing = db.query(AttendanceJob).filter(
+                AttendanceJob.upload_key == key,
+                AttendanceJob.status != "failed"
+            ).first()
+            if existing:
+                _cleanup(group_img_paths)
+                return existing.id, False
+
+        job = AttendanceJob(
+            session_name=session_name,
+            class_name=class_name,
+            mode=mode,
+            photo_count=len(group_img_paths),
+            upload_key=key,
+            submitted_by=submitted_by,
+            status="queued",
+            worker=WORKER_ID,
+            heartbeat_at=datetime.utcnow()
+        )
+        db.add(job)
+        db.commit()
+        job_id = job.id
+
+    executor.submit(_run_job, job_id, list(group_img_paths))
+    return job_id, True
+
+
+def _cleanup(group_img_paths):
+    for folder in {os.path.dirname(p) for p in group_img_paths}:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# ---------------------------
+# WORKER
+# ---------------------------
+def _run_job(job_id, group_img_paths):
+    from utils.face_utils import record_attendance
+    from utils.video_attendance import is_video, encode_session_media
+
+    try:
+        with session_scope() as db:
+            job = db.get(AttendanceJob, job_id)
+            job.status = "running"
+            job.started_at = datetime.utcnow()
+            db.commit()
+
+            # Uploads may include classroom video clips next to the photos
+            per_photo = None
+            if any(is_video(p) for p in group_img_paths):
+                with tagged(session=job.session_name, class_name=job.class_name):
+                    per_photo = encode_session_media(group_img_paths)
+            csv_path, csv_bytes, visitors = record_attendance(
+                db, job.session_name, job.class_name, group_img_paths, mode=job.mode, per_photo=per_photo
+            )
+            with _csv_results_lock:
+                _csv_results[job_id] = csv_bytes
+                while len(_csv_results) > CSV_RESULTS_KEPT:
+                    _csv_results.popitem(last=False)
+
+            job = db.get(AttendanceJob, job_id)
+            job.status = "done"
+            job.csv_path = csv_path
+            job.visitors = json.dumps(visitors) if visitors else None
+            job.finished_at = datetime.utcnow()
+            db.commit()
+    except Exception as e:
+        print(f"❌ Attendance job {job_id} failed: {e}")
+        with session_scope() as db:
+            job = db.get(AttendanceJob, job_id)
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            db.commit()
+    finally:
+        _cleanup(group_img_paths)
+
+
+def detach_user_jobs(db, user_id):
+    # Keeps a faculty member's job history when their account is removed;
+    # tables created before submitted_by was declared ON DELETE SET NULL
+    # still carry the plain foreign key. The caller commits.
+    db.query(AttendanceJob).filter(AttendanceJob.submitted_by == user_id).update(
+        {"submitted_by": None}, synchronize_session=False
+    )
+
+
+# ---------------------------
+# STATUS
+# ---------------------------
+def recent_jobs(submitted_by=None, limit=10):
+    with session_scope() as db:
+        query = db.query(AttendanceJob)
+        if submitted_by is not None:
+            query = query.filter(AttendanceJob.submitted_by == submitted_by)
+        return query.order_by(AttendanceJob.created_at.desc()).limit(limit).all()
+
+
+def queue_position(job):
+    # Number of jobs queued ahead of this one
+    if job.status != "queued":
+        return 0
+    with session_scope() as db:
+        return db.query(AttendanceJob).filter(
+            AttendanceJob.status == "queued",
+            AttendanceJob.id < job.id
+        ).count()
+
+
+def job_csv_bytes(job):
+    with _csv_results_lock:
+        csv_bytes = _csv_results.get(job.id)
+    if csv_bytes is None and job.csv_path and os.path.exists(job.csv_path):
+        with open(job.csv_path, "rb") as f:
+            csv_bytes = f.read()
+    return csv_bytes
+
+
+def job_visitors(job):
+    return json.loads(job.visitors) if job.visitors else []
+
+
+def job_timings(job):
+    now = datetime.utcnow()
+    waited = ((job.started_at or now) - job.created_at).total_seconds() if job.created_at else 0.0
+    ran = ((job.finished_at or now) - job.started_at).total_seconds() if job.started_at else 0.0
+    return waited, ran
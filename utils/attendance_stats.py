@@ -0,0 +1,130 @@
+from sqlalchemy import insert, update, delete, select, func, case
+
+from db.models import Student, AttendanceSession, AttendanceRecord, StudentAttendanceStat
+
+DEFAULTER_THRESHOLD = 75.0
+
+
+# ---------------------------
+# INCREMENTAL UPDATE
+# ---------------------------
+def _insert_missing(db):
+    # INSERT of stats rows that leaves rows already present untouched
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+        # no-op update instead of INSERT IGNORE, which would also swallow
+        # foreign-key errors
+        stmt = mysql_insert(StudentAttendanceStat)
+        return stmt.on_duplicate_key_update(sessions_held=StudentAttendanceStat.sessions_held)
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(StudentAttendanceStat).on_conflict_do_nothing()
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(StudentAttendanceStat).on_conflict_do_nothing()
+    raise ValueError(f"Unsupported database backend for attendance stats: {dialect}")
+
+
+def update_attendance_stats(db, class_name, attendance, timestamp):
+    # Fold one new session into the per-student totals. Runs inside the
+    # caller's transaction; O(students in the session).
+    if not attendance:
+        return
+
+    student_ids = list(attendance)
+    present_ids = [sid for sid, status in attendance.items() if status == "Present"]
+
+    # Two sessions of a class can be recorded at once, so rows missing for
+    # both are created with an insert that skips existing keys rather than
+    # checked for first
+    db.execute(_insert_missing(db), [
+        {"student_id": sid, "class_name": class_name, "sessions_held": 0, "sessions_present": 0}
+        for sid in student_ids
+    ])
+
+    in_class = StudentAttendanceStat.class_name == class_name
+    db.execute(
+        update(StudentAttendanceStat)
+        .where(in_class, StudentAttendanceStat.student_id.in_(student_ids))
+        .values(sessions_held=StudentAttendanceStat.sessions_held + 1)
+    )
+    if present_ids:
+        db.execute(
+            update(StudentAttendanceStat)
+            .where(in_class, StudentAttendanceStat.student_id.in_(present_ids))
+            .values(sessions_present=StudentAttendanceStat.sessions_present + 1, last_seen=timestamp)
+        )
+
+
+# ---------------------------
+# BACKFILL
+# ---------------------------
+def rebuild_attendance_stats(db):
+    # Recompute every total from attendance_records in one INSERT ... SELECT
+    is_present = AttendanceRecord.status == "Present"
+    totals = (
+        select(
+            AttendanceRecord.student_id,
+            AttendanceSession.class_name,
+            func.count(AttendanceRecord.id),
+            func.sum(case((is_present, 1), else_=0)),
+            func.max(case((is_present, AttendanceSession.timestamp), else_=None))
+        )
+        .join(AttendanceSession, AttendanceSession.id == AttendanceRecord.session_id)
+        .join(Student, Student.id == AttendanceRecord.student_id)
+        .group_by(AttendanceRecord.student_id, AttendanceSession.class_name)
+    )
+
+    db.execute(delete(StudentAttendanceStat))
+    db.execute(
+        insert(StudentAttendanceStat).from_select(
+            ["student_id", "class_name", "sessions_held", "sessions_present", "last_seen"],
+            totals
+        )
+    )
+    db.commit()
+    return db.query(StudentAttendanceStat).count()
+
+
+# ---------------------------
+# REPORTS
+# ---------------------------
+def _percentage():
+    return case(
+        (StudentAttendanceStat.sessions_held > 0,
+         100.0 * StudentAttendanceStat.sessions_present / StudentAttendanceStat.sessions_held),
+        else_=0.0
+    )
+
+
+def attendance_report(db, class_name=None, below=None):
+    # Rows of (roll_no, name, class_name, held, present, percentage, last_seen)
+    # read from the aggregates only. below= keeps students under that
+    # percentage (the defaulter list).
+    percentage = _percentage().label("percentage")
+    query = (
+        db.query(
+            Student.roll_no,
+            Student.name,
+            StudentAttendanceStat.class_name,
+            StudentAttendanceStat.sessions_held,
+            StudentAttendanceStat.sessions_present,
+            percentage,
+            StudentAttendanceStat.last_seen
+        )
+        .join(Student, Student.id == StudentAttendanceStat.student_id)
+    )
+    if class_name:
+        query = query.filter(StudentAttendanceStat.class_name == class_name)
+    if below is not None:
+        query = query.filter(_percentage() < below)
+        return query.order_by(percentage, Student.roll_no).all()
+    return query.order_by(StudentAttendanceStat.class_name, Student.roll_no).all()
+
+
+def report_classes(db):
+    return [
+        c for (c,) in db.query(StudentAttendanceStat.class_name).distinct().order_by(StudentAttendanceStat.class_name)
+    ]
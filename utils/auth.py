@@ -0,0 +1,85 @@
+import os
+import hmac
+import time
+import hashlib
+import threading
+
+from utils.db_conn import session_scope
+from db.models import User
+
+# Stored passwords are "pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>".
+# Rows created before hashing still hold the plaintext; they are checked as
+# such and rehashed on the next successful login.
+HASH_SCHEME = "pbkdf2_sha256"
+PBKDF2_ITERATIONS = 200000
+
+# Successful logins are remembered for this long, so repeated logins (and
+# Streamlit reruns of the login form) skip the database and the hash
+LOGIN_CACHE_TTL = 300
+
+_login_cache = {}
+_login_cache_lock = threading.Lock()
+# Cache keys are HMACs under a per-process key, never the password itself
+_cache_key_secret = os.urandom(32)
+
+
+# ---------------------------
+# PASSWORD HASHING
+# ---------------------------
+def hash_password(password, iterations=PBKDF2_ITERATIONS):
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{HASH_SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def is_hashed(stored):
+    return stored.startswith(HASH_SCHEME + "$")
+
+
+def verify_password(password, stored):
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+
+    _, iterations, salt, expected = stored.split("$")
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+# ---------------------------
+# LOGIN
+# ---------------------------
+def _cache_key(username, password):
+    return hmac.new(_cache_key_secret, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+
+def authenticate(username, password):
+    # Returns {"id", "username", "role"} or None
+    key = _cache_key(username, password)
+    now = time.monotonic()
+    with _login_cache_lock:
+        cached = _login_cache.get(key)
+        if cached is not None and cached[1] > now:
+            return dict(cached[0])
+
+    with session_scope() as db:
+        user = db.query(User).filter(User.username == username).first()
+        if user is None or not verify_password(password, user.password):
+            return None
+        if not is_hashed(user.password):
+            user.password = hash_password(password)
+            db.commit()
+        session_user = {"id": user.id, "username": user.username, "role": user.role}
+
+    with _login_cache_lock:
+        # drop expired entries so the cache stays small
+        for stale in [k for k, (_, expires) in _login_cache.items() if expires <= now]:
+            del _login_cache[stale]
+        _login_cache[key] = (session_user, now + LOGIN_CACHE_TTL)
+    return dict(session_user)
+
+
+def invalidate_logins(*usernames):
+    # Call after a user's username or password changes, or the user is removed
+    with _login_cache_lock:
+        for key in [k for k, (user, _) in _login_cache.items() if user["username"] in usernames]:
+            del _login_cache[key]
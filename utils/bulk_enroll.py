@@ -0,0 +1,276 @@
+import os
+import io
+import csv
+import json
+import shutil
+import hashlib
+import zipfile
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from utils.db_conn import session_scope
+from db.models import User, Student, FaceEncoding, EnrollmentImport
+from utils.class_cache import class_cache
+from utils.face_index import add_student_to_index
+from utils.auth import hash_password
+from utils.face_utils import IMAGE_EXTENSIONS, encoding_to_bytes, encoding_from_bytes, get_process_pool
+from utils.face_quality import assess_student_image, quality_to_json
+from utils.image_store import write_image, add_image_refs
+
+MANIFEST_COLUMNS = ("roll_no", "name", "class_name", "username", "password")
+
+# Students written per transaction; an interrupted import loses at most one
+# batch and re-running it skips everyone already enrolled.
+ENROLL_BATCH_SIZE = 200
+
+
+def import_key(zip_bytes, manifest_bytes):
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(zip_bytes).digest())
+    digest.update(hashlib.sha256(manifest_bytes).digest())
+    return digest.hexdigest()
+
+
+# ---------------------------
+# MANIFEST
+# ---------------------------
+# CSV with a header row: roll_no, name, class_name, username, password.
+# username defaults to the roll number when left empty.
+def read_manifest(manifest_bytes):
+    # Returns (rows, failures)
+    reader = csv.DictReader(io.StringIO(manifest_bytes.decode("utf-8-sig")))
+    missing = [c for c in MANIFEST_COLUMNS if c != "username" and c not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Manifest is missing column(s): {', '.join(missing)}")
+
+    # Students of one batch are inserted together, so a repeated username
+    # must fail its line here rather than the whole batch on every resume
+    rows, failures, seen, seen_users = [], [], set(), set()
+    for line_no, raw in enumerate(reader, start=2):
+        row = {c: (raw.get(c) or "").strip() for c in MANIFEST_COLUMNS}
+        row["username"] = row["username"] or row["roll_no"]
+        if not all(row[c] for c in MANIFEST_COLUMNS):
+            failures.append({"roll_no": row["roll_no"], "reason": f"line {line_no}: missing fields"})
+        elif row["roll_no"] in seen:
+            failures.append({"roll_no": row["roll_no"], "reason": f"line {line_no}: duplicate roll number"})
+        elif row["username"] in seen_users:
+            failures.append({"roll_no": row["roll_no"],
+                             "reason": f"line {line_no}: duplicate username {row['username']}"})
+        else:
+            seen.add(row["roll_no"])
+            seen_users.add(row["username"])
+            rows.append(row)
+    return rows, failures
+
+
+# ---------------------------
+# ZIP OF IMAGE FOLDERS
+# ---------------------------
+# One folder per roll number, at any depth (e.g. "CS101/2023CS001/a.jpg").
+# Members are written under our own names, never the paths from the archive.
+def extract_images(zip_file, dest):
+    # Returns {roll_no: [image paths]}
+    images = {}
+    with zipfile.ZipFile(zip_file) as archive:
+        for member in archive.infolist():
+            parts = member.filename.replace("\\", "/").split("/")
+            if member.is_dir() or len(parts) < 2 or not parts[-1].lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            roll_no, file_name = parts[-2], os.path.basename(parts[-1])
+            folder = os.path.join(dest, hashlib.sha1(roll_no.encode()).hexdigest())
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, file_name)
+            with archive.open(member) as src, open(path, "wb") as out:
+                shutil.copyfileobj(src, out)
+            images.setdefault(roll_no, []).append(path)
+    return images
+
+
+# ---------------------------
+# PARALLEL ENCODING
+# ---------------------------
+def encode_enrollment_image(img_path):
+    # Runs in a pool worker. Returns (quality, encoding bytes, stored); only
+    # images that pass the quality check (see face_quality) are encoded and
+    # written to the image store, stored being write_image()'s
+    # (hash, size, width, height).
+    with open(img_path, "rb") as f:
+        data = f.read()
+    encoding, quality = assess_student_image(data)
+    if encoding is None:
+        return quality, None, None
+    return quality, encoding_to_bytes(encoding), write_image(data)
+
+
+def _image_problem(file_name, quality):
+    return f"{file_name}: " + ", ".join(quality["problems"])
+
+
+# ---------------------------
+# BATCH INSERT
+# ---------------------------
+def _enroll_batch(db, batch, images):
+    # Returns (enrolled students, skipped count, failures)
+    roll_nos = [r["roll_no"] for r in batch]
+    usernames = [r["username"] for r in batch]
+    enrolled_rolls = {r for (r,) in db.query(Student.roll_no).filter(Student.roll_no.in_(roll_nos))}
+    taken_users = {u for (u,) in db.query(User.username).filter(User.username.in_(usernames))}
+
+    failures = []
+    pending = []
+    for row in batch:
+        if row["roll_no"] in enrolled_rolls:
+            continue
+        if row["username"] in taken_users:
+            failures.append({"roll_no": row["roll_no"], "reason": f"username {row['username']} already exists"})
+        elif not images.get(row["roll_no"]):
+            failures.append({"roll_no": row["roll_no"], "reason": "no images in the ZIP"})
+        else:
+            pending.append(row)
+    skipped = len(batch) - len(pending) - len(failures)
+    if not pending:
+        return [], skipped, failures
+
+    paths = [p for row in pending for p in images[row["roll_no"]]]
+    if len(paths) > 1:
+        encoded = get_process_pool().map(encode_enrollment_image, paths, chunksize=4)
+    else:
+        encoded = map(encode_enrollment_image, paths)
+    results = dict(zip(paths, encoded))
+
+    accepted = []
+    for row in pending:
+        good, problems, seen = [], [], set()
+        for path in images[row["roll_no"]]:
+            quality, blob, stored = results[path]
+            if blob is None:
+                problems.append(_image_problem(os.path.basename(path), quality))
+            elif stored[0] not in seen:
+                seen.add(stored[0])
+                good.append((path, blob, stored, quality))
+        if good:
+            accepted.append((row, good))
+        if problems:
+            failures.append({
+                "roll_no": row["roll_no"],
+                "reason": ("not enrolled: " if not good else "image(s) skipped: ") + "; ".join(problems)
+            })
+    if not accepted:
+        return [], skipped, failures
+
+    # PBKDF2 is deliberately slow, so the hashes are spread over the pool too
+    hashes = get_process_pool().map(hash_password, [row["password"] for row, _ in accepted], chunksize=16)
+    db.execute(insert(User), [
+        {"username": row["username"], "password": password_hash, "role": "student"}
+        for (row, _), password_hash in zip(accepted, hashes)
+    ])
+    user_ids = dict(db.query(User.username, User.id).filter(
+        User.username.in_([row["username"] for row, _ in accepted])
+    ))
+    db.execute(insert(Student), [
+        {"name": row["name"], "roll_no": row["roll_no"], "class_name": row["class_name"],
+         "user_id": user_ids[row["username"]]}
+        for row, _ in accepted
+    ])
+    student_ids = dict(db.query(Student.roll_no, Student.id).filter(
+        Student.roll_no.in_([row["roll_no"] for row, _ in accepted])
+    ))
+
+    # The images are already in the store; the rows reference them by hash.
+    # If the batch rolls back the stored files stay unreferenced, and the
+    # next run of the import reuses them.
+    students, encoding_rows = [], []
+    for row, good in accepted:
+        student_id = student_ids[row["roll_no"]]
+        encodings = []
+        for path, blob, (digest, size, _, _), quality in good:
+            encoding_rows.append({
+                "student_id": student_id, "file_name": os.path.basename(path), "image_hash": digest,
+                "file_size": size, "file_mtime": 0, "encoding": blob, "quality": quality_to_json(quality)
+            })
+            encodings.append(encoding_from_bytes(blob))
+        students.append((student_id, row["class_name"], encodings))
+
+    add_image_refs(db, [stored for _, good in accepted for _, _, stored, _ in good])
+    db.execute(insert(FaceEncoding), encoding_rows)
+    return students, skipped, failures
+
+
+# ---------------------------
+# IMPORT
+# ---------------------------
+def bulk_enroll(zip_file, manifest_bytes, key=None, progress=None):
+    # zip_file is a path or file object. progress(processed, total) is called
+    # after every batch. Returns the EnrollmentImport row.
+    rows, manifest_failures = read_manifest(manifest_bytes)
+
+    with session_scope() as db:
+        record = None
+        if key:
+            record = db.query(EnrollmentImport).filter(EnrollmentImport.import_key == key).first()
+        if record is None:
+            record = EnrollmentImport(import_key=key or hashlib.sha256(manifest_bytes).hexdigest())
+            db.add(record)
+        elif record.status != "done":
+            print(f"Resuming enrollment import #{record.id}")
+        record.status = "running"
+        record.total = len(rows)
+        record.processed = record.enrolled = record.skipped = 0
+        record.failures = None
+        record.error = None
+        record.finished_at = None
+        db.commit()
+        import_id = record.id
+
+    staging = tempfile.mkdtemp(prefix="enroll_")
+    failures = list(manifest_failures)
+    enrolled = skipped = 0
+    try:
+        images = extract_images(zip_file, staging)
+
+        for start in range(0, len(rows), ENROLL_BATCH_SIZE):
+            batch = rows[start:start + ENROLL_BATCH_SIZE]
+            with session_scope() as db:
+                students, batch_skipped, batch_failures = _enroll_batch(db, batch, images)
+                enrolled += len(students)
+                skipped += batch_skipped
+                failures.extend(batch_failures)
+
+                record = db.get(EnrollmentImport, import_id)
+                record.processed = start + len(batch)
+                record.enrolled = enrolled
+                record.skipped = skipped
+                record.failures = json.dumps(failures) if failures else None
+                db.commit()
+
+            class_cache.invalidate(*{class_name for _, class_name, _ in students})
+            for student_id, _, encodings in students:
+                add_student_to_index(student_id, encodings)
+            print(f"Enrolled {enrolled}, skipped {skipped}, failed {len(failures)} "
+                  f"({start + len(batch)}/{len(rows)})")
+            if progress:
+                progress(start + len(batch), len(rows))
+
+        status, error = "done", None
+    except Exception as e:
+        print(f"❌ Enrollment import {import_id} failed: {e}")
+        status, error = "failed", str(e)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    with session_scope() as db:
+        record = db.get(EnrollmentImport, import_id)
+        record.status = status
+        record.error = error
+        record.failures = json.dumps(failures) if failures else None
+        record.finished_at = datetime.utcnow()
+        db.commit()
+        db.refresh(record)
+        db.expunge(record)
+        return record
+
+
+def import_failures(record):
+    return json.loads(record.failures) if record.failures else []
@@ -0,0 +1,180 @@
+import time
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert
+
+from db.models import MatchDistance, MatchThreshold
+
+# Per-class match tolerances fitted from the logged match distances. In a
+# class session most students are either clearly in the photos (small best
+# distance) or clearly not (large), so the best distances of a class are
+# bimodal; Otsu's method puts the threshold between the two modes. The fit
+# is clamped to a safe range and skipped while a class has little history
+# or the two modes are not well separated.
+TOLERANCE_MIN = 0.40
+TOLERANCE_MAX = 0.60
+MIN_SAMPLES = 200
+MIN_SESSIONS = 5
+# Otsu's separability (between-class over total variance, 0..1) below which
+# the history is not trusted
+MIN_SEPARABILITY = 0.5
+HISTOGRAM_BINS = 120
+HISTOGRAM_RANGE = (0.0, 1.2)
+CALIBRATION_DAYS = 90
+
+# Tolerances are read for every session; a calibration run in another
+# process is picked up within this many seconds
+TOLERANCE_CACHE_TTL = 300
+
+_tolerances = {}
+_tolerances_lock = threading.Lock()
+
+
+# ---------------------------
+# LOGGING
+# ---------------------------
+def save_match_distances(db, session_id, class_name, student_ids, per_student, tolerance, timestamp):
+    # per_student is match_encodings()'s (faces, students) distance matrix.
+    # One multi-row INSERT; the caller commits.
+    if not student_ids:
+        return
+    closest = np.sort(per_student, axis=0)
+    best = closest[0] if len(closest) > 0 else np.full(len(student_ids), np.inf)
+    second = closest[1] if len(closest) > 1 else np.full(len(student_ids), np.inf)
+
+    db.execute(insert(MatchDistance), [
+        {
+            "session_id": session_id,
+            "class_name": class_name,
+            "student_id": student_id,
+            "best_distance": float(b) if np.isfinite(b) else None,
+            "second_distance": float(s) if np.isfinite(s) else None,
+            "tolerance": tolerance,
+            "created_at": timestamp,
+        }
+        for student_id, b, s in zip(student_ids, best.tolist(), second.tolist())
+    ])
+
+
+# ---------------------------
+# APPLYING
+# ---------------------------
+def class_tolerance(db, class_name, default):
+    now = time.monotonic()
+    with _tolerances_lock:
+        cached = _tolerances.get(class_name)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+    row = db.get(MatchThreshold, class_name)
+    tolerance = row.tolerance if row is not None else default
+    with _tolerances_lock:
+        _tolerances[class_name] = (tolerance, now + TOLERANCE_CACHE_TTL)
+    return tolerance
+
+
+def invalidate_tolerances():
+    with _tolerances_lock:
+        _tolerances.clear()
+
+
+# ---------------------------
+# FITTING
+# ---------------------------
+def otsu_threshold(values):
+    # (threshold, separability) maximising the between-class variance of
+    # the histogram of values
+    counts, edges = np.histogram(np.clip(values, *HISTOGRAM_RANGE), bins=HISTOGRAM_BINS, range=HISTOGRAM_RANGE)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weights = counts / max(counts.sum(), 1)
+
+    below = np.cumsum(weights)
+    below_mean = np.cumsum(weights * centers)
+    total_mean = below_mean[-1]
+    above = 1.0 - below
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (total_mean * below - below_mean) ** 2 / (below * above)
+    between = np.nan_to_num(between, nan=0.0, posinf=0.0)
+
+    # empty bins between the modes leave a plateau of equal splits; take
+    # its middle rather than its edge
+    plateau = np.flatnonzero(between >= between.max() - 1e-12)
+    split = int(plateau[len(plateau) // 2])
+    total_variance = float((weights * (centers - total_mean) ** 2).sum())
+    separability = float(between[split]) / total_variance if total_variance else 0.0
+    return float(edges[split + 1]), separability
+
+
+def flipped_decisions(best, used, tolerance):
+    # Borderline decisions of the history that would come out differently
+    # under tolerance: (Absent -> Present, Present -> Absent). A student is
+    # Present when their best distance is within the tolerance; in
+    # assignment mode this is an estimate.
+    to_present = int(((best > used) & (best <= tolerance)).sum())
+    to_absent = int(((best <= used) & (best > tolerance)).sum())
+    return to_present, to_absent
+
+
+def fit_class_tolerance(best, sessions):
+    # (tolerance or None, reason); best holds the finite best distances
+    if len(best) < MIN_SAMPLES or sessions < MIN_SESSIONS:
+        return None, f"not enough history ({len(best)} distances, {sessions} sessions)"
+    threshold, separability = otsu_threshold(best)
+    if separability < MIN_SEPARABILITY:
+        return None, f"distances not separable (separability {separability:.2f})"
+    return round(min(TOLERANCE_MAX, max(TOLERANCE_MIN, threshold)), 3), f"separability {separability:.2f}"
+
+
+def calibrate(db, days=CALIBRATION_DAYS, dry_run=False):
+    # Fits every class with logged distances over the last days. Returns
+    # one dict per class: class_name, samples, sessions, current, fitted
+    # (None when not fitted), reason, to_present, to_absent.
+    from utils.face_utils import MATCH_TOLERANCE
+
+    since = datetime.utcnow() - timedelta(days=days)
+    history = {}
+    rows = db.query(
+        MatchDistance.class_name, MatchDistance.session_id, MatchDistance.best_distance, MatchDistance.tolerance
+    ).filter(MatchDistance.created_at >= since)
+    for class_name, session_id, best, used in rows:
+        entry = history.setdefault(class_name, {"sessions": set(), "best": [], "used": []})
+        entry["sessions"].add(session_id)
+        # no face at all counts as infinitely far
+        entry["best"].append(np.inf if best is None else best)
+        entry["used"].append(used)
+
+    current = {t.class_name: t for t in db.query(MatchThreshold)}
+    report = []
+    for class_name, entry in sorted(history.items()):
+        best = np.asarray(entry["best"], dtype=np.float64)
+        used = np.asarray(entry["used"], dtype=np.float64)
+        finite = best[np.isfinite(best)]
+        fitted, reason = fit_class_tolerance(finite, len(entry["sessions"]))
+        old = current[class_name].tolerance if class_name in current else MATCH_TOLERANCE
+        to_present, to_absent = flipped_decisions(best, used, fitted) if fitted is not None else (0, 0)
+        report.append({
+            "class_name": class_name,
+            "samples": len(best),
+            "sessions": len(entry["sessions"]),
+            "current": old,
+            "fitted": fitted,
+            "reason": reason,
+            "to_present": to_present,
+            "to_absent": to_absent,
+        })
+
+        if fitted is None or dry_run:
+            continue
+        row = current.get(class_name) or MatchThreshold(class_name=class_name)
+        row.tolerance = fitted
+        row.samples = len(finite)
+        row.sessions = len(entry["sessions"])
+        row.fitted_at = datetime.utcnow()
+        db.add(row)
+
+    if not dry_run:
+        db.commit()
+        invalidate_tolerances()
+    return report
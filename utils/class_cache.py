@@ -0,0 +1,191 @@
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Stacked embedding matrix of one class plus the student index it was built
+# from. owners[i] is the position (in student_ids) of the student owning
+# row i of matrix.
+ClassEmbeddings = namedtuple(
+    "ClassEmbeddings",
+    ["student_ids", "names", "roll_nos", "matrix", "owners"]
+)
+
+CLASS_CACHE_MAX_CLASSES = 64
+CLASS_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _entry_size(entry):
+    return entry.matrix.nbytes + entry.owners.nbytes
+
+
+def _without_student(entry, student_id):
+    # Copy of entry without the student's rows
+    if student_id not in entry.student_ids:
+        return entry
+    position = entry.student_ids.index(student_id)
+    keep = entry.owners != position
+    owners = entry.owners[keep]
+    return ClassEmbeddings(
+        student_ids=entry.student_ids[:position] + entry.student_ids[position + 1:],
+        names=entry.names[:position] + entry.names[position + 1:],
+        roll_nos=entry.roll_nos[:position] + entry.roll_nos[position + 1:],
+        matrix=entry.matrix[keep],
+        owners=owners - (owners > position)
+    )
+
+
+def _with_student(entry, student_id, name, roll_no, encodings):
+    # Copy of entry with the student's rows replaced by encodings, appended
+    # last so every student's rows stay contiguous
+    entry = _without_student(entry, student_id)
+    encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, entry.matrix.shape[1])
+    position = len(entry.student_ids)
+    return ClassEmbeddings(
+        student_ids=entry.student_ids + [student_id],
+        names=entry.names + [name],
+        roll_nos=entry.roll_nos + [roll_no],
+        matrix=np.vstack([entry.matrix, encodings]),
+        owners=np.concatenate([entry.owners, np.full(len(encodings), position, dtype=np.int64)])
+    )
+
+
+# ---------------------------
+# LRU CACHE
+# ---------------------------
+# Process-wide, so every Streamlit session of the same server shares it.
+# Whoever adds, edits or removes a student in this process must invalidate
+# or patch the affected class(es). Changes made by another process (the
+# enroll_students.py import, a second server) are caught by the fingerprint
+# stored with each entry, which the caller re-checks against the database
+# once the entry is older than its recheck interval.
+class ClassEmbeddingCache:
+
+    def __init__(self, max_classes=CLASS_CACHE_MAX_CLASSES, max_bytes=CLASS_CACHE_MAX_BYTES):
+        self.max_classes = max_classes
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # class_name -> (fingerprint, monotonic time it was last confirmed)
+        self._checks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get(self, class_name):
+        with self._lock:
+            entry = self._entries.get(class_name)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(class_name)
+            self.hits += 1
+            return entry
+
+    def put(self, class_name, entry, fingerprint=None):
+        # Shared between threads, so never let a caller mutate it in place
+        entry.matrix.setflags(write=False)
+        entry.owners.setflags(write=False)
+
+        with self._lock:
+            old = self._entries.pop(class_name, None)
+            if old is not None:
+                self._bytes -= _entry_size(old)
+
+            self._entries[class_name] = entry
+            self._bytes += _entry_size(entry)
+            self._checks[class_name] = (fingerprint, time.monotonic())
+
+            while self._entries and (
+                len(self._entries) > self.max_classes or self._bytes > self.max_bytes
+            ):
+                evicted_class, evicted = self._entries.popitem(last=False)
+                self._bytes -= _entry_size(evicted)
+                self._checks.pop(evicted_class, None)
+                self.evictions += 1
+
+    def recheck_due(self, class_name, max_age):
+        with self._lock:
+            check = self._checks.get(class_name)
+            return check is not None and time.monotonic() - check[1] >= max_age
+
+    def confirm(self, class_name, fingerprint):
+        # True (and the entry good for another interval) when the class
+        # still has the fingerprint it was cached with; otherwise the entry
+        # is dropped
+        with self._lock:
+            check = self._checks.get(class_name)
+            if check is not None and check[0] == fingerprint:
+                self._checks[class_name] = (fingerprint, time.monotonic())
+                return True
+            # the lookup already counted as a hit; counters only ever grow
+            self.stale += 1
+            self._drop(class_name)
+            return False
+
+    def invalidate(self, *class_names):
+        with self._lock:
+            for class_name in class_names:
+                self._drop(class_name)
+
+    def _drop(self, class_name):
+        # caller holds the lock
+        entry = self._entries.pop(class_name, None)
+        if entry is not None:
+            self._bytes -= _entry_size(entry)
+        self._checks.pop(class_name, None)
+
+    # Edits of one student patch the cached class instead of dropping it, so
+    # the next session of the class does not reload every student. The
+    # entry keeps its fingerprint: the edit changed the class in the
+    # database, so the next recheck reloads it once, which also picks up
+    # whatever another process changed in the meantime.
+    def update_student(self, class_name, student_id, name, roll_no, encodings):
+        with self._lock:
+            entry = self._entries.get(class_name)
+        if entry is not None:
+            self._replace(class_name, entry, _with_student(entry, student_id, name, roll_no, encodings))
+
+    def remove_student(self, class_name, student_id):
+        with self._lock:
+            entry = self._entries.get(class_name)
+        if entry is not None:
+            self._replace(class_name, entry, _without_student(entry, student_id))
+
+    def _replace(self, class_name, old, new):
+        new.matrix.setflags(write=False)
+        new.owners.setflags(write=False)
+        with self._lock:
+            # dropped if the class was evicted, invalidated or rebuilt meanwhile
+            current = self._entries.get(class_name)
+            if current is not old:
+                self._drop(class_name)
+                return
+            self._entries[class_name] = new
+            self._bytes += _entry_size(new) - _entry_size(old)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._checks.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "classes": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stale": self.stale,
+                # stale lookups were counted as hits but reloaded the class
+                "hit_rate": (self.hits - self.stale) / lookups if lookups else 0.0,
+            }
+
+
+class_cache = ClassEmbeddingCache()
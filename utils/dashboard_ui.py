@@ -0,0 +1,15 @@
+import streamlit as st
+
+# Streamlit pieces shared by the admin and faculty dashboards
+
+
+def show_image_report(report):
+    # Outcome of enroll_student() / update_student_images(): rejected and
+    # flagged uploads
+    for file_name, outcome, quality in report:
+        if outcome == "rejected":
+            st.error(f"{file_name} not added: {', '.join(quality['problems'])}")
+        elif outcome == "duplicate":
+            st.info(f"{file_name} is already enrolled for this student.")
+        elif quality["status"] == "flag":
+            st.warning(f"{file_name} added, but: {', '.join(quality['problems'])}")
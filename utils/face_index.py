@@ -0,0 +1,283 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+ENCODING_SIZE = 128
+
+# "auto" picks the flat index for small institutions and IVF beyond
+# IVF_MIN_VECTORS; "flat" / "ivf" force one; "off" disables the
+# institution-wide index (and visitor flagging) entirely.
+FACE_INDEX_MODE = os.environ.get("ATTENDANCE_FACE_INDEX", "auto")
+IVF_MIN_VECTORS = 20000
+IVF_LISTS = 256
+IVF_PROBES = 8
+KMEANS_POINTS_PER_LIST = 64
+
+# float32 halves memory and doubles matrix-product speed; the precision is
+# far finer than the 0.5 match tolerance.
+DTYPE = np.float32
+
+
+def _as_matrix(vectors):
+    return np.asarray(vectors, dtype=DTYPE).reshape(-1, ENCODING_SIZE)
+
+
+def _squared_distances(queries, vectors):
+    return np.maximum(
+        np.einsum("ij,ij->i", queries, queries)[:, None]
+        + np.einsum("ij,ij->i", vectors, vectors)[None, :]
+        - 2.0 * (queries @ vectors.T),
+        0.0
+    )
+
+
+def _nearest(queries, vectors, chunk=8192):
+    # Index of the nearest vector for every query, in chunks to bound memory
+    nearest = np.empty(len(queries), dtype=np.int64)
+    for start in range(0, len(queries), chunk):
+        block = queries[start:start + chunk]
+        nearest[start:start + chunk] = _squared_distances(block, vectors).argmin(axis=1)
+    return nearest
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    rng = np.random.default_rng(seed)
+    if len(vectors) > k * KMEANS_POINTS_PER_LIST:
+        vectors = vectors[rng.choice(len(vectors), k * KMEANS_POINTS_PER_LIST, replace=False)]
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = _nearest(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        cells, starts, counts = np.unique(assign[order], return_index=True, return_counts=True)
+        centroids[cells] = np.add.reduceat(vectors[order], starts, axis=0) / counts[:, None]
+
+        # re-seed empty clusters on random points so k stays useful
+        empty = np.setdiff1d(np.arange(k), cells)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+    return centroids
+
+
+# ---------------------------
+# FLAT INDEX
+# ---------------------------
+# Exact search: one matrix product against every stored embedding.
+class FlatFaceIndex:
+
+    def __init__(self):
+        self._vectors = np.empty((0, ENCODING_SIZE), dtype=DTYPE)
+        self._owners = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._owners)
+
+    def add(self, owner_id, vectors):
+        vectors = _as_matrix(vectors)
+        self.add_batch(np.full(len(vectors), owner_id, dtype=np.int64), vectors)
+
+    def add_batch(self, owners, vectors):
+        self._vectors = np.vstack([self._vectors, _as_matrix(vectors)])
+        self._owners = np.concatenate([self._owners, np.asarray(owners, dtype=np.int64)])
+
+    def remove(self, owner_id):
+        keep = self._owners != owner_id
+        self._vectors = self._vectors[keep]
+        self._owners = self._owners[keep]
+
+    def search(self, queries):
+        # (distances, owner ids) of the nearest stored embedding per query;
+        # owner -1 / distance inf when the index is empty
+        queries = _as_matrix(queries)
+        if not len(self._owners) or not len(queries):
+            return np.full(len(queries), np.inf), np.full(len(queries), -1, dtype=np.int64)
+
+        squared = _squared_distances(queries, self._vectors)
+        best = squared.argmin(axis=1)
+        return np.sqrt(squared[np.arange(len(queries)), best]), self._owners[best]
+
+
+# ---------------------------
+# IVF INDEX
+# ---------------------------
+# Embeddings are partitioned by k-means into n_lists cells; a query only
+# scans the n_probes cells whose centroids are closest to it.
+class IVFFaceIndex:
+
+    def __init__(self, training_vectors, n_lists=IVF_LISTS, n_probes=IVF_PROBES):
+        self.centroids = kmeans(_as_matrix(training_vectors), n_lists)
+        self.n_probes = min(n_probes, len(self.centroids))
+        self._vectors = [np.empty((0, ENCODING_SIZE), dtype=DTYPE) for _ in self.centroids]
+        self._owners = [np.empty(0, dtype=np.int64) for _ in self.centroids]
+        self._lists_of_owner = {}
+
+    def __len__(self):
+        return sum(len(o) for o in self._owners)
+
+    def add(self, owner_id, vectors):
+        vectors = _as_matrix(vectors)
+        self.add_batch(np.full(len(vectors), owner_id, dtype=np.int64), vectors)
+
+    def add_batch(self, owners, vectors):
+        vectors = _as_matrix(vectors)
+        owners = np.asarray(owners, dtype=np.int64)
+        if not len(vectors):
+            return
+
+        cells = _nearest(vectors, self.centroids)
+        order = np.argsort(cells, kind="stable")
+        unique_cells, starts = np.unique(cells[order], return_index=True)
+        ends = np.r_[starts[1:], len(order)]
+
+        for cell, start, end in zip(unique_cells.tolist(), starts, ends):
+            members = order[start:end]
+            self._vectors[cell] = np.vstack([self._vectors[cell], vectors[members]])
+            self._owners[cell] = np.concatenate([self._owners[cell], owners[members]])
+            for owner_id in np.unique(owners[members]).tolist():
+                self._lists_of_owner.setdefault(owner_id, set()).add(cell)
+
+    def remove(self, owner_id):
+        for cell in self._lists_of_owner.pop(owner_id, ()):
+            keep = self._owners[cell] != owner_id
+            self._vectors[cell] = self._vectors[cell][keep]
+            self._owners[cell] = self._owners[cell][keep]
+
+    def search(self, queries):
+        queries = _as_matrix(queries)
+        distances = np.full(len(queries), np.inf)
+        owners = np.full(len(queries), -1, dtype=np.int64)
+        if not len(queries):
+            return distances, owners
+
+        coarse = _squared_distances(queries, self.centroids)
+        probes = np.argpartition(coarse, self.n_probes - 1, axis=1)[:, :self.n_probes]
+
+        for q, cells in enumerate(probes):
+            candidates = [c for c in cells if len(self._owners[c])]
+            if not candidates:
+                continue
+            vectors = np.vstack([self._vectors[c] for c in candidates])
+            cell_owners = np.concatenate([self._owners[c] for c in candidates])
+            squared = _squared_distances(queries[q:q + 1], vectors)[0]
+            best = squared.argmin()
+            distances[q] = np.sqrt(squared[best])
+            owners[q] = cell_owners[best]
+
+        return distances, owners
+
+
+# ---------------------------
+# INSTITUTION-WIDE INDEX
+# ---------------------------
+# Built lazily from every stored encoding on first use and then kept in sync
+# through add_student_to_index / remove_student_from_index. Encodings stored
+# by another process (the enroll_students.py import only ever adds) are
+# picked up from the rows past the highest id loaded so far, at most every
+# FACE_INDEX_RECHECK seconds.
+FACE_INDEX_RECHECK = 60
+
+_index = None
+_index_seen_id = 0
+_index_checked = 0.0
+_index_lock = threading.Lock()
+
+
+def build_face_index(encodings_by_student, mode=FACE_INDEX_MODE):
+    owners = []
+    vectors = []
+    for student_id, encodings in encodings_by_student.items():
+        owners.extend([student_id] * len(encodings))
+        vectors.extend(encodings)
+    vectors = _as_matrix(vectors)
+
+    if mode == "ivf" or (mode == "auto" and len(vectors) >= IVF_MIN_VECTORS):
+        index = IVFFaceIndex(vectors)
+    else:
+        index = FlatFaceIndex()
+
+    index.add_batch(owners, vectors)
+    return index
+
+
+def _load_encodings(db, student_ids=None):
+    # ({student_id: [encoding]}, highest row id seen)
+    from utils.face_utils import encoding_from_bytes
+    from db.models import FaceEncoding
+
+    rows = db.query(FaceEncoding.id, FaceEncoding.student_id, FaceEncoding.encoding)
+    if student_ids is not None:
+        rows = rows.filter(FaceEncoding.student_id.in_(student_ids))
+    encodings_by_student = {}
+    seen_id = 0
+    for row_id, student_id, blob in rows:
+        seen_id = max(seen_id, row_id)
+        encodings = encodings_by_student.setdefault(student_id, [])
+        if blob is not None:
+            encodings.append(encoding_from_bytes(blob))
+    return encodings_by_student, seen_id
+
+
+def _catch_up(db):
+    # Reloads the students with encoding rows added since the last check;
+    # caller holds _index_lock
+    from db.models import FaceEncoding
+
+    global _index_seen_id
+    added = db.query(FaceEncoding.id, FaceEncoding.student_id).filter(FaceEncoding.id > _index_seen_id).all()
+    if not added:
+        return
+    changed = {student_id for _, student_id in added}
+    encodings_by_student, _ = _load_encodings(db, list(changed))
+    for student_id in changed:
+        _index.remove(student_id)
+        encodings = encodings_by_student.get(student_id)
+        if encodings:
+            _index.add(student_id, encodings)
+    _index_seen_id = max(row_id for row_id, _ in added)
+    print(f"Face index: reloaded {len(changed)} student(s) with new encodings")
+
+
+def get_face_index(db):
+    global _index, _index_seen_id, _index_checked
+    if FACE_INDEX_MODE == "off":
+        return None
+
+    with _index_lock:
+        now = time.monotonic()
+        if _index is None:
+            encodings_by_student, _index_seen_id = _load_encodings(db)
+            _index = build_face_index(encodings_by_student)
+            _index_checked = now
+            print(f"Built {type(_index).__name__} over {len(_index)} face encodings")
+        elif now - _index_checked >= FACE_INDEX_RECHECK:
+            _catch_up(db)
+            _index_checked = now
+        return _index
+
+
+def search_face_index(db, queries):
+    index = get_face_index(db)
+    if index is None:
+        return None
+    with _index_lock:
+        return index.search(queries)
+
+
+def add_student_to_index(student_id, encodings):
+    # Replaces whatever the index held for the student
+    with _index_lock:
+        if _index is None:
+            return
+        _index.remove(student_id)
+        if len(encodings):
+            _index.add(student_id, encodings)
+
+
+def remove_student_from_index(student_id):
+    with _index_lock:
+        if _index is not None:
+            _index.remove(student_id)
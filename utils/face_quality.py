@@ -0,0 +1,158 @@
+import io
+import json
+import math
+
+import numpy as np
+
+from utils.face_utils import detect_faces, face_crop
+
+# Enrollment images are scored before their encoding is stored. An image
+# is rejected when it cannot give a reliable encoding (no face, several
+# faces of similar size, a tiny, very blurry or profile face) and flagged
+# when it is usable but worse than it should be; flagged images are kept and
+# their problems shown next to them in the dashboards.
+MIN_FACE_SIDE = 60           # pixels; below this the face is rejected
+GOOD_FACE_SIDE = 120         # below this it is flagged as small
+# Several faces are accepted (and flagged) only when the largest is at least
+# this many times the area of the next one, i.e. clearly the subject
+DOMINANT_FACE_RATIO = 2.0
+
+# Sharpness is the variance of the Laplacian of the face resized to
+# SHARPNESS_SIDE pixels, so it does not depend on the photo's resolution
+SHARPNESS_SIDE = 128
+SHARPNESS_REJECT = 15.0
+SHARPNESS_FLAG = 50.0
+
+# Yaw is the nose tip's horizontal offset from the midpoint of the eyes,
+# in inter-eye distances (0 when facing the camera); roll is the tilt of
+# the eye line in degrees
+YAW_FLAG = 0.35
+YAW_REJECT = 0.7
+ROLL_FLAG = 20.0
+
+
+def face_sharpness(crop, location):
+    from PIL import Image
+
+    top, right, bottom, left = location
+    face = Image.fromarray(crop[top:bottom, left:right]).convert("L")
+    gray = np.asarray(face.resize((SHARPNESS_SIDE, SHARPNESS_SIDE)), dtype=np.float64)
+    laplacian = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4.0 * gray[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def face_pose(crop, location):
+    # (yaw, roll) from the 5-point landmarks, or (None, None) when they
+    # could not be found
+    import face_recognition
+
+    landmarks = face_recognition.face_landmarks(crop, face_locations=[location], model="small")
+    if not landmarks or not all(k in landmarks[0] for k in ("left_eye", "right_eye", "nose_tip")):
+        return None, None
+
+    left_eye = np.mean(landmarks[0]["left_eye"], axis=0)
+    right_eye = np.mean(landmarks[0]["right_eye"], axis=0)
+    nose = np.mean(landmarks[0]["nose_tip"], axis=0)
+    eye_distance = float(np.linalg.norm(right_eye - left_eye))
+    if eye_distance == 0:
+        return None, None
+
+    middle = (left_eye + right_eye) / 2
+    yaw = float(nose[0] - middle[0]) / eye_distance
+    roll = math.degrees(math.atan2(right_eye[1] - left_eye[1], right_eye[0] - left_eye[0]))
+    # the eye order depends on the landmark model; only the tilt matters
+    roll = (roll + 90.0) % 180.0 - 90.0
+    return yaw, roll
+
+
+def _status(problems):
+    if any(level == "reject" for level, _ in problems):
+        return "reject"
+    return "flag" if problems else "ok"
+
+
+# ---------------------------
+# SCORE ONE IMAGE
+# ---------------------------
+def assess_student_image(data):
+    # data is the uploaded image bytes. Returns (encoding or None, quality):
+    # quality is {status, problems, faces, face_side, sharpness, yaw, roll}
+    # and the encoding is None when the image is rejected.
+    import face_recognition
+
+    quality = {"faces": 0, "face_side": None, "sharpness": None, "yaw": None, "roll": None}
+    problems = []
+    try:
+        full, boxes = detect_faces(io.BytesIO(data))
+    except Exception as e:
+        print(f"❌ Unreadable enrollment image: {e}")
+        problems.append(("reject", "unreadable image"))
+        boxes = []
+    quality["faces"] = len(boxes)
+
+    if not boxes:
+        if not problems:
+            problems.append(("reject", "no face found"))
+        quality.update(status=_status(problems), problems=[p for _, p in problems])
+        return None, quality
+
+    areas = sorted(((b[2] - b[0]) * (b[1] - b[3]), b) for b in boxes)
+    box = areas[-1][1]
+    if len(boxes) > 1:
+        if areas[-1][0] >= DOMINANT_FACE_RATIO * areas[-2][0]:
+            problems.append(("flag", f"{len(boxes)} faces, using the largest"))
+        else:
+            problems.append(("reject", f"{len(boxes)} faces of similar size"))
+
+    side = min(box[2] - box[0], box[1] - box[3])
+    quality["face_side"] = side
+    if side < MIN_FACE_SIDE:
+        problems.append(("reject", f"face too small ({side}px)"))
+    elif side < GOOD_FACE_SIDE:
+        problems.append(("flag", f"small face ({side}px)"))
+
+    crop, location = face_crop(full, box)
+    sharpness = quality["sharpness"] = round(face_sharpness(crop, location), 1)
+    if sharpness < SHARPNESS_REJECT:
+        problems.append(("reject", "very blurry"))
+    elif sharpness < SHARPNESS_FLAG:
+        problems.append(("flag", "blurry"))
+
+    yaw, roll = face_pose(crop, location)
+    if yaw is not None:
+        quality["yaw"], quality["roll"] = round(yaw, 2), round(roll, 1)
+        if abs(yaw) >= YAW_REJECT:
+            problems.append(("reject", "face turned away"))
+        elif abs(yaw) >= YAW_FLAG:
+            problems.append(("flag", "face partly turned"))
+        if abs(roll) >= ROLL_FLAG:
+            problems.append(("flag", "head tilted"))
+
+    quality.update(status=_status(problems), problems=[p for _, p in problems])
+    if quality["status"] == "reject":
+        return None, quality
+
+    encodings = face_recognition.face_encodings(crop, known_face_locations=[location])
+    if not encodings:
+        quality.update(status="reject", problems=quality["problems"] + ["face could not be encoded"])
+        return None, quality
+    return encodings[0], quality
+
+
+def quality_to_json(quality):
+    return json.dumps(quality)
+
+
+def quality_from_json(text):
+    return json.loads(text) if text else None
+
+
+def quality_summary(quality):
+    # Short text for captions, e.g. "flag: blurry, small face (90px)"
+    if not quality:
+        return "not scored"
+    if quality["status"] == "ok":
+        return "ok"
+    return f"{quality['status']}: " + ", ".join(quality["problems"])
@@ -1,148 +1,822 @@
 import os
-import pandas as pd
-import face_recognition
-
-from db.models import Student, AttendanceSession, AttendanceRecord
+import io
+import csv
+import time
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from datetime import datetime
+from sqlalchemy import insert, func
+
+from db.models import Student, AttendanceSession, AttendanceRecord, FaceEncoding
+from utils.class_cache import class_cache, ClassEmbeddings
+from utils.attendance_stats import update_attendance_stats
+from utils.face_index import search_face_index, add_student_to_index
+from utils.metrics import span, tagged, captured_spans, replay, flush_spans
+from utils.attendance_archive import append_session
+from utils.calibration import class_tolerance, save_match_distances
 
 STUDENT_IMG_DIR = "student_images"
 CSV_DIR = "attendance_csvs"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
 
 os.makedirs(CSV_DIR, exist_ok=True)
 
 
+# ---------------------------
+# DETECTION PIPELINE
+# ---------------------------
+# Faces are detected on a copy of the photo downscaled to DETECTION_MAX_SIDE
+# (JPEGs are decoded straight at reduced size), the boxes are mapped back to
+# the original, and only the face regions are encoded at full resolution.
+DETECTION_MODEL = os.environ.get("ATTENDANCE_DETECTION_MODEL", "hog")
+DETECTION_UPSAMPLE = int(os.environ.get("ATTENDANCE_DETECTION_UPSAMPLE", "1"))
+DETECTION_MAX_SIDE = int(os.environ.get("ATTENDANCE_DETECTION_MAX_SIDE", "1600"))
+FACE_CROP_MARGIN = 0.3
+
+EXIF_ORIENTATION = 0x0112
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_image(img_path, max_side=None):
+    # RGB PIL image with EXIF orientation applied, optionally no larger than
+    # max_side. Returns (image, full-resolution (width, height)).
+    from PIL import Image, ImageOps
+
+    img = Image.open(img_path)
+    full_size = img.size
+    if img.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+        full_size = full_size[::-1]
+
+    if max_side and max(full_size) > max_side:
+        img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((max_side, max_side))
+    else:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+
+    return img, full_size
+
+
+def detect_faces(img_path):
+    # Returns (full-resolution image, [(top, right, bottom, left)] in its
+    # pixel coordinates); the image is only decoded at full size when a face
+    # was found.
+    # Imported here: dlib takes seconds to load and most page loads never
+    # process a photo.
+    import face_recognition
+
+    with span("decode"):
+        small, full_size = load_image(img_path, DETECTION_MAX_SIDE)
+    with span("detect") as tags:
+        boxes = face_recognition.face_locations(
+            np.asarray(small),
+            number_of_times_to_upsample=DETECTION_UPSAMPLE,
+            model=DETECTION_MODEL
+        )
+        tags["faces"] = len(boxes)
+    if not boxes or small.size == full_size:
+        return small, boxes
+
+    with span("decode_full"):
+        full, _ = load_image(img_path)
+    scale_x = full.size[0] / small.size[0]
+    scale_y = full.size[1] / small.size[1]
+    return full, [
+        (int(top * scale_y), int(right * scale_x), int(bottom * scale_y), int(left * scale_x))
+        for top, right, bottom, left in boxes
+    ]
+
+
+def face_crop(full, box):
+    # The face region of a PIL image with FACE_CROP_MARGIN around it, as an
+    # array, plus the face location within the crop
+    top, right, bottom, left = box
+    margin_x = int((right - left) * FACE_CROP_MARGIN)
+    margin_y = int((bottom - top) * FACE_CROP_MARGIN)
+    crop_left, crop_top = max(0, left - margin_x), max(0, top - margin_y)
+    crop_right = min(full.size[0], right + margin_x)
+    crop_bottom = min(full.size[1], bottom + margin_y)
+
+    crop = np.asarray(full.crop((crop_left, crop_top, crop_right, crop_bottom)))
+    return crop, (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+
+
+def detect_and_encode(img_path):
+    # Returns [(encoding, (top, right, bottom, left))] in original pixel
+    # coordinates, one entry per detected face.
+    import face_recognition
+
+    full, boxes = detect_faces(img_path)
+    faces = []
+    if not boxes:
+        return faces
+
+    with span("encode", faces=len(boxes)):
+        for box in boxes:
+            crop, location = face_crop(full, box)
+            encodings = face_recognition.face_encodings(crop, known_face_locations=[location])
+            if encodings:
+                faces.append((encodings[0], box))
+
+    return faces
+
+
+# ---------------------------
+# ENCODE ONE STUDENT IMAGE
+# ---------------------------
+def encode_student_image(img_path):
+    print("Processing student image:", img_path)
+
+    try:
+        faces = detect_and_encode(img_path)
+
+        print("Faces detected:", len(faces))
+
+        if faces:
+            # the enrolled student is the largest face in the photo
+            encoding, _ = max(faces, key=lambda f: (f[1][2] - f[1][0]) * (f[1][1] - f[1][3]))
+            return encoding
+
+    except Exception as e:
+        print(f"❌ Error in {img_path}: {e}")
+
+    return None
+
+
+def list_student_images(images_path):
+    if not images_path or not os.path.exists(images_path):
+        return []
+
+    return [
+        os.path.join(images_path, file_name)
+        for file_name in sorted(os.listdir(images_path))
+        if file_name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
 # ---------------------------
 # GET STUDENT FACE ENCODINGS
 # ---------------------------
 def get_student_encodings(images_path):
     encodings = []
 
-    from PIL import Image
-    import numpy as np
+    for img_path in list_student_images(images_path):
+        encoding = encode_student_image(img_path)
+        if encoding is not None:
+            encodings.append(encoding)
 
-    if not os.path.exists(images_path):
-        return encodings
+    return encodings
 
-    for file_name in os.listdir(images_path):
-        if file_name.lower().endswith((".jpg", ".jpeg", ".png")):
-            img_path = os.path.join(images_path, file_name)
 
-            print("Processing student image:", img_path)
+# ---------------------------
+# ENCODING STORE
+# ---------------------------
+def image_hash(img_path):
+    digest = hashlib.sha256()
+    with open(img_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-            try:
-                # ✅ FORCE CLEAN RGB IMAGE
-                pil_img = Image.open(img_path).convert("RGB")
-                img = np.array(pil_img)
 
-                faces = face_recognition.face_encodings(img)
+def encoding_to_bytes(encoding):
+    return np.asarray(encoding, dtype=np.float64).tobytes()
 
-                print("Faces detected:", len(faces))
 
-                if faces:
-                    encodings.append(faces[0])
+def encoding_from_bytes(blob):
+    return np.frombuffer(blob, dtype=np.float64)
+
+
+def _file_fingerprints(images_path):
+    fingerprints = {}
+    for img_path in list_student_images(images_path):
+        stat = os.stat(img_path)
+        fingerprints[os.path.basename(img_path)] = (stat.st_size, stat.st_mtime_ns)
+    return fingerprints
 
-            except Exception as e:
-                print(f"❌ Error in {img_path}: {e}")
-                continue
+
+def encodings_stale(student, rows):
+    # Students in the image store (no images_path) are never stale: their
+    # rows are only changed together with the store
+    if not student.images_path:
+        return False
+    stored = {r.file_name: (r.file_size, r.file_mtime) for r in rows}
+    return stored != _file_fingerprints(student.images_path)
+
+
+def load_encoding_rows(db, student_ids):
+    rows_by_student = {sid: [] for sid in student_ids}
+    if not student_ids:
+        return rows_by_student
+
+    rows = db.query(FaceEncoding).filter(FaceEncoding.student_id.in_(student_ids)).all()
+    for row in rows:
+        rows_by_student[row.student_id].append(row)
+    return rows_by_student
+
+
+def sync_student_encodings(db, student, rows=None):
+    # Re-encode only the images whose content hash is not already stored.
+    # Returns the student's current encodings.
+    if rows is None:
+        rows = db.query(FaceEncoding).filter(FaceEncoding.student_id == student.id).all()
+    if not student.images_path:
+        return [encoding_from_bytes(r.encoding) for r in rows if r.encoding is not None]
+
+    by_name = {r.file_name: r for r in rows}
+    by_hash = {r.image_hash: r.encoding for r in rows}
+    files = _file_fingerprints(student.images_path)
+    changed = False
+
+    for file_name, row in by_name.items():
+        if file_name not in files:
+            db.delete(row)
+            changed = True
+
+    encodings = []
+    for file_name, (size, mtime) in files.items():
+        row = by_name.get(file_name)
+
+        if row is None or (row.file_size, row.file_mtime) != (size, mtime):
+            img_path = os.path.join(student.images_path, file_name)
+            digest = image_hash(img_path)
+
+            if digest in by_hash:
+                blob = by_hash[digest]
+            else:
+                known = db.query(FaceEncoding).filter(FaceEncoding.image_hash == digest).first()
+                if known is not None:
+                    blob = known.encoding
+                else:
+                    encoding = encode_student_image(img_path)
+                    blob = None if encoding is None else encoding_to_bytes(encoding)
+                by_hash[digest] = blob
+
+            if row is None:
+                row = FaceEncoding(student_id=student.id, file_name=file_name)
+                db.add(row)
+            row.image_hash = digest
+            row.file_size = size
+            row.file_mtime = mtime
+            row.encoding = blob
+            changed = True
+
+        if row.encoding is not None:
+            encodings.append(encoding_from_bytes(row.encoding))
+
+    if changed:
+        db.commit()
+        add_student_to_index(student.id, encodings)
+
+    return encodings
+
+
+def load_student_encodings(db, students):
+    # Bulk read of every stored encoding for the given students, refreshing
+    # only those whose image folder changed since it was last encoded.
+    rows_by_student = load_encoding_rows(db, [s.id for s in students])
+    encodings = {}
+
+    for student in students:
+        rows = rows_by_student.get(student.id, [])
+        if encodings_stale(student, rows):
+            encodings[student.id] = sync_student_encodings(db, student, rows)
+        else:
+            encodings[student.id] = [
+                encoding_from_bytes(r.encoding) for r in rows if r.encoding is not None
+            ]
 
     return encodings
 
 
 # ---------------------------
-# MATCH FACES
+# CLASS DISTANCE MATRIX
 # ---------------------------
-def match_faces(group_img_path, class_name, db):
-    from PIL import Image
-    import numpy as np
+MATCH_TOLERANCE = 0.5
+ENCODING_SIZE = 128
+
+# "independent": every student is checked against every face on its own, so
+#                one face may mark several look-alike students Present.
+# "assignment":  faces and students are matched one-to-one.
+MATCH_MODES = ("independent", "assignment")
+
+
+def build_class_matrix(students, encodings_by_student):
+    # Stack the representative encodings of every student of the class into
+    # one (N, 128) matrix. owners[i] is the index (into students) of the
+    # student owning row i; rows of one student are contiguous.
+    rows = []
+    owners = []
+    for index, student in enumerate(students):
+        for encoding in representative_encodings(encodings_by_student.get(student.id, [])):
+            rows.append(encoding)
+            owners.append(index)
+
+    if not rows:
+        return np.empty((0, ENCODING_SIZE)), np.empty(0, dtype=np.int64)
+
+    return np.vstack(rows), np.asarray(owners, dtype=np.int64)
+
+
+def face_distance_matrix(group_encodings, known_matrix):
+    # Euclidean distances of every group face to every known encoding, using
+    # |g - k|^2 = |g|^2 + |k|^2 - 2 g.k so it is a single matrix product.
+    group = np.asarray(group_encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+    known = np.asarray(known_matrix, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+
+    squared = (
+        np.einsum("ij,ij->i", group, group)[:, None]
+        + np.einsum("ij,ij->i", known, known)[None, :]
+        - 2.0 * (group @ known.T)
+    )
+    np.maximum(squared, 0.0, out=squared)
+    return np.sqrt(squared)
 
-    # ✅ FIX: Use PIL instead of OpenCV
-    try:
-        pil_img = Image.open(group_img_path).convert("RGB")
-        group_img = np.array(pil_img)
-    except Exception as e:
-        raise ValueError(f"Invalid group image: {e}")
 
-    group_encodings = face_recognition.face_encodings(group_img)
+# ---------------------------
+# REPRESENTATIVE ENCODINGS
+# ---------------------------
+# Students keep uploading photos, but matching only needs a few encodings
+# per student: outliers (a wrong face, a bad photo) are dropped, and larger
+# sets are reduced to their centroid plus REPRESENTATIVE_MEDOIDS medoids.
+# The stored encodings are untouched; this only shapes the class matrix.
+REPRESENTATIVE_MEDOIDS = 3
+# Encodings further than this from the student's medoid are outliers;
+# photos of one person are usually well within the 0.5 match tolerance
+OUTLIER_DISTANCE = 0.6
+
+
+def k_medoids(distances, k, iterations=10):
+    # Indices of k medoids of a square distance matrix: greedy PAM build,
+    # then alternating assignment / medoid update until stable
+    medoids = [int(distances.sum(axis=1).argmin())]
+    while len(medoids) < k:
+        nearest = distances[:, medoids].min(axis=1)
+        gain = np.maximum(nearest[:, None] - distances, 0.0).sum(axis=0)
+        gain[medoids] = -1.0
+        medoids.append(int(gain.argmax()))
+
+    for _ in range(iterations):
+        assign = distances[:, medoids].argmin(axis=1)
+        updated = []
+        for cluster, current in enumerate(medoids):
+            members = np.flatnonzero(assign == cluster)
+            # a medoid duplicating another one may be left without members
+            if not len(members):
+                updated.append(current)
+                continue
+            updated.append(int(members[distances[np.ix_(members, members)].sum(axis=1).argmin()]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return medoids
+
+
+def representative_encodings(encodings):
+    encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+    # with two encodings neither can be told apart as the outlier
+    if len(encodings) <= 2:
+        return encodings
+
+    distances = face_distance_matrix(encodings, encodings)
+    medoid = distances.sum(axis=1).argmin()
+    keep = distances[medoid] <= OUTLIER_DISTANCE
+    encodings = encodings[keep]
+    if len(encodings) <= REPRESENTATIVE_MEDOIDS + 1:
+        return encodings
+
+    medoids = k_medoids(distances[np.ix_(keep, keep)], REPRESENTATIVE_MEDOIDS)
+    return np.vstack([encodings.mean(axis=0), encodings[medoids]])
 
-    print("Detected faces in group image:", len(group_encodings))
 
+def face_student_distances(distances, owners, n_students):
+    # Reduce (faces, encodings) to (faces, students) by taking the closest
+    # encoding of each student. Students without encodings stay at inf.
+    reduced = np.full((distances.shape[0], n_students), np.inf)
+    if distances.size:
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        reduced[:, owners[starts]] = np.minimum.reduceat(distances, starts, axis=1)
+    return reduced
+
+
+# ---------------------------
+# CLASS EMBEDDINGS (CACHED)
+# ---------------------------
+# A cached class is checked against the database at most this often, so
+# students enrolled by another process (enroll_students.py) are matched
+# within this many seconds
+CLASS_CACHE_RECHECK = 60
+
+
+def class_fingerprint(db, class_name):
+    # Changes whenever a student of the class, or one of their encodings,
+    # is added, removed or moved to another class
+    return tuple(db.query(
+        func.count(Student.id), func.max(Student.id), func.count(FaceEncoding.id), func.max(FaceEncoding.id)
+    ).select_from(Student).outerjoin(FaceEncoding, FaceEncoding.student_id == Student.id).filter(
+        Student.class_name == class_name
+    ).one())
+
+
+def get_class_embeddings(db, class_name):
+    cached = class_cache.get(class_name)
+    if cached is not None:
+        if not class_cache.recheck_due(class_name, CLASS_CACHE_RECHECK):
+            return cached
+        if class_cache.confirm(class_name, class_fingerprint(db, class_name)):
+            return cached
+        print(f"Class {class_name} changed since it was cached; reloading")
+
+    # taken before loading, so a change made during the load is caught by
+    # the next recheck
+    fingerprint = class_fingerprint(db, class_name)
     students = db.query(Student).filter(Student.class_name == class_name).all()
-    attendance = {s.id: "Absent" for s in students}
+    encodings_by_student = load_student_encodings(db, students)
 
     for student in students:
-        if not student.images_path:
-            continue
+        if not encodings_by_student[student.id]:
+            print(f"No encodings for {student.name}")
 
-        student_encodings = get_student_encodings(student.images_path)
+    matrix, owners = build_class_matrix(students, encodings_by_student)
+    class_embeddings = ClassEmbeddings(
+        student_ids=[s.id for s in students],
+        names=[s.name for s in students],
+        roll_nos=[s.roll_no for s in students],
+        matrix=matrix,
+        owners=owners
+    )
+    class_cache.put(class_name, class_embeddings, fingerprint)
+    return class_embeddings
 
-        if not student_encodings:
-            print(f"No encodings for {student.name}")
+
+def update_student_caches(db, student, old_class=None):
+    # After one student's images, name, roll number or class changed (and
+    # were committed): patches the cached class(es) and the face index for
+    # that student only
+    encodings = sync_student_encodings(db, student)
+    if old_class is not None and old_class != student.class_name:
+        class_cache.remove_student(old_class, student.id)
+    class_cache.update_student(student.class_name, student.id, student.name, student.roll_no,
+                               representative_encodings(encodings))
+    add_student_to_index(student.id, encodings)
+
+
+# ---------------------------
+# ONE-TO-ONE ASSIGNMENT
+# ---------------------------
+def assign_faces(per_student, tolerance=MATCH_TOLERANCE):
+    # Credit each face to at most one student (and vice versa), minimising
+    # the total distance. Returns {student index: distance}. Uses the
+    # Hungarian solver from scipy when it is installed, otherwise a greedy
+    # pass over candidate pairs in increasing distance.
+    within = per_student <= tolerance
+    if not within.any():
+        return {}
+
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        linear_sum_assignment = None
+
+    if linear_sum_assignment is not None:
+        cost = np.where(within, per_student, tolerance * 10.0 + 1.0)
+        face_idx, student_idx = linear_sum_assignment(cost)
+        return {
+            int(s): float(per_student[f, s])
+            for f, s in zip(face_idx, student_idx)
+            if within[f, s]
+        }
+
+    face_idx, student_idx = np.nonzero(within)
+    order = np.argsort(per_student[face_idx, student_idx], kind="stable")
+
+    assigned = {}
+    used_faces = set()
+    for k in order:
+        f = int(face_idx[k])
+        s = int(student_idx[k])
+        if f in used_faces or s in assigned:
             continue
+        assigned[s] = float(per_student[f, s])
+        used_faces.add(f)
+
+    return assigned
 
-        matched = False
 
-        for g_enc in group_encodings:
-            results = face_recognition.compare_faces(
-                student_encodings,
-                g_enc,
-                tolerance=0.5
+def distance_to_confidence(distance):
+    return round(max(0.0, 1.0 - float(distance)), 4)
+
+
+# ---------------------------
+# GROUP PHOTO ENCODING
+# ---------------------------
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    # One pool per server process, shared by every session. "spawn" because
+    # forking the multi-threaded Streamlit server is not safe.
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn")
             )
+        return _process_pool
+
+
+def encode_group_image(group_img_path):
+    start = time.perf_counter()
+
+    # ✅ FIX: Use PIL instead of OpenCV
+    try:
+        faces = detect_and_encode(group_img_path)
+    except Exception as e:
+        raise ValueError(f"Invalid group image: {e}")
+
+    elapsed = (time.perf_counter() - start) * 1000
+    rss = peak_rss_mb()
+    print(f"Detected faces in group image: {len(faces)} ({elapsed:.0f} ms"
+          + (f", peak RSS {rss:.0f} MB)" if rss is not None else ")"))
+
+    return np.asarray([f[0] for f in faces], dtype=np.float64).reshape(-1, ENCODING_SIZE)
+
+
+def _encode_group_image_with_spans(group_img_path):
+    # Pool worker: the encodings plus the spans timed in the worker
+    with captured_spans() as spans:
+        encodings = encode_group_image(group_img_path)
+    return encodings, spans
 
-            if True in results:
-                matched = True
-                break
 
-        if matched:
-            attendance[student.id] = "Present"
+def encode_group_images(group_img_paths, pool=None):
+    # Detect and encode every photo of a session, one photo per worker of
+    # pool (default: the shared process pool). Returns one (faces, 128)
+    # array per photo.
+    if pool is None and len(group_img_paths) == 1:
+        return [encode_group_image(group_img_paths[0])]
 
-    return attendance
+    group_img_paths = [os.path.abspath(p) for p in group_img_paths]
+    per_photo = []
+    for encodings, spans in (pool or get_process_pool()).map(_encode_group_image_with_spans, group_img_paths):
+        replay(spans)
+        per_photo.append(encodings)
+    return per_photo
 
 
 # ---------------------------
-# MARK ATTENDANCE
+# MATCH FACES
 # ---------------------------
-def mark_attendance(db, session_name, class_name, group_img_path):
+def class_face_distances(per_photo, class_embeddings):
+    # (faces, students) distances of every face of the session to the
+    # closest encoding of every student of the class
+    group_encodings = np.vstack(per_photo) if per_photo else np.empty((0, ENCODING_SIZE))
+    distances = face_distance_matrix(group_encodings, class_embeddings.matrix)
+    return face_student_distances(distances, class_embeddings.owners, len(class_embeddings.student_ids))
+
+
+def match_encodings(per_photo, class_embeddings, mode="independent", tolerance=MATCH_TOLERANCE, per_student=None):
+    # per_photo is one (faces, 128) array per photo of the session;
+    # per_student skips recomputing class_face_distances().
+    # Returns ({student_id: status}, {student_id: confidence or None},
+    # indices of the faces not within tolerance of any student of the class).
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Unknown match mode: {mode}")
+
+    if per_student is None:
+        per_student = class_face_distances(per_photo, class_embeddings)
+
+    if mode == "assignment":
+        # The same person usually appears in several photos, so faces are
+        # assigned one-to-one within each photo and the photos are unioned.
+        matched = {}
+        row = 0
+        for photo_encodings in per_photo:
+            photo_rows = per_student[row:row + len(photo_encodings)]
+            row += len(photo_encodings)
+            for i, distance in assign_faces(photo_rows, tolerance).items():
+                matched[i] = min(distance, matched.get(i, distance))
+    else:
+        best = per_student.min(axis=0, initial=np.inf)
+        matched = {
+            i: float(best[i]) for i in np.flatnonzero(best <= tolerance).tolist()
+        }
+
+    attendance = {}
+    confidence = {}
+    for i, student_id in enumerate(class_embeddings.student_ids):
+        if i in matched:
+            attendance[student_id] = "Present"
+            confidence[student_id] = distance_to_confidence(matched[i])
+        else:
+            attendance[student_id] = "Absent"
+            confidence[student_id] = None
+
+    unmatched = np.flatnonzero(per_student.min(axis=1, initial=np.inf) > tolerance)
+
+    return attendance, confidence, unmatched
+
+
+def match_class(group_img_paths, class_embeddings, mode="independent", tolerance=MATCH_TOLERANCE):
+    # group_img_paths is one path or a list of photos of the same session.
+    # Returns ({student_id: status}, {student_id: confidence or None}).
+    if isinstance(group_img_paths, str):
+        group_img_paths = [group_img_paths]
+
+    attendance, confidence, _ = match_encodings(
+        encode_group_images(group_img_paths), class_embeddings, mode=mode, tolerance=tolerance
+    )
+    return attendance, confidence
 
-    attendance = match_faces(group_img_path, class_name, db)
 
-    # Create session
-    session = AttendanceSession(session_name=session_name, class_name=class_name)
-    db.add(session)
-    db.commit()
-    db.refresh(session)
+def match_faces(group_img_paths, class_name, db, mode="independent"):
+    # Uses the class's calibrated tolerance (see calibrate_thresholds.py)
+    class_embeddings = get_class_embeddings(db, class_name)
+    tolerance = class_tolerance(db, class_name, MATCH_TOLERANCE)
+    return match_class(group_img_paths, class_embeddings, mode=mode, tolerance=tolerance)
 
-    # Insert records
-    for student_id, status in attendance.items():
-        rec = AttendanceRecord(
-            session_id=session.id,
-            student_id=student_id,
-            status=status
-        )
-        db.add(rec)
 
-    db.commit()
+# ---------------------------
+# OUT-OF-CLASS VISITORS
+# ---------------------------
+def identify_visitors(db, face_encodings, class_student_ids):
+    # Look faces no class member matched up in the institution-wide index.
+    # Returns [{student_id, name, roll_no, class_name, distance}] of enrolled
+    # students from other classes, or [] when the index is disabled.
+    if not len(face_encodings):
+        return []
+
+    found = search_face_index(db, face_encodings)
+    if found is None:
+        return []
+
+    in_class = set(class_student_ids)
+    best = {}
+    for distance, owner in zip(*found):
+        owner = int(owner)
+        if owner < 0 or owner in in_class or distance > MATCH_TOLERANCE:
+            continue
+        best[owner] = min(float(distance), best.get(owner, float(distance)))
 
-    # Export CSV
-    students = db.query(Student).filter(Student.id.in_(attendance.keys())).all()
+    if not best:
+        return []
 
-    data = []
-    for student in students:
-        data.append({
-            "student_id": student.id,
-            "student_name": student.name,
-            "roll_no": student.roll_no,
-            "status": attendance[student.id]
-        })
-
-    df = pd.DataFrame(data)
-
-    csv_path = os.path.join(
-        CSV_DIR,
-        f"{session.timestamp.date()}_{session_name}_{class_name}.csv"
+    students = db.query(Student).filter(Student.id.in_(best.keys())).all()
+    return [
+        {
+            "student_id": s.id,
+            "name": s.name,
+            "roll_no": s.roll_no,
+            "class_name": s.class_name,
+            "distance": round(best[s.id], 4)
+        }
+        for s in students
+    ]
+
+
+# ---------------------------
+# SAVE ATTENDANCE
+# ---------------------------
+def save_attendance(db, session_name, class_name, attendance, confidence, timestamp, csv_path=None):
+    # Session row plus one multi-row INSERT (executemany) for its records,
+    # without building ORM objects, and the per-student running totals.
+    # The caller commits.
+    result = db.execute(
+        insert(AttendanceSession).values(
+            session_name=session_name,
+            class_name=class_name,
+            timestamp=timestamp,
+            csv_path=csv_path
+        )
     )
+    session_id = result.inserted_primary_key[0]
+
+    if attendance:
+        db.execute(
+            insert(AttendanceRecord),
+            [
+                {
+                    "session_id": session_id,
+                    "student_id": student_id,
+                    "status": status,
+                    "confidence": confidence.get(student_id)
+                }
+                for student_id, status in attendance.items()
+            ]
+        )
+        update_attendance_stats(db, class_name, attendance, timestamp)
 
-    df.to_csv(csv_path, index=False)
+    return session_id
 
-    session.csv_path = csv_path
-    db.commit()
 
-    return csv_path
\ No newline at end of file
+# ---------------------------
+# CSV EXPORT
+# ---------------------------
+CSV_COLUMNS = ["student_id", "student_name", "roll_no", "status", "confidence"]
+
+
+def attendance_rows(class_embeddings, attendance, confidence):
+    # Generator over the students already loaded for matching
+    for student_id, name, roll_no in zip(
+        class_embeddings.student_ids, class_embeddings.names, class_embeddings.roll_nos
+    ):
+        yield student_id, name, roll_no, attendance[student_id], confidence[student_id]
+
+
+def write_attendance_csv(f, rows):
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(CSV_COLUMNS)
+    writer.writerows(rows)
+
+
+def attendance_csv_bytes(rows):
+    buffer = io.StringIO()
+    write_attendance_csv(buffer, rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+# ---------------------------
+# MARK ATTENDANCE
+# ---------------------------
+def record_attendance(db, session_name, class_name, group_img_paths, mode="independent", per_photo=None):
+    # Returns (csv_path, csv_bytes, visitors) so callers can serve the report
+    # without reading it back from disk; visitors are enrolled students of
+    # other classes recognised in the photos (see identify_visitors).
+    # per_photo skips encoding when the caller already encoded the photos.
+    if isinstance(group_img_paths, str):
+        group_img_paths = [group_img_paths]
+
+    with tagged(session=session_name, class_name=class_name), span("record_attendance") as tags:
+        with span("load_class"):
+            class_embeddings = get_class_embeddings(db, class_name)
+            tolerance = class_tolerance(db, class_name, MATCH_TOLERANCE)
+        if per_photo is None:
+            per_photo = encode_group_images(group_img_paths)
+        tags["faces"] = sum(len(p) for p in per_photo)
+
+        with span("match", faces=tags["faces"]):
+            per_student = class_face_distances(per_photo, class_embeddings)
+            attendance, confidence, unmatched = match_encodings(
+                per_photo, class_embeddings, mode=mode, tolerance=tolerance, per_student=per_student
+            )
+        with span("visitors"):
+            visitors = identify_visitors(db, np.vstack(per_photo)[unmatched], class_embeddings.student_ids)
+
+        timestamp = datetime.utcnow()
+        csv_path = os.path.join(
+            CSV_DIR,
+            f"{timestamp.date()}_{session_name}_{class_name}.csv"
+        )
+
+        # Session, records and CSV succeed or fail together
+        try:
+            with span("db_write"):
+                session_id = save_attendance(
+                    db, session_name, class_name, attendance, confidence, timestamp, csv_path
+                )
+                # history for calibrate_thresholds.py
+                save_match_distances(
+                    db, session_id, class_name, class_embeddings.student_ids, per_student, tolerance, timestamp
+                )
+
+            with span("csv_export"):
+                csv_bytes = attendance_csv_bytes(attendance_rows(class_embeddings, attendance, confidence))
+                with open(csv_path, "wb") as f:
+                    f.write(csv_bytes)
+
+            with span("db_commit"):
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        # The archive is a derived copy for reports: losing one session there
+        # must not fail the attendance that is already committed
+        try:
+            with span("archive_write"):
+                append_session(session_id, session_name, class_name, timestamp,
+                               attendance_rows(class_embeddings, attendance, confidence))
+        except Exception as e:
+            print(f"❌ Could not archive session {session_id}: {e}")
+
+    flush_spans()
+    return csv_path, csv_bytes, visitors
+
+
+def mark_attendance(db, session_name, class_name, group_img_paths, mode="independent"):
+    csv_path, _, _ = record_attendance(db, session_name, class_name, group_img_paths, mode=mode)
+    return csv_path
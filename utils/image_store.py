@@ -0,0 +1,286 @@
+import os
+import io
+import shutil
+import hashlib
+import tempfile
+
+from db.models import FaceEncoding, StoredImage
+from utils.face_utils import STUDENT_IMG_DIR, encoding_to_bytes, sync_student_encodings, update_student_caches
+from utils.face_quality import assess_student_image, quality_to_json, quality_from_json
+
+# Enrollment images are stored once per distinct upload, named by the
+# SHA-256 of the uploaded bytes:
+#   student_images/store/ab/ab12....jpg    normalized, at most STORE_MAX_SIDE
+#   student_images/thumbs/ab/ab12....jpg   THUMB_SIDE thumbnail for the dashboards
+# The same hash keys the face_encodings rows, so an image uploaded again (for
+# the same or another student) is neither written nor encoded twice.
+STORE_DIR = os.path.join(STUDENT_IMG_DIR, "store")
+THUMB_DIR = os.path.join(STUDENT_IMG_DIR, "thumbs")
+STORE_MAX_SIDE = 1600
+STORE_JPEG_QUALITY = 90
+THUMB_SIDE = 160
+
+
+def image_path(image_hash):
+    return os.path.join(STORE_DIR, image_hash[:2], image_hash + ".jpg")
+
+
+def thumbnail_path(image_hash):
+    return os.path.join(THUMB_DIR, image_hash[:2], image_hash + ".jpg")
+
+
+def _write_atomic(path, data):
+    # Readers never see a half-written file, and two workers storing the
+    # same image just replace each other's identical copy
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _jpeg_bytes(img, max_side):
+    img = img.copy()
+    img.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=STORE_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue(), img.size
+
+
+# ---------------------------
+# FILES
+# ---------------------------
+def write_image(data):
+    # Stores an uploaded image (any format PIL reads) unless already stored.
+    # Safe to call from pool workers. Returns (hash, stored bytes, width, height).
+    from PIL import Image, ImageOps
+
+    digest = hashlib.sha256(data).hexdigest()
+    path = image_path(digest)
+    if os.path.exists(path) and os.path.exists(thumbnail_path(digest)):
+        with Image.open(path) as img:
+            return digest, os.path.getsize(path), img.size[0], img.size[1]
+
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("RGB")
+    normalized, (width, height) = _jpeg_bytes(img, STORE_MAX_SIDE)
+    thumbnail, _ = _jpeg_bytes(img, THUMB_SIDE)
+    _write_atomic(path, normalized)
+    _write_atomic(thumbnail_path(digest), thumbnail)
+    return digest, len(normalized), width, height
+
+
+def write_image_file(img_path):
+    with open(img_path, "rb") as f:
+        return write_image(f.read())
+
+
+def remove_image_files(image_hashes):
+    # Only for hashes release_image_refs() returned, after the commit
+    for image_hash in image_hashes:
+        for path in (image_path(image_hash), thumbnail_path(image_hash)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# ---------------------------
+# REFERENCE COUNTS
+# ---------------------------
+def add_image_refs(db, stored):
+    # stored is [(hash, size, width, height)], one entry per new reference
+    if not stored:
+        return
+    hashes = {s[0] for s in stored}
+    rows = {r.image_hash: r for r in db.query(StoredImage).filter(StoredImage.image_hash.in_(hashes))}
+    for image_hash, size, width, height in stored:
+        row = rows.get(image_hash)
+        if row is None:
+            row = rows[image_hash] = StoredImage(
+                image_hash=image_hash, size=size, width=width, height=height, refcount=0
+            )
+            db.add(row)
+        row.refcount += 1
+
+
+def release_image_refs(db, image_hashes):
+    # One reference per entry. Returns the hashes no longer referenced, whose
+    # files the caller removes with remove_image_files() once committed.
+    if not image_hashes:
+        return []
+    rows = {
+        r.image_hash: r
+        for r in db.query(StoredImage).filter(StoredImage.image_hash.in_(set(image_hashes)))
+    }
+    for image_hash in image_hashes:
+        if image_hash in rows:
+            rows[image_hash].refcount -= 1
+
+    orphaned = [h for h, row in rows.items() if row.refcount <= 0]
+    for image_hash in orphaned:
+        db.delete(rows[image_hash])
+    return orphaned
+
+
+# ---------------------------
+# STUDENT IMAGES
+# ---------------------------
+# Students enrolled through the store have no images_path; their
+# face_encodings rows are the list of their images. Adding or removing
+# images only encodes the new ones, and patches the student's class in the
+# class cache and the face index instead of rebuilding them. Students still
+# on a legacy folder are moved into the store first.
+def _score_uploads(db, uploads, have):
+    # Scores the uploads whose hash is not in have. Returns (report, accepted):
+    # report is [(file name, outcome, quality)] with every upload rejected or
+    # "duplicate" so far, accepted is [(position, file name, data, encoding
+    # bytes, quality)] for _store_uploads() to mark "added".
+    report = [(file_name, "duplicate", None) for file_name, _ in uploads]
+    new = []
+    for position, (file_name, data) in enumerate(uploads):
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in have:
+            have.add(digest)
+            new.append((position, file_name, digest, data))
+
+    # Scores and encodings are keyed by the same hash, so images known from
+    # any student are not scored or encoded again
+    known = {
+        h: (blob, quality)
+        for h, blob, quality in db.query(FaceEncoding.image_hash, FaceEncoding.encoding, FaceEncoding.quality)
+        .filter(FaceEncoding.image_hash.in_([n[2] for n in new]))
+        if quality is not None
+    } if new else {}
+
+    accepted = []
+    for position, file_name, digest, data in new:
+        if digest in known:
+            blob, quality = known[digest][0], quality_from_json(known[digest][1])
+        else:
+            encoding, quality = assess_student_image(data)
+            blob = None if encoding is None else encoding_to_bytes(encoding)
+            known[digest] = (blob, quality_to_json(quality))
+        if quality["status"] == "reject":
+            report[position] = (file_name, "rejected", quality)
+        else:
+            accepted.append((position, file_name, data, blob, quality))
+    return report, accepted
+
+
+def _store_uploads(db, student, accepted, report):
+    # Writes the accepted images to the store and adds their rows; the
+    # caller commits. Returns the hashes stored.
+    hashes = set()
+    for position, file_name, data, blob, quality in accepted:
+        image_hash, size, width, height = write_image(data)
+        add_image_refs(db, [(image_hash, size, width, height)])
+        db.add(FaceEncoding(
+            student_id=student.id, file_name=file_name, image_hash=image_hash,
+            file_size=size, file_mtime=0, encoding=blob, quality=quality_to_json(quality)
+        ))
+        report[position] = (file_name, "added", quality)
+        hashes.add(image_hash)
+    return hashes
+
+
+def enroll_student(db, user, student, uploads):
+    # Adds a new student (and their portal user) only when at least one of
+    # the uploads is usable, so a rejected enrollment leaves nothing behind
+    # and can be submitted again with better photos. Everything is committed
+    # in one transaction. Returns (report as for update_student_images,
+    # created).
+    report, accepted = _score_uploads(db, uploads, set())
+    if not accepted:
+        return report, False
+
+    student.user = user
+    db.add_all([user, student])
+    db.flush()
+    _store_uploads(db, student, accepted, report)
+    db.commit()
+    update_student_caches(db, student)
+    return report, True
+
+
+def update_student_images(db, student, uploads=(), remove_ids=()):
+    # uploads is [(file name, bytes)], remove_ids face_encodings row ids of
+    # the student. The uploads are scored first (see face_quality); rejected
+    # images and images the student keeps already are not added. Nothing
+    # changes when the removal would leave the student without a usable
+    # face image. Commits once;
+    # returns (images removed, report, refused) with report
+    # [(file name, outcome, quality)], outcome "added", "rejected" or
+    # "duplicate".
+    migrate_student_images(db, student)
+    rows = db.query(FaceEncoding).filter(FaceEncoding.student_id == student.id).all()
+    removing = [r for r in rows if r.id in set(remove_ids)]
+    have = {r.image_hash for r in rows if r not in removing}
+
+    report, accepted = _score_uploads(db, uploads, have)
+    kept = sum(r.encoding is not None for r in rows if r not in removing)
+    if removing and kept + len(accepted) == 0:
+        return 0, report, True
+    if not removing and not accepted:
+        return 0, report, False
+
+    orphaned = release_image_refs(db, [r.image_hash for r in removing])
+    for row in removing:
+        db.delete(row)
+    # sessions do not autoflush: an image removed and uploaded again must
+    # be gone before its reference is added back
+    db.flush()
+    stored = _store_uploads(db, student, accepted, report)
+    db.commit()
+    # an image removed and uploaded again in the same edit keeps its file
+    remove_image_files([h for h in orphaned if h not in stored])
+    update_student_caches(db, student)
+    return len(removing), report, False
+
+
+def student_images(db, student):
+    # [(face_encodings id, file name, thumbnail path, encoded, quality)];
+    # students still on a legacy folder show the original files
+    if student.images_path:
+        sync_student_encodings(db, student)
+    rows = db.query(FaceEncoding).filter(FaceEncoding.student_id == student.id).order_by(FaceEncoding.id)
+    return [
+        (r.id, r.file_name,
+         os.path.join(student.images_path, r.file_name) if student.images_path else thumbnail_path(r.image_hash),
+         r.encoding is not None, quality_from_json(r.quality))
+        for r in rows
+    ]
+
+
+def release_student_images(db, student):
+    # Call before deleting a student. Returns the hashes to pass to
+    # remove_image_files() after the commit.
+    if student.images_path:
+        return []
+    hashes = [h for (h,) in db.query(FaceEncoding.image_hash).filter(FaceEncoding.student_id == student.id)]
+    return release_image_refs(db, hashes)
+
+
+# ---------------------------
+# MIGRATION
+# ---------------------------
+def migrate_student_images(db, student):
+    # Moves a student from student_images/<id>/ into the store. The stored
+    # encodings are kept: their image_hash already is the store key.
+    # Returns the number of images moved.
+    if not student.images_path:
+        return 0
+    sync_student_encodings(db, student)
+    rows = db.query(FaceEncoding).filter(FaceEncoding.student_id == student.id).all()
+
+    stored = []
+    for row in rows:
+        image_hash, size, width, height = write_image_file(os.path.join(student.images_path, row.file_name))
+        row.image_hash = image_hash
+        row.file_size = size
+        row.file_mtime = 0
+        stored.append((image_hash, size, width, height))
+    add_image_refs(db, stored)
+
+    folder = student.images_path
+    student.images_path = None
+    db.commit()
+    shutil.rmtree(folder, ignore_errors=True)
+    return len(rows)
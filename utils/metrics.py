@@ -0,0 +1,259 @@
+import os
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from collections import deque
+
+import numpy as np
+
+# Per-stage timings of the attendance pipeline. Every span is kept
+# in-process (a window of recent samples per stage for the percentiles,
+# plus running count/sum); with ATTENDANCE_METRICS_PERSIST=1 they are also
+# written to the pipeline_spans table so history survives restarts.
+PERSIST_SPANS = os.environ.get("ATTENDANCE_METRICS_PERSIST", "0") == "1"
+SAMPLES_KEPT = 2048
+RECENT_SPANS_KEPT = 500
+QUANTILES = (0.5, 0.95, 0.99)
+# Spans waiting to be persisted are flushed by a background thread every
+# FLUSH_INTERVAL seconds; at most PENDING_SPANS_KEPT wait, the oldest being
+# dropped beyond that (e.g. while the database is unreachable)
+FLUSH_INTERVAL = 30
+PENDING_SPANS_KEPT = 20000
+
+_lock = threading.Lock()
+_stages = {}
+_recent = deque(maxlen=RECENT_SPANS_KEPT)
+_pending = deque(maxlen=PENDING_SPANS_KEPT)
+_dropped = 0
+_flusher = None
+_context = threading.local()
+
+
+class _Stage:
+
+    def __init__(self):
+        self.samples = deque(maxlen=SAMPLES_KEPT)
+        self.count = 0
+        self.total_ms = 0.0
+
+
+# ---------------------------
+# RECORDING
+# ---------------------------
+def record(name, duration_ms, tags=None):
+    global _dropped
+    tags = dict(tags or {})
+    with _lock:
+        stage = _stages.setdefault(name, _Stage())
+        stage.samples.append(duration_ms)
+        stage.count += 1
+        stage.total_ms += duration_ms
+        _recent.append((datetime.utcnow(), name, duration_ms, tags))
+        if PERSIST_SPANS:
+            if len(_pending) == PENDING_SPANS_KEPT:
+                _dropped += 1
+            _pending.append((datetime.utcnow(), name, duration_ms, tags))
+            _start_flusher()
+
+
+def current_tags():
+    # Tags of the enclosing tagged() blocks of this thread; helper threads
+    # carry them over with tagged(**tags)
+    return dict(getattr(_context, "tags", {}))
+
+
+@contextmanager
+def tagged(**tags):
+    # Tags (session, class, ...) added to every span of this thread inside
+    # the block
+    previous = getattr(_context, "tags", {})
+    _context.tags = {**previous, **tags}
+    try:
+        yield
+    finally:
+        _context.tags = previous
+
+
+@contextmanager
+def span(name, **tags):
+    # Times the block. Tags can also be set on the yielded dict inside it,
+    # e.g. the number of faces only known once detection ran.
+    span_tags = {**current_tags(), **tags}
+    start = time.perf_counter()
+    try:
+        yield span_tags
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        captured = getattr(_context, "captured", None)
+        if captured is not None:
+            captured.append((name, duration_ms, span_tags))
+        else:
+            record(name, duration_ms, span_tags)
+
+
+# Spans timed in a pool worker never reach this process's registry, so the
+# worker captures them and returns them alongside its result; the caller
+# replays them under its own tags.
+@contextmanager
+def captured_spans():
+    spans = []
+    _context.captured = spans
+    try:
+        yield spans
+    finally:
+        _context.captured = None
+
+
+def replay(spans):
+    context_tags = current_tags()
+    for name, duration_ms, tags in spans:
+        record(name, duration_ms, {**context_tags, **tags})
+
+
+# ---------------------------
+# READING
+# ---------------------------
+def _summary(samples, count, total_ms):
+    values = np.fromiter(samples, dtype=np.float64)
+    percentiles = np.percentile(values, [q * 100 for q in QUANTILES]) if len(values) else [0.0] * len(QUANTILES)
+    return {
+        "count": count,
+        "mean_ms": total_ms / count if count else 0.0,
+        "p50_ms": float(percentiles[0]),
+        "p95_ms": float(percentiles[1]),
+        "p99_ms": float(percentiles[2]),
+        "max_ms": float(values.max()) if len(values) else 0.0,
+    }
+
+
+def stage_summaries():
+    # {stage: {count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}; percentiles
+    # over the last SAMPLES_KEPT spans of each stage
+    with _lock:
+        return {
+            name: _summary(stage.samples, stage.count, stage.total_ms)
+            for name, stage in sorted(_stages.items())
+        }
+
+
+def recent_spans(limit=100):
+    with _lock:
+        return list(_recent)[-limit:][::-1]
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _recent.clear()
+        _pending.clear()
+
+
+def prometheus_text():
+    # Prometheus text exposition format: one summary over every stage, plus
+    # the class embedding cache counters
+    lines = [
+        "# HELP attendance_stage_seconds Time spent in each attendance pipeline stage.",
+        "# TYPE attendance_stage_seconds summary",
+    ]
+    for name, s in stage_summaries().items():
+        for q in QUANTILES:
+            value = s[f"p{int(q * 100)}_ms"] / 1000
+            lines.append(f'attendance_stage_seconds{{stage="{name}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'attendance_stage_seconds_sum{{stage="{name}"}} {s["mean_ms"] * s["count"] / 1000:.6f}')
+        lines.append(f'attendance_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+
+    from utils.class_cache import class_cache
+
+    cache = class_cache.stats()
+    for counter, help_text in (
+        ("hits", "Class embedding cache lookups served from memory."),
+        ("misses", "Class embedding cache lookups that loaded the class from the database."),
+        ("evictions", "Classes evicted from the class embedding cache."),
+        ("stale", "Cached classes found changed on a recheck and reloaded."),
+    ):
+        lines.append(f"# HELP attendance_class_cache_{counter}_total {help_text}")
+        lines.append(f"# TYPE attendance_class_cache_{counter}_total counter")
+        lines.append(f"attendance_class_cache_{counter}_total {cache[counter]}")
+    lines.append("# HELP attendance_class_cache_bytes Memory held by the class embedding cache.")
+    lines.append("# TYPE attendance_class_cache_bytes gauge")
+    lines.append(f"attendance_class_cache_bytes {cache['bytes']}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# PERSISTENCE
+# ---------------------------
+def _start_flusher():
+    # caller holds _lock
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+        _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush_spans()
+
+
+def flush_spans():
+    # Writes the spans recorded since the last flush; no-op unless
+    # ATTENDANCE_METRICS_PERSIST=1. Spans that could not be written are
+    # queued again for the next flush.
+    global _dropped
+    if not PERSIST_SPANS:
+        return 0
+    with _lock:
+        pending = list(_pending)
+        _pending.clear()
+        dropped, _dropped = _dropped, 0
+    if dropped:
+        print(f"⚠️  Dropped {dropped} pipeline spans waiting to be persisted")
+    if not pending:
+        return 0
+
+    from sqlalchemy import insert
+    from utils.db_conn import session_scope
+    from db.models import PipelineSpan
+
+    try:
+        with session_scope() as db:
+            db.execute(insert(PipelineSpan), [
+                {
+                    "created_at": created_at,
+                    "stage": name,
+                    "duration_ms": duration_ms,
+                    "session_name": tags.get("session"),
+                    "class_name": tags.get("class_name"),
+                    "faces": tags.get("faces"),
+                }
+                for created_at, name, duration_ms, tags in pending
+            ])
+            db.commit()
+    except Exception as e:
+        print(f"❌ Could not persist pipeline spans: {e}")
+        with _lock:
+            # ahead of the spans recorded meanwhile, within the cap
+            room = PENDING_SPANS_KEPT - len(_pending)
+            requeued = pending[-room:] if room > 0 else []
+            _pending.extendleft(reversed(requeued))
+            _dropped += len(pending) - len(requeued)
+        return 0
+    return len(pending)
+
+
+def persisted_summaries(db, since):
+    # Same shape as stage_summaries(), over the spans stored since the given
+    # datetime
+    from db.models import PipelineSpan
+
+    durations = {}
+    rows = db.query(PipelineSpan.stage, PipelineSpan.duration_ms).filter(PipelineSpan.created_at >= since)
+    for stage, duration_ms in rows:
+        durations.setdefault(stage, []).append(duration_ms)
+    return {
+        stage: _summary(values, len(values), sum(values))
+        for stage, values in sorted(durations.items())
+    }
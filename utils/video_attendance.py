@@ -0,0 +1,385 @@
+import os
+import time
+import queue
+import threading
+
+import numpy as np
+
+from utils.face_utils import (
+    DETECTION_MODEL, DETECTION_UPSAMPLE, FACE_CROP_MARGIN, ENCODING_SIZE, IMAGE_EXTENSIONS,
+    encode_group_images, get_process_pool, peak_rss_mb
+)
+from utils.metrics import span, tagged, current_tags, captured_spans, replay
+
+# Attendance from a short classroom video (or a local camera) instead of
+# photos. Frames are sampled rather than all processed, faces are followed
+# from sample to sample by box overlap, and each tracked face is encoded only
+# a few times. A track's encodings are averaged, so every person seen in the
+# clip counts as one face, as if they appeared once in a single photo.
+#
+#   reader thread --(bounded frame queue)--> detection threads --> tracker
+#
+# Detection and encoding run in the process pool; the threads only move
+# frames, so a 4-core machine keeps up with a 720p stream.
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm")
+
+# Detection runs on frames downscaled to this size; faces are encoded from
+# the full-resolution frame
+VIDEO_DETECT_MAX_SIDE = int(os.environ.get("ATTENDANCE_VIDEO_DETECT_MAX_SIDE", "960"))
+
+# Seconds between sampled frames: the minimum while new faces appear or
+# tracks still need encodings, growing up to the maximum while the scene
+# is settled
+SAMPLE_INTERVAL_MIN = 0.2
+SAMPLE_INTERVAL_MAX = 1.0
+SAMPLE_INTERVAL_GROWTH = 1.5
+
+# A detection continues a track when their boxes overlap at least this much
+TRACK_IOU = 0.3
+# Tracks not seen for this many seconds are closed
+TRACK_MAX_GAP = 2.0
+ENCODINGS_PER_TRACK = 3
+# Encodings of one track are spaced out, so they cover different poses
+ENCODE_SPACING = 1.0
+# Closed tracks whose averaged encodings are this close are the same person
+# seen again, unless the two were on screen at the same time
+TRACK_MERGE_DISTANCE = 0.35
+
+FRAME_QUEUE_SIZE = 8
+
+
+def is_video(source):
+    # Camera sources are given by index
+    return isinstance(source, int) or os.path.splitext(str(source))[1].lower() in VIDEO_EXTENSIONS
+
+
+def _open_capture(source):
+    # Imported here: OpenCV is only needed for video sessions
+    import cv2
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source: {source}")
+    return capture
+
+
+# ---------------------------
+# POOL WORKERS
+# ---------------------------
+def _detect_frame(small_rgb):
+    import face_recognition
+
+    with captured_spans() as spans:
+        with span("video_detect") as tags:
+            boxes = face_recognition.face_locations(
+                small_rgb, number_of_times_to_upsample=DETECTION_UPSAMPLE, model=DETECTION_MODEL
+            )
+            tags["faces"] = len(boxes)
+    return boxes, spans
+
+
+def _encode_crops(crops):
+    # crops is [(RGB crop, face location within the crop)]; returns one
+    # encoding or None per crop
+    import face_recognition
+
+    encodings = []
+    with captured_spans() as spans:
+        with span("video_encode", faces=len(crops)):
+            for crop, location in crops:
+                found = face_recognition.face_encodings(crop, known_face_locations=[location])
+                encodings.append(found[0] if found else None)
+    return encodings, spans
+
+
+# ---------------------------
+# TRACKING
+# ---------------------------
+class _Track:
+
+    def __init__(self, track_id, box, t):
+        self.id = track_id
+        self.box = box
+        self.first_seen = t
+        self.last_seen = t
+        self.last_encoded = None
+        self.pending = 0
+        self.encodings = []
+
+    def wants_encoding(self, t):
+        return (
+            len(self.encodings) + self.pending < ENCODINGS_PER_TRACK
+            and (self.last_encoded is None or t - self.last_encoded >= ENCODE_SPACING)
+        )
+
+
+def _iou(a, b):
+    # boxes are (top, right, bottom, left)
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    overlap = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return overlap / float(area_a + area_b - overlap)
+
+
+def _associate(tracks, boxes):
+    # Greedy one-to-one matching by overlap. Returns ({box index: track},
+    # indices of the boxes starting a new track).
+    pairs = sorted(
+        ((_iou(track.box, box), i, track) for track in tracks for i, box in enumerate(boxes)),
+        key=lambda p: p[0], reverse=True
+    )
+    matched = {}
+    used = set()
+    for overlap, i, track in pairs:
+        if overlap < TRACK_IOU:
+            break
+        if i in matched or track.id in used:
+            continue
+        matched[i] = track
+        used.add(track.id)
+    return matched, [i for i in range(len(boxes)) if i not in matched]
+
+
+def _face_crop(frame, box):
+    # RGB crop around the box with the same margin as photo encoding
+    top, right, bottom, left = box
+    height, width = frame.shape[:2]
+    margin_x = int((right - left) * FACE_CROP_MARGIN)
+    margin_y = int((bottom - top) * FACE_CROP_MARGIN)
+    crop_left, crop_top = max(0, left - margin_x), max(0, top - margin_y)
+    crop_right, crop_bottom = min(width, right + margin_x), min(height, bottom + margin_y)
+
+    # OpenCV frames are BGR
+    crop = np.ascontiguousarray(frame[crop_top:crop_bottom, crop_left:crop_right, ::-1])
+    return crop, (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+
+
+def _merge_tracks(tracks):
+    # Groups the tracks of one person who left the frame (or was missed for
+    # a while) and came back. Returns one averaged encoding per person.
+    people = []
+    for track in sorted(tracks, key=lambda t: t.first_seen):
+        centroid = np.mean(track.encodings, axis=0)
+        for person in people:
+            overlaps = any(
+                track.first_seen <= other.last_seen and other.first_seen <= track.last_seen
+                for other in person["tracks"]
+            )
+            if not overlaps and np.linalg.norm(person["centroid"] - centroid) <= TRACK_MERGE_DISTANCE:
+                person["tracks"].append(track)
+                person["encodings"].extend(track.encodings)
+                person["centroid"] = np.mean(person["encodings"], axis=0)
+                break
+        else:
+            people.append({"tracks": [track], "encodings": list(track.encodings), "centroid": centroid})
+    return [p["centroid"] for p in people]
+
+
+# ---------------------------
+# VIDEO PIPELINE
+# ---------------------------
+def _put(q, item, stop):
+    # Blocking put that gives up once the pipeline is stopping
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def encode_video(source, max_seconds=None, pool=None, workers=None):
+    # source is a video file or a camera index. Camera streams are read in
+    # real time (frames are dropped when detection falls behind) until
+    # max_seconds; files are read completely unless max_seconds is given.
+    # Returns a (people, 128) array, one averaged encoding per person seen.
+    import cv2
+
+    pool = pool or get_process_pool()
+    workers = max(1, workers or os.cpu_count() or 1)
+    live = isinstance(source, int)
+    if live and max_seconds is None:
+        raise ValueError("A camera stream needs max_seconds")
+    capture = _open_capture(source)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+
+    frames = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+    results = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+    stop = threading.Event()
+    sampling = {"interval": SAMPLE_INTERVAL_MIN}
+    stats = {"read": 0, "sampled": 0, "dropped": 0}
+    tags = current_tags()
+
+    def read_frames():
+        start = time.monotonic()
+        next_sample = 0.0
+        index = 0
+        try:
+            while not stop.is_set():
+                if not capture.grab():
+                    break
+                t = time.monotonic() - start if live else stats["read"] / fps
+                stats["read"] += 1
+                if max_seconds is not None and t > max_seconds:
+                    break
+                # Frames between samples are grabbed but never decoded
+                if t < next_sample:
+                    continue
+                ok, frame = capture.retrieve()
+                if not ok:
+                    continue
+                if live:
+                    try:
+                        frames.put_nowait((index, t, frame))
+                    except queue.Full:
+                        # detection is behind: skip this frame and sample less often
+                        stats["dropped"] += 1
+                        sampling["interval"] = min(SAMPLE_INTERVAL_MAX,
+                                                   sampling["interval"] * SAMPLE_INTERVAL_GROWTH)
+                        continue
+                elif not _put(frames, (index, t, frame), stop):
+                    break
+                index += 1
+                stats["sampled"] += 1
+                next_sample = t + sampling["interval"]
+        finally:
+            capture.release()
+            for _ in range(workers):
+                _put(frames, None, stop)
+
+    def detect_frames():
+        with tagged(**tags):
+            try:
+                while not stop.is_set():
+                    try:
+                        item = frames.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if item is None:
+                        break
+                    index, t, frame = item
+                    height, width = frame.shape[:2]
+                    scale = min(1.0, VIDEO_DETECT_MAX_SIDE / float(max(height, width)))
+                    small = frame if scale == 1.0 else cv2.resize(
+                        frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA
+                    )
+                    small_rgb = np.ascontiguousarray(small[:, :, ::-1])
+                    boxes, spans = pool.submit(_detect_frame, small_rgb).result()
+                    replay(spans)
+                    boxes = [
+                        (int(top / scale), int(right / scale), int(bottom / scale), int(left / scale))
+                        for top, right, bottom, left in boxes
+                    ]
+                    if not _put(results, (index, t, frame, boxes), stop):
+                        break
+            except Exception as e:
+                _put(results, e, stop)
+            finally:
+                _put(results, None, stop)
+
+    threads = [threading.Thread(target=read_frames, name="video-reader", daemon=True)]
+    threads += [
+        threading.Thread(target=detect_frames, name=f"video-detect-{i}", daemon=True) for i in range(workers)
+    ]
+
+    active = []
+    closed = []
+    encoding_jobs = []
+    next_id = 0
+    start = time.perf_counter()
+    with span("video") as video_tags:
+        for thread in threads:
+            thread.start()
+        try:
+            # Detection threads finish out of order; samples are tracked in order
+            waiting = {}
+            expected = 0
+            finished = 0
+            while finished < workers:
+                item = results.get()
+                if item is None:
+                    finished += 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                waiting[item[0]] = item
+                while expected in waiting:
+                    _, t, frame, boxes = waiting.pop(expected)
+                    expected += 1
+
+                    for track in [tr for tr in active if t - tr.last_seen > TRACK_MAX_GAP]:
+                        active.remove(track)
+                        closed.append(track)
+                    matched, new = _associate(active, boxes)
+                    for i in new:
+                        matched[i] = _Track(next_id, boxes[i], t)
+                        active.append(matched[i])
+                        next_id += 1
+
+                    to_encode = []
+                    for i, track in matched.items():
+                        track.box = boxes[i]
+                        track.last_seen = t
+                        if track.wants_encoding(t):
+                            track.pending += 1
+                            track.last_encoded = t
+                            to_encode.append(track)
+                    if to_encode:
+                        crops = [_face_crop(frame, track.box) for track in to_encode]
+                        encoding_jobs.append((to_encode, pool.submit(_encode_crops, crops)))
+
+                    # Sample fast while there are faces to pick up, slow down once
+                    # everyone in view has been encoded
+                    if new or any(track.wants_encoding(t + ENCODE_SPACING) for track in active):
+                        sampling["interval"] = SAMPLE_INTERVAL_MIN
+                    else:
+                        sampling["interval"] = min(SAMPLE_INTERVAL_MAX,
+                                                   sampling["interval"] * SAMPLE_INTERVAL_GROWTH)
+
+            for to_encode, future in encoding_jobs:
+                encodings, spans = future.result()
+                replay(spans)
+                for track, encoding in zip(to_encode, encodings):
+                    track.pending -= 1
+                    if encoding is not None:
+                        track.encodings.append(encoding)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        tracks = [track for track in closed + active if track.encodings]
+        people = _merge_tracks(tracks)
+        video_tags["faces"] = len(people)
+
+    elapsed = time.perf_counter() - start
+    rss = peak_rss_mb()
+    print(f"Video {source}: {stats['read']} frames, {stats['sampled']} sampled"
+          + (f", {stats['dropped']} dropped" if stats["dropped"] else "")
+          + f", {next_id} tracks, {sum(len(t.encodings) for t in tracks)} encodings,"
+          + f" {len(people)} people ({stats['read'] / elapsed:.1f} frames/s"
+          + (f", peak RSS {rss:.0f} MB)" if rss is not None else ")"))
+
+    return np.asarray(people, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+
+
+def list_session_media(folder):
+    # Photos and videos of a folder, sorted by name
+    return sorted(
+        os.path.join(folder, f) for f in os.listdir(folder)
+        if f.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)
+    ) if os.path.isdir(folder) else []
+
+
+def encode_session_media(sources, pool=None, max_seconds=None):
+    # Photos, videos and cameras of one session, in record_attendance's
+    # per_photo shape: one array per photo and one per video
+    photos = [s for s in sources if not is_video(s)]
+    per_photo = encode_group_images(photos, pool=pool) if photos else []
+    per_photo += [encode_video(s, max_seconds=max_seconds, pool=pool) for s in sources if is_video(s)]
+    return per_photo